@@ -0,0 +1,106 @@
+"""Report how long each bundled Python module takes to import.
+
+R loads the modules in inst/python through reticulate (``source_python`` or
+``import_from_path``), and a spawned pool worker imports its engine module
+again before it can run a task, so module-level imports delay the start of
+every such call. This script imports each module in a fresh interpreter under
+``python -X importtime`` and reports its cumulative import time, with the
+slowest of the packages it pulls in.
+
+Usage (from the repository root):
+
+    python bench/import_time.py
+    python bench/import_time.py psd read_mat_file --repeat 5 --top 8
+
+Each module is imported ``--repeat`` times and the fastest run is reported,
+which discounts a cold file cache on the first. Modules whose dependencies are
+not installed are reported as failing rather than stopping the run.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+PYTHON_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "inst", "python")
+
+MODULES = [
+    "ifcb_pool",
+    "ifcb_reader",
+    "work_queue",
+    "psd_summary",
+    "read_mat_file",
+    "psd",
+    "extract_pngs",
+    "extract_slim_features",
+]
+
+# "import time: <self us> | <cumulative us> | <indent><module>"
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def import_times(module):
+    """Import ``module`` in a fresh interpreter and return its cumulative
+    import time and ``{direct import: cumulative time}``, in microseconds.
+    Raises RuntimeError if the import fails."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (PYTHON_DIR, env.get("PYTHONPATH")) if p)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        message = proc.stderr.strip().splitlines()
+        raise RuntimeError(message[-1] if message else "import failed")
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            entries.append((len(match.group(3)), match.group(4),
+                            int(match.group(2))))
+
+    # -X importtime lists a module after everything it imported, indented one
+    # level deeper, so the direct imports are the entries one level below the
+    # module's line back to the previous entry at its level.
+    for i in range(len(entries) - 1, -1, -1):
+        depth, name, total = entries[i]
+        if name == module:
+            break
+    else:
+        raise RuntimeError("module not found in -X importtime output")
+    deps = {}
+    for dep_depth, dep_name, dep_total in reversed(entries[:i]):
+        if dep_depth <= depth:
+            break
+        if dep_depth == depth + 2:
+            deps[dep_name] = dep_total
+    return total, deps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure import time of the bundled Python modules.")
+    parser.add_argument("modules", nargs="*", default=MODULES,
+                        help="Modules to measure (default: all bundled).")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Imports per module; the fastest is reported.")
+    parser.add_argument("--top", type=int, default=5,
+                        help="Slowest dependencies listed per module.")
+    args = parser.parse_args(argv)
+
+    for module in args.modules:
+        try:
+            runs = [import_times(module) for _ in range(max(1, args.repeat))]
+        except RuntimeError as e:
+            print(f"{module:<24} failed: {e}")
+            continue
+        total, deps = min(runs, key=lambda run: run[0])
+        print(f"{module:<24} {total / 1000:8.1f} ms")
+        for name, t in sorted(deps.items(), key=lambda d: -d[1])[:args.top]:
+            print(f"    {name:<20} {t / 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
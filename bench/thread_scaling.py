@@ -0,0 +1,144 @@
+"""Measure how extraction throughput scales with pool workers, with and
+without a limit on the native library threads inside each worker.
+
+numpy / scipy / scikit-image hand work to BLAS and OpenMP libraries that
+start a thread per core in every process, so ``N`` workers on ``N`` cores can
+end up running ``N * N`` threads. This script runs the same workload on pools
+of 1, 2, 4, ... workers twice - with the libraries left at their defaults
+(``native_threads=None``, the behaviour before the limit was added) and with
+the cores divided between the workers (``native_threads="auto"``) - and
+prints the throughput of each, so the two scaling curves can be compared.
+
+Usage (from the repository root):
+
+    python bench/thread_scaling.py
+    python bench/thread_scaling.py --workers 1 2 4 8 16 --tasks 64
+    python bench/thread_scaling.py --data /path/to/raw/bins
+
+Without ``--data`` each task is a synthetic BLAS-bound kernel (products of
+``--size`` x ``--size`` matrices), which isolates the thread contention. With
+``--data`` each run is a real ``extract_features`` over the bins in that
+directory (outputs go to a temporary directory and are discarded), reported
+in ROIs per second; it needs ifcb-features installed.
+
+Under the fork start method a worker inherits numpy's BLAS already loaded,
+and only ``threadpoolctl`` can limit it; without it the "auto" column
+matches the default one. Use ``--start-method spawn`` to measure the
+environment-variable limit alone.
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+PYTHON_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "inst", "python")
+sys.path.insert(0, PYTHON_DIR)
+
+
+def _kernel(size, repeats):
+    import numpy as np
+
+    rng = np.random.default_rng(size)
+    a = rng.random((size, size))
+    for _ in range(repeats):
+        a = a @ a
+        a /= np.abs(a).max()
+    return float(a[0, 0])
+
+
+def run_kernel(workers, native_threads, tasks, size, repeats):
+    """Run ``tasks`` kernels on a pool of ``workers`` and return tasks/s."""
+    from ifcb_pool import create_pool, threads_per_worker
+
+    pool = create_pool(workers,
+                       native_threads=threads_per_worker(workers,
+                                                         native_threads))
+    try:
+        pool.apply(_kernel, (size, 1))  # pay the pool's start-up first
+        start = time.perf_counter()
+        pool.starmap(_kernel, [(size, repeats)] * tasks)
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.terminate()
+        pool.join()
+    return tasks / elapsed
+
+
+def run_extraction(workers, native_threads, data_directory):
+    """Extract every bin in ``data_directory`` with ``workers`` workers and
+    return ROIs/s."""
+    from extract_slim_features import extract_features
+
+    scratch = tempfile.mkdtemp(prefix="irfcb_bench_")
+    try:
+        start = time.perf_counter()
+        results = extract_features(
+            data_directory, os.path.join(scratch, "features"),
+            os.path.join(scratch, "blobs"), overwrite=True,
+            num_workers=workers, native_threads=native_threads)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return sum(r.get("n_rois", 0) for r in results) / elapsed
+
+
+def main(argv=None):
+    cores = os.cpu_count() or 1
+    default_workers = sorted({1, 2, 4, 8, 16, 32, cores} & set(
+        range(1, cores + 1)))
+    parser = argparse.ArgumentParser(
+        description="Compare worker scaling with and without native thread "
+                    "limits.")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=default_workers,
+                        help="Pool sizes to measure (default: powers of two "
+                             "up to the number of cores).")
+    parser.add_argument("--data",
+                        help="Raw data directory: benchmark extract_features "
+                             "on it instead of the synthetic kernel.")
+    parser.add_argument("--tasks", type=int, default=32,
+                        help="Synthetic kernels per run (default: 32).")
+    parser.add_argument("--size", type=int, default=512,
+                        help="Matrix size of the synthetic kernel.")
+    parser.add_argument("--repeats", type=int, default=20,
+                        help="Matrix products per synthetic kernel.")
+    parser.add_argument("--start-method", choices=["fork", "spawn",
+                                                   "forkserver"],
+                        help="multiprocessing start method (default: the "
+                             "platform's).")
+    args = parser.parse_args(argv)
+
+    if args.start_method:
+        multiprocessing.set_start_method(args.start_method)
+    try:
+        import threadpoolctl  # noqa: F401
+    except ImportError:
+        if multiprocessing.get_start_method() == "fork":
+            print("note: threadpoolctl is not installed, so forked workers "
+                  "keep their inherited BLAS threads; try --start-method "
+                  "spawn")
+
+    unit = "ROIs/s" if args.data else "tasks/s"
+    print(f"{cores} cores; throughput in {unit}")
+    print(f"{'workers':>7} {'default':>10} {'auto':>10} {'threads':>8} "
+          f"{'gain':>6}")
+    for workers in args.workers:
+        row = []
+        for native_threads in (None, "auto"):
+            if args.data:
+                row.append(run_extraction(workers, native_threads, args.data))
+            else:
+                row.append(run_kernel(workers, native_threads, args.tasks,
+                                      args.size, args.repeats))
+        from ifcb_pool import threads_per_worker
+        threads = threads_per_worker(workers)
+        print(f"{workers:>7} {row[0]:>10.2f} {row[1]:>10.2f} {threads:>8} "
+              f"{row[1] / row[0]:>5.2f}x")
+
+if __name__ == "__main__":
+    main()
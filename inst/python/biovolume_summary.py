@@ -0,0 +1,412 @@
+"""Per-class counts, biovolume and carbon for many bins at once.
+
+``ifcb_summarize_biovolumes()`` in R joins each bin's feature CSV with its
+classification file one bin at a time, then aggregates the joined ROIs. With
+``parallel = TRUE`` it calls :func:`summarize_biovolumes` instead, which
+reduces each bin to one row per class in a pool worker and returns a single
+long-format table:
+
+  * ``sample``, ``classifier`` and ``class`` (None for ROIs without a class);
+  * ``counts``: the number of ROIs;
+  * ``cell_counts`` (with ``use_cell_counts``): the resolved number of cells,
+    NaN when any ROI of the class carries no chain count;
+  * ``biovolume_mm3``;
+  * ``carbon_diatom_ug`` and ``carbon_nondiatom_ug``: the class total under
+    the diatom and the non-diatom Menden-Deuer and Lessard (2000) equation,
+    since whether a class is a diatom is looked up (in WoRMS) by the caller;
+  * ``carbon_ug``, when ``diatom_classes`` names the diatom classes.
+
+The arithmetic follows ``ifcb_extract_biovolumes()``: biovolume is
+``Biovolume * micron_factor ** 3`` per ROI, carbon is converted per ROI (or
+per cell with ``carbon_conversion="cell"``), and the totals skip missing
+values. Classification files are read as R reads them: ``.mat`` through
+``read_mat_file`` (automated ``TBclass`` results, or manual ``classlist``
+files given ``class2use``), ClassiPyR ``.csv`` files with pandas, and ``.h5``
+files with ``h5py``.
+"""
+
+import os
+import re
+
+import numpy as np
+
+from ifcb_pool import create_pool
+
+#: log10(a) and b of the Menden-Deuer and Lessard (2000) relationships,
+#: log10(pgC cell^-1) = log10(a) + b * log10(V um^3).
+CARBON_EQUATIONS = {
+    'large': (-0.933, 0.881),      # diatoms > 3000 um^3 (vol2C_lgdiatom)
+    'all': (-0.541, 0.811),        # diatoms of all sizes (vol2C_diatom)
+    'nondiatom': (-0.665, 0.939),  # other protists (vol2C_nondiatom)
+}
+
+#: Volume (um^3) above which diatom_equation="auto" uses the large-diatom
+#: equation (vol2C_diatom_auto).
+LARGE_DIATOM_VOLUME = 3000
+
+_ROI = re.compile(r'_(\d+)\.png$')
+
+
+def vol2carbon(volume, equation='nondiatom'):
+    """Carbon (pg) of ``volume`` (um^3) under ``equation``: "large", "all",
+    "auto" (large above 3000 um^3, all-sizes otherwise) or "nondiatom"."""
+    volume = np.asarray(volume, dtype=np.float64)
+    if equation == 'auto':
+        return np.where(volume > LARGE_DIATOM_VOLUME,
+                        vol2carbon(volume, 'large'),
+                        vol2carbon(volume, 'all'))
+    loga, b = CARBON_EQUATIONS[equation]
+    with np.errstate(divide='ignore'):
+        return 10 ** (loga + b * np.log10(volume))
+
+
+def _carbon(volume, equation, cells=None):
+    """Per-ROI carbon; with ``cells``, converted per cell and summed over the
+    chain, a missing or non-positive count converting as one cell."""
+    if cells is None:
+        return vol2carbon(volume, equation)
+    n = np.where(np.isnan(cells) | (cells < 1), 1.0, cells)
+    return n * vol2carbon(volume / n, equation)
+
+
+def resolve_cell_counts(cell_count, single_cell_values=(-1, 0)):
+    """Map the ``single_cell_values`` of a raw chain count to one cell."""
+    cell_count = np.asarray(cell_count, dtype=np.float64)
+    return np.where(np.isin(cell_count, np.asarray(single_cell_values,
+                                                   dtype=np.float64)),
+                    1.0, cell_count)
+
+
+def _strings(value):
+    """A string, or a (nested) list of them as read_mat_file returns cell
+    arrays and char matrices, as a flat list."""
+    if value is None:
+        return []
+    if isinstance(value, (str, bytes)):
+        value = [value]
+    out = []
+    for item in np.asarray(value, dtype=object).ravel():
+        if isinstance(item, (list, np.ndarray)):
+            out.extend(_strings(item))
+        else:
+            out.append(item.decode('utf-8') if isinstance(item, bytes)
+                       else str(item))
+    return out
+
+
+def _numbers(value):
+    return np.atleast_1d(np.asarray(value, dtype=np.float64)).ravel()
+
+
+def _read_mat_classes(file_path, threshold, class2use):
+    from read_mat_file import read_mat_file
+
+    if class2use is not None:
+        # A manual file: classlist columns are named by list_titles
+        data = read_mat_file(file_path, ['classlist', 'list_titles'])
+        classlist = np.atleast_2d(np.asarray(data['classlist'],
+                                             dtype=np.float64))
+        titles = _strings(data.get('list_titles')) or ['roi number', 'manual']
+        roi = classlist[:, titles.index('roi number')]
+        manual = classlist[:, titles.index('manual')]
+        keep = ~np.isnan(manual)
+        roi, manual = roi[keep], manual[keep].astype(np.int64)
+        # A class index beyond class2use is reported as the number itself
+        classes = [class2use[m - 1] if 1 <= m <= len(class2use) else str(m)
+                   for m in manual]
+        return roi, classes, None, None
+
+    variable = ('TBclass_above_threshold' if threshold == 'opt'
+                else 'TBclass')
+    data = read_mat_file(file_path, ['roinum', variable, 'classifierName',
+                                     'cell_count'])
+    classifier = _strings(data.get('classifierName'))
+    cell_count = data.get('cell_count')
+    return (_numbers(data['roinum']), _strings(data[variable]),
+            classifier[0] if classifier else None,
+            None if cell_count is None else _numbers(cell_count))
+
+
+def _read_csv_classes(file_path, threshold):
+    import pandas as pd
+
+    table = pd.read_csv(file_path)
+    missing = [c for c in ('file_name', 'class_name')
+               if c not in table.columns]
+    if missing:
+        raise ValueError(f"not a ClassiPyR classification file (missing "
+                         f"{', '.join(missing)})")
+    roi = np.array([float(m.group(1)) if m else np.nan
+                    for m in map(_ROI.search, table['file_name'].astype(str))])
+    column = ('class_name_auto' if threshold != 'opt'
+              and 'class_name_auto' in table.columns else 'class_name')
+    cell_count = (table['cell_count'].to_numpy(dtype=np.float64)
+                  if 'cell_count' in table.columns else None)
+    classes = [None if c != c else str(c) for c in table[column]]
+    return roi, classes, None, cell_count
+
+
+def _read_h5_classes(file_path, threshold):
+    try:
+        import h5py
+    except ImportError as e:
+        raise ImportError(
+            "h5py is required to read .h5 classification files; install it "
+            "with 'pip install h5py'") from e
+
+    with h5py.File(file_path, 'r') as h5:
+        def first(*names):
+            for name in names:
+                if name in h5:
+                    return h5[name][()]
+            return None
+
+        classifier = _strings(first('classifier_name', 'classifierName'))
+        classes = (first('class_name', 'class_labels_above_threshold')
+                   if threshold == 'opt'
+                   else first('class_name_auto', 'class_labels_auto'))
+        cell_count = first('cell_count')
+        return (_numbers(h5['roi_numbers'][()]), _strings(classes),
+                classifier[0] if classifier else None,
+                None if cell_count is None else _numbers(cell_count))
+
+
+def read_classes(file_path, threshold='opt', class2use=None):
+    """Read the per-ROI classes of one classification file.
+
+    Args:
+        file_path (str): A ``.mat``, ``.h5`` or ClassiPyR ``.csv`` file.
+        threshold (str): "opt" (default) for the threshold-applied classes,
+            anything else for the winning class.
+        class2use (list, optional): Class names of a manual ``.mat`` file,
+            whose ``classlist`` holds indices into them. ROIs not annotated
+            are left out.
+
+    Returns:
+        tuple: ROI numbers (float64), class names, the classifier name (None
+        if not recorded) and the raw chain counts (None if not recorded).
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        return _read_csv_classes(file_path, threshold)
+    if extension == '.h5':
+        return _read_h5_classes(file_path, threshold)
+    return _read_mat_classes(file_path, threshold, class2use)
+
+
+def summarize_bin(sample, feature_file, class_file=None, threshold='opt',
+                  class2use=None, micron_factor=1 / 3.4,
+                  diatom_equation='large', use_cell_counts=False,
+                  single_cell_values=(-1, 0), carbon_conversion='roi',
+                  drop_zero_volume=False):
+    """Summarize one bin per class; see :func:`summarize_biovolumes`.
+
+    Returns:
+        dict: ``sample``, ``status`` ("ok", "empty" when every ROI was
+        dropped, or "error"), ``message``, ``has_cell_count``,
+        ``negative_cell_counts`` and ``rows``, a pandas.DataFrame with one row
+        per class.
+    """
+    import pandas as pd
+    from psd import read_feature_table
+
+    result = {'sample': sample, 'status': 'error', 'message': '',
+              'has_cell_count': False, 'negative_cell_counts': 0,
+              'rows': None}
+    try:
+        features = read_feature_table(feature_file,
+                                      columns=['roi_number', 'Biovolume'])
+        roi = features['roi_number'].to_numpy(dtype=np.float64)
+        volume = features['Biovolume'].to_numpy(dtype=np.float64)
+        if drop_zero_volume:
+            keep = volume != 0
+            roi, volume = roi[keep], volume[keep]
+        if roi.size == 0:
+            result['status'] = 'empty'
+            return result
+
+        frame = pd.DataFrame({'roi_number': roi, 'volume': volume})
+        classifier = None
+        if class_file is not None:
+            class_roi, classes, classifier, cell_count = read_classes(
+                class_file, threshold, class2use)
+            classes_frame = pd.DataFrame({'roi_number': class_roi,
+                                          'class': pd.Series(classes,
+                                                             dtype=object)})
+            if use_cell_counts:
+                result['has_cell_count'] = cell_count is not None
+                classes_frame['cell_count'] = (
+                    np.nan if cell_count is None else cell_count)
+            # A left join, as in R: every feature ROI is kept, unclassified
+            # ones with a missing class.
+            frame = frame.merge(classes_frame, on='roi_number', how='left')
+        else:
+            frame['class'] = None
+            if use_cell_counts:
+                frame['cell_count'] = np.nan
+        volume_um3 = frame['volume'].to_numpy() * micron_factor ** 3
+
+        cells = None
+        if use_cell_counts:
+            cells = resolve_cell_counts(frame['cell_count'],
+                                        single_cell_values)
+            result['negative_cell_counts'] = int(np.sum(cells < 0))
+        carbon_cells = cells if carbon_conversion == 'cell' else None
+
+        # Group with bincount over the class codes: one vectorized pass per
+        # column, where a DataFrame groupby costs more than reading the bin.
+        codes, classes = pd.factorize(frame['class'], use_na_sentinel=False)
+        n_classes = len(classes)
+
+        def total(values):
+            values = np.asarray(values, dtype=np.float64)
+            # Missing values are skipped, as sum(na.rm = TRUE) does in R
+            return np.bincount(codes, np.where(np.isnan(values), 0, values),
+                               minlength=n_classes)
+
+        rows = pd.DataFrame({
+            'sample': sample,
+            'classifier': pd.Series([classifier] * n_classes, dtype=object),
+            'class': pd.Series(classes, dtype=object),
+            'counts': np.bincount(codes, minlength=n_classes),
+        })
+        if use_cell_counts:
+            # NaN when any ROI of the class has no chain count, rather than
+            # counting those ROIs as zero cells.
+            missing = np.bincount(codes, np.isnan(cells), minlength=n_classes)
+            rows['cell_counts'] = np.where(missing > 0, np.nan, total(cells))
+        rows['biovolume_mm3'] = total(volume_um3 * 1e-9)
+        rows['carbon_diatom_ug'] = total(
+            _carbon(volume_um3, diatom_equation, carbon_cells) * 1e-6)
+        rows['carbon_nondiatom_ug'] = total(
+            _carbon(volume_um3, 'nondiatom', carbon_cells) * 1e-6)
+        result['rows'] = rows
+        result['status'] = 'ok'
+    except Exception as e:  # noqa: BLE001 - reported per bin
+        result['message'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def summarize_biovolumes(bins, threshold='opt', class2use=None,
+                         micron_factor=1 / 3.4, diatom_equation='large',
+                         use_cell_counts=False, single_cell_values=(-1, 0),
+                         carbon_conversion='roi', drop_zero_volume=False,
+                         diatom_classes=None, num_workers=1,
+                         use_threads=False, python_executable=None):
+    """Counts, biovolume and carbon per class for many bins.
+
+    Args:
+        bins (list): One ``(sample, feature_file, class_file)`` per bin;
+            ``class_file`` may be None, leaving every ROI without a class.
+        threshold (str): "opt" (default) for the threshold-applied classes
+            of automated results, anything else for the winning class.
+        class2use (list, optional): Class names for manual ``.mat`` files;
+            see :func:`read_classes`.
+        micron_factor (float): Microns per pixel (default 1/3.4).
+        diatom_equation (str): Diatom carbon equation: "large" (default),
+            "all" or "auto"; see :func:`vol2carbon`.
+        use_cell_counts (bool): Add ``cell_counts`` from the chain counts of
+            the classification files.
+        single_cell_values (sequence): Chain counts that mean one cell
+            (default -1 and 0).
+        carbon_conversion (str): "roi" (default) converts each ROI volume to
+            carbon; "cell" converts the volume per cell and multiplies back,
+            which needs ``use_cell_counts``.
+        drop_zero_volume (bool): Leave out ROIs with a zero ``Biovolume``.
+        diatom_classes (list, optional): Classes that are diatoms; if given,
+            a ``carbon_ug`` column picks the matching carbon total per class.
+        num_workers (int): Bins summarized at a time. 1 (default) runs
+            sequentially; more use a pool (worker processes, or threads with
+            ``use_threads``; see ``ifcb_pool.create_pool``).
+        use_threads (bool): Use a thread pool rather than processes.
+        python_executable (str, optional): Real Python interpreter for spawn
+            workers, e.g. ``reticulate::py_exe()`` from R.
+
+    Returns:
+        dict: ``data``, a pandas.DataFrame with one row per sample and class
+        (described in the module docstring), in the order of ``bins``;
+        ``errors``, sample -> message for the bins that could not be read;
+        ``empty``, the samples whose ROIs were all dropped;
+        ``without_cell_count``, with ``use_cell_counts``, the samples whose
+        classification file has no chain counts; and
+        ``negative_cell_counts``, the number of ROIs whose resolved count is
+        still negative.
+    """
+    import pandas as pd
+
+    if carbon_conversion == 'cell' and not use_cell_counts:
+        raise ValueError('carbon_conversion="cell" requires use_cell_counts')
+    if diatom_equation not in ('large', 'all', 'auto'):
+        raise ValueError(f"unknown diatom_equation {diatom_equation!r}")
+
+    options = (threshold, None if class2use is None else list(class2use),
+               float(micron_factor), diatom_equation, bool(use_cell_counts),
+               tuple(np.atleast_1d(single_cell_values).tolist()),
+               carbon_conversion, bool(drop_zero_volume))
+    tasks = [(str(sample), str(feature_file),
+              None if class_file is None else str(class_file)) + options
+             for sample, feature_file, class_file in bins]
+
+    num_workers = max(1, int(num_workers))
+    if num_workers <= 1 or len(tasks) <= 1:
+        results = [summarize_bin(*task) for task in tasks]
+    else:
+        pool = create_pool(min(num_workers, len(tasks)), use_threads,
+                           python_executable)
+        try:
+            # starmap preserves the order of the bins.
+            results = pool.starmap(summarize_bin, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    frames = [r['rows'] for r in results if r['status'] == 'ok']
+    columns = ['sample', 'classifier', 'class', 'counts']
+    if use_cell_counts:
+        columns.append('cell_counts')
+    columns += ['biovolume_mm3', 'carbon_diatom_ug', 'carbon_nondiatom_ug']
+    data = (pd.concat(frames, ignore_index=True)[columns] if frames
+            else pd.DataFrame({column: [] for column in columns}))
+    if diatom_classes is not None:
+        is_diatom = data['class'].isin(list(diatom_classes)).to_numpy()
+        data['carbon_ug'] = np.where(is_diatom, data['carbon_diatom_ug'],
+                                     data['carbon_nondiatom_ug'])
+
+    return {
+        'data': data,
+        'errors': {r['sample']: r['message'] for r in results
+                   if r['status'] == 'error'},
+        'empty': [r['sample'] for r in results if r['status'] == 'empty'],
+        'without_cell_count': [r['sample'] for r in results
+                               if use_cell_counts and r['status'] == 'ok'
+                               and not r['has_cell_count']],
+        'negative_cell_counts': sum(r['negative_cell_counts']
+                                    for r in results),
+    }
+
+
+def r_summarize_biovolumes(samples, feature_files, class_files, **kwargs):
+    """
+    Wrapper function to be used in R via reticulate.
+
+    Takes the bins as three parallel vectors (``class_files`` entries may be
+    None) and returns ``data`` as a dict of one typed NumPy array per column,
+    which R converts in bulk, with a missing class or classifier as None.
+    """
+    import pandas as pd
+
+    if isinstance(samples, str):
+        samples, feature_files, class_files = ([samples], [feature_files],
+                                               [class_files])
+    result = summarize_biovolumes(zip(samples, feature_files, class_files),
+                                  **kwargs)
+    data = result['data']
+    columns = {}
+    for name, values in data.items():
+        if pd.api.types.is_numeric_dtype(values):
+            columns[name] = np.ascontiguousarray(
+                values.to_numpy(dtype=np.float64))
+        else:
+            columns[name] = [None if pd.isna(v) else str(v) for v in values]
+    result['data'] = columns
+    return result
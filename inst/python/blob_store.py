@@ -0,0 +1,337 @@
+"""Packed blob stores: every blob mask of a bin (or a day) in one indexed file.
+
+``extract_slim_features`` writes blobs, by default, as the upstream
+``<lid>_blobs_v4.zip``: one PNG per ROI. Reading a single mask back means
+opening the archive, parsing its central directory and inflating a PNG, and
+an archive of millions of small zips is hard on the filesystem. With
+``blob_format="packed"`` a bin's masks are written instead to
+``<lid>_blobs_v4.pack``, which :class:`BlobStore` reads by ROI number with
+one index lookup and one read; :func:`convert_zips` packs existing archives,
+one file per bin or per day (``DYYYYMMDD_blobs_v4.pack``).
+
+A pack is laid out as::
+
+    magic | mask records ... | index | lid table | footer
+
+  * ``magic`` is the 8 bytes ``IFCBBLB1``;
+  * each mask record is the mask's pixels, one bit each in row-major order
+    (``numpy.packbits``), compressed with zlib;
+  * the index holds one ``INDEX_DTYPE`` entry per mask - position in the lid
+    table, ROI number, offset and length of its record, and the mask's height
+    and width - sorted by lid and ROI number, so a mask is found by binary
+    search;
+  * the lid table is a JSON list of the bins in the file;
+  * the footer (``FOOTER``) gives the offset of the index, the number of
+    entries and the length of the lid table, and repeats the magic, so a
+    truncated file is recognised rather than misread.
+
+Packs are written under a temporary name and moved into place when complete,
+like every other output of the extraction.
+"""
+
+import json
+import mmap
+import os
+import re
+import struct
+import uuid
+import zipfile
+import zlib
+
+import numpy as np
+
+#: Leading and trailing bytes of a pack.
+MAGIC = b'IFCBBLB1'
+
+#: One index entry per mask; little-endian so packs move between hosts.
+INDEX_DTYPE = np.dtype([('lid', '<u4'), ('roi', '<u4'), ('offset', '<u8'),
+                        ('length', '<u4'), ('height', '<u4'),
+                        ('width', '<u4')])
+
+#: Index offset, number of entries, lid table length, magic.
+FOOTER = struct.Struct('<QQQ8s')
+
+#: File name suffix of a pack.
+PACK_SUFFIX = '_blobs_v4.pack'
+
+_MEMBER = re.compile(r'^(D\d{8}T\d{6}_IFCB\d+)_(\d+)\.png$')
+
+
+def pack_path(directory, name):
+    """Return the path of the pack for ``name``, a bin lid or a day
+    (``DYYYYMMDD``)."""
+    return os.path.join(directory, f"{name}{PACK_SUFFIX}")
+
+
+def find_pack(directory, lid):
+    """Return the path of the pack in ``directory`` holding bin ``lid``: its
+    own pack if there is one, otherwise its day's. Raises KeyError if
+    neither exists."""
+    for name in (lid, lid[:9]):
+        path = pack_path(directory, name)
+        if os.path.exists(path):
+            return path
+    raise KeyError(lid)
+
+
+def _keys(lid_positions, rois):
+    return (np.asarray(lid_positions, dtype=np.uint64) << np.uint64(32)) | \
+        np.asarray(rois, dtype=np.uint64)
+
+
+class BlobStoreWriter:
+    """Write blob masks to a new pack at ``path``.
+
+    Use as a context manager: the pack is moved into place when the block
+    exits normally and discarded if it raises. Masks may be added in any
+    order; adding the same ROI of a bin twice raises ValueError.
+
+    Args:
+        path (str): Pack to write; replaced if it exists.
+        level (int): zlib compression level of the mask records.
+    """
+
+    def __init__(self, path, level=6):
+        self.path = path
+        self.level = level
+        self._tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(MAGIC)
+        self._offset = len(MAGIC)
+        self._lids = {}
+        self._entries = []
+        self._seen = set()
+
+    def add(self, lid, roi_number, mask):
+        """Add the mask of ROI ``roi_number`` of bin ``lid``; any non-zero
+        pixel is part of the blob."""
+        mask = np.asarray(mask)
+        if mask.ndim != 2:
+            raise ValueError(f"mask must be 2-D, not {mask.ndim}-D")
+        position = self._lids.setdefault(str(lid), len(self._lids))
+        roi_number = int(roi_number)
+        if (position, roi_number) in self._seen:
+            raise ValueError(f"duplicate mask: {lid} ROI {roi_number}")
+        self._seen.add((position, roi_number))
+
+        record = zlib.compress(np.packbits(mask.ravel() != 0).tobytes(),
+                               self.level)
+        self._file.write(record)
+        self._entries.append((position, roi_number, self._offset, len(record),
+                              mask.shape[0], mask.shape[1]))
+        self._offset += len(record)
+
+    def close(self):
+        """Write the index and footer and move the pack into place."""
+        index = np.array(self._entries, dtype=INDEX_DTYPE)
+        index = index[np.argsort(_keys(index['lid'], index['roi']),
+                                 kind='stable')]
+        lids = json.dumps(list(self._lids)).encode('utf-8')
+        self._file.write(index.tobytes())
+        self._file.write(lids)
+        self._file.write(FOOTER.pack(self._offset, len(index), len(lids),
+                                     MAGIC))
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Discard the pack being written."""
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class BlobStore:
+    """Read blob masks from a pack by bin and ROI number.
+
+    The file is memory-mapped, so reading a mask costs an index lookup and
+    the decompression of that mask alone. Use as a context manager, or call
+    :meth:`close`.
+
+    Args:
+        path (str): A pack written by :class:`BlobStoreWriter`.
+
+    Raises:
+        ValueError: if ``path`` is not a complete pack.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            if size < len(MAGIC) + FOOTER.size:
+                raise ValueError(f"not a blob pack: {path}")
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            index_offset, n_entries, lids_length, magic = FOOTER.unpack(
+                self._map[size - FOOTER.size:])
+            if self._map[:len(MAGIC)] != MAGIC or magic != MAGIC:
+                raise ValueError(f"not a blob pack, or truncated: {path}")
+            lids_offset = index_offset + n_entries * INDEX_DTYPE.itemsize
+            self._index = np.frombuffer(
+                self._map[index_offset:lids_offset], dtype=INDEX_DTYPE)
+            self._lids = json.loads(
+                self._map[lids_offset:lids_offset + lids_length])
+        except BaseException:
+            self.close()
+            raise
+        self._positions = {lid: i for i, lid in enumerate(self._lids)}
+        self._keys = _keys(self._index['lid'], self._index['roi'])
+
+    def lids(self):
+        """Bins in the pack."""
+        return list(self._lids)
+
+    def _position(self, lid):
+        if lid is None:
+            if len(self._lids) != 1:
+                raise ValueError(f"{self.path} holds {len(self._lids)} bins; "
+                                 f"give the lid")
+            return 0
+        try:
+            return self._positions[str(lid)]
+        except KeyError:
+            raise KeyError(lid) from None
+
+    def _rows(self, position):
+        start, stop = np.searchsorted(
+            self._keys, _keys([position, position + 1], [0, 0]))
+        return self._index[start:stop]
+
+    def rois(self, lid=None):
+        """ROI numbers with a mask in bin ``lid``, ascending. ``lid`` may be
+        omitted for a pack of one bin."""
+        return self._rows(self._position(lid))['roi'].astype(np.int64)
+
+    def _decode(self, entry):
+        offset = int(entry['offset'])
+        height, width = int(entry['height']), int(entry['width'])
+        bits = np.frombuffer(zlib.decompress(
+            self._map[offset:offset + int(entry['length'])]), dtype=np.uint8)
+        return np.unpackbits(bits, count=height * width).reshape(
+            height, width).astype(bool)
+
+    def mask(self, roi_number, lid=None):
+        """Return the mask of ROI ``roi_number`` as a boolean array.
+
+        ``lid`` may be omitted for a pack of one bin. Raises KeyError if the
+        pack has no mask for the ROI (compute_features failed on it, or it is
+        not in the bin).
+        """
+        position = self._position(lid)
+        key = _keys(position, roi_number)
+        row = int(np.searchsorted(self._keys, key))
+        if row == len(self._keys) or self._keys[row] != key:
+            raise KeyError((self._lids[position], roi_number))
+        return self._decode(self._index[row])
+
+    def masks(self, lid=None):
+        """Return ``{roi_number: mask}`` for every ROI of bin ``lid``."""
+        return {int(entry['roi']): self._decode(entry)
+                for entry in self._rows(self._position(lid))}
+
+    def __len__(self):
+        return len(self._index)
+
+    def close(self):
+        """Release the file."""
+        if getattr(self, '_map', None) is not None:
+            self._index = None
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def convert_zips(blobs_directory, output_directory, per="bin",
+                 overwrite=False):
+    """Pack the ``<lid>_blobs_v4.zip`` archives in ``blobs_directory``.
+
+    Args:
+        blobs_directory (str): Directory of blob archives (searched
+            recursively).
+        output_directory (str): Directory the packs are written to; created
+            if it does not exist.
+        per (str): ``"bin"`` writes one ``<lid>_blobs_v4.pack`` per archive;
+            ``"day"`` writes one ``DYYYYMMDD_blobs_v4.pack`` per day, holding
+            every bin of that day.
+        overwrite (bool): Replace existing packs instead of skipping them.
+
+    Returns:
+        list[str]: Paths of the packs written.
+    """
+    from PIL import Image
+
+    if per not in ("bin", "day"):
+        raise ValueError(f"per must be 'bin' or 'day', not {per!r}")
+    archives = {}
+    for folder, _, files in os.walk(blobs_directory):
+        for file_name in files:
+            if file_name.endswith('_blobs_v4.zip'):
+                lid = file_name[:-len('_blobs_v4.zip')]
+                archives[lid] = os.path.join(folder, file_name)
+
+    groups = {}
+    for lid in sorted(archives):
+        groups.setdefault(lid if per == "bin" else lid[:9], []).append(lid)
+
+    os.makedirs(output_directory, exist_ok=True)
+    written = []
+    for name, lids in groups.items():
+        path = pack_path(output_directory, name)
+        if not overwrite and os.path.exists(path):
+            continue
+        with BlobStoreWriter(path) as writer:
+            for lid in lids:
+                with zipfile.ZipFile(archives[lid]) as zf:
+                    for member in zf.namelist():
+                        match = _MEMBER.match(os.path.basename(member))
+                        if not match:
+                            continue
+                        with zf.open(member) as f:
+                            mask = np.asarray(Image.open(f))
+                        writer.add(match.group(1), int(match.group(2)), mask)
+        written.append(path)
+    return written
+
+
+def _main(argv=None):
+    """Command-line entry point: pack a directory of blob archives.
+
+    Call explicitly, as for ``extract_slim_features._main``, e.g.
+    ``python -c "import blob_store; blob_store._main()" blobs/ packs/``.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Pack IFCB blob archives (*_blobs_v4.zip) into indexed "
+                    "blob packs.")
+    parser.add_argument("blobs_directory",
+                        help="Directory of *_blobs_v4.zip archives.")
+    parser.add_argument("output_directory",
+                        help="Directory to write *_blobs_v4.pack files to.")
+    parser.add_argument("--per", choices=["bin", "day"], default="bin",
+                        help="One pack per bin (default) or per day.")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="Replace existing packs instead of skipping.")
+    args = parser.parse_args(argv)
+    written = convert_zips(args.blobs_directory, args.output_directory,
+                           per=args.per, overwrite=args.overwrite)
+    print(f"Packs written: {len(written)}")
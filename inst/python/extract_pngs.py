@@ -0,0 +1,447 @@
+"""Export IFCB region-of-interest images as PNG files or ZIP archives.
+
+This module is bundled with the R package 'iRfcb' as a Python counterpart to
+ifcb_extract_pngs(), for exports too large to run one bin at a time in R. It
+reads raw bins through the ``ifcb_reader`` adapter (so either the ``ifcbkit``
+or the ``pyifcb`` backend can be used, as in ``extract_slim_features``) and
+encodes PNGs in a worker pool that is polled incrementally, like
+``extract_slim_features.ParallelExtractor``.
+
+Images are rendered as ifcb_extract_pngs() renders them: raw pixel values by
+default, with optional min-max ``normalize``, ``gamma`` correction and a scale
+bar drawn at the same position and size. Each PNG is named
+``<lid>_<roi:05d>.png`` and goes to an output folder named after the ROI's
+class, when classes are given, or otherwise after its bin.
+
+Output is written either as individual files (``<out>/<folder>/<png>``) or,
+with ``archive`` set, as one ``<out>/<folder>.zip`` per folder. Existing
+outputs are skipped unless ``overwrite`` is requested: per file, or per archive
+member. Archives cannot have members replaced in place, so with ``overwrite``
+an archive this run writes to is recreated from scratch.
+
+In archive mode a per-class archive collects ROIs from many bins, which the
+workers process concurrently. Workers therefore only encode the PNGs; the
+polling side (:meth:`PngExporter.poll`) appends them to the archives, so each
+archive has a single writer.
+"""
+
+import io
+import os
+import time
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+# Sibling modules, imported at module scope so they resolve while this file's
+# directory is still on sys.path (reticulate's import_from_path puts it there
+# only for the duration of the import).
+from ifcb_pool import create_pool
+from ifcb_reader import init_worker_reader, shared_reader, worker_reader
+
+#: Valid scale bar positions, as accepted by ifcb_extract_pngs().
+SCALE_BAR_POSITIONS = ("topright", "topleft", "bottomright", "bottomleft")
+
+
+def _png_name(lid, roi_number):
+    return f"{lid}_{int(roi_number):05d}.png"
+
+
+def _render(image, gamma=1, normalize=False, scale_bar_px=None,
+            scale_bar_position="bottomright", scale_bar_color="black"):
+    """Render one ROI as ifcb_extract_pngs() does.
+
+    Pixels are scaled to [0, 1], min-max stretched when ``normalize`` is set,
+    gamma corrected, and returned as 8-bit values. The scale bar geometry
+    mirrors the R implementation, translated from its 1-based inclusive
+    indices.
+
+    Returns:
+        tuple: (uint8 array, bool telling whether a requested scale bar was
+        left out because it is too long for the image).
+
+    Raises:
+        ValueError: if ``normalize`` is set and the image has a single value,
+            which leaves nothing to stretch.
+    """
+    pixels = np.asarray(image, dtype=np.float64)
+    height, width = pixels.shape
+
+    if normalize:
+        low, high = pixels.min(), pixels.max()
+        if high == low:
+            raise ValueError("image has a single pixel value and cannot be "
+                             "normalized")
+        pixels = (pixels - low) / (high - low)
+    else:
+        pixels = pixels / 255
+
+    if gamma != 1:
+        pixels = pixels ** gamma
+
+    no_scale_bar = False
+    if scale_bar_px is not None:
+        if scale_bar_px >= width:
+            no_scale_bar = True
+        else:
+            bar_height = max(2, round(0.02 * height))
+            if scale_bar_position in ("bottomright", "topright"):
+                x1 = width - scale_bar_px - 4
+            else:
+                x1 = 4
+            if scale_bar_position in ("bottomright", "bottomleft"):
+                y1 = height - bar_height - 3
+            else:
+                y1 = 4
+            x2 = min(x1 + scale_bar_px, width)
+            y2 = min(y1 + bar_height, height)
+            x1 = max(1, x1)
+            y1 = max(1, y1)
+            pixels[y1 - 1:y2, x1 - 1:x2] = 0 if scale_bar_color == "black" else 1
+
+    return np.rint(pixels * 255).astype(np.uint8), no_scale_bar
+
+
+def _encode_png(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _export_bin(data_directory, out_folder, lid, rois, folders, overwrite,
+                archive, skip_members, render_options, backend=None):
+    """Render and write (or, in archive mode, return) the PNGs of one bin.
+
+    A module-level function so it can be pickled and dispatched to a pool
+    worker. Bins are read through the worker's reader, opened by the pool
+    initializer and reused across bins, as ``_process_bin`` does in
+    ``extract_slim_features`` (see ``ifcb_reader.worker_reader``).
+
+    Args:
+        data_directory (str): Raw IFCB data directory.
+        out_folder (str): Root output directory.
+        lid (str): Bin lid.
+        rois (list or None): ROI numbers to export, or None for every ROI.
+        folders (list or str): Output folder name per entry of ``rois``, or a
+            single name for every ROI of the bin.
+        overwrite (bool): Replace existing PNG files (file mode only; archive
+            skipping is decided by the caller via ``skip_members``).
+        archive (bool): Return the encoded PNGs instead of writing files.
+        skip_members (set): PNG names already present in the target archives.
+        render_options (dict): Keyword arguments for :func:`_render`.
+        backend (str, optional): Force a raw-data reader.
+
+    Returns:
+        dict: ``bin``, ``status`` ("processed", "skipped" or "error"),
+        ``message``, counts ``written``, ``skipped``, ``failed`` and
+        ``no_scale_bar``, and in archive mode ``members``, a dict of folder ->
+        list of (PNG name, bytes).
+    """
+    result = {"bin": lid, "status": "processed", "message": "", "written": 0,
+              "skipped": 0, "failed": 0, "no_scale_bar": 0}
+    if archive:
+        result["members"] = {}
+
+    def target(roi_number, folder):
+        name = _png_name(lid, roi_number)
+        if archive:
+            return name, name in skip_members
+        path = os.path.join(out_folder, folder, name)
+        return path, os.path.exists(path) and not overwrite
+
+    # When the ROIs are listed up front, a bin whose outputs all exist is
+    # skipped without being read at all.
+    if rois is not None:
+        if isinstance(folders, str):
+            folders = [folders] * len(rois)
+        wanted = []
+        for roi_number, folder in zip(rois, folders):
+            if target(roi_number, folder)[1]:
+                result["skipped"] += 1
+            else:
+                wanted.append((int(roi_number), folder))
+        if not wanted:
+            result.update(status="skipped", message="outputs already exist")
+            return result
+
+    try:
+        reader = worker_reader(data_directory, backend)
+        try:
+            images = reader.read_images(lid)
+        except KeyError:
+            # The reader may predate the bin; look again before reporting it
+            # missing.
+            reader = worker_reader(data_directory, backend, refresh=True)
+            images = reader.read_images(lid)
+        if rois is None:
+            # Materialised here so a truncated .roi fails inside this block;
+            # see extract_slim_features._process_bin.
+            items = [(number, image, folders)
+                     for number, image in images.items()]
+        else:
+            items = []
+            for number, folder in wanted:
+                try:
+                    items.append((number, images[number], folder))
+                except KeyError:
+                    # Zero-sized ROIs carry no image, as in ifcb_extract_pngs().
+                    continue
+    except KeyError:
+        result.update(status="error", message="bin not found in data directory")
+        return result
+    except Exception as e:  # noqa: BLE001 - report any access failure to R
+        result.update(status="error", message=str(e))
+        return result
+
+    if rois is None and not items:
+        result.update(status="error", message="no ROIs found in bin")
+        return result
+
+    for number, image, folder in items:
+        destination, exists = target(number, folder)
+        if rois is None and exists:
+            result["skipped"] += 1
+            continue
+        try:
+            pixels, no_scale_bar = _render(image, **render_options)
+            data = _encode_png(pixels)
+        except Exception as e:  # noqa: BLE001 - skip a bad ROI, keep the rest
+            result["failed"] += 1
+            result["message"] = f"Failed to extract ROI {number}: {e}"
+            continue
+        result["no_scale_bar"] += no_scale_bar
+
+        if archive:
+            result["members"].setdefault(folder, []).append((destination, data))
+        else:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with open(destination, "wb") as f:
+                f.write(data)
+        result["written"] += 1
+
+    if result["written"] == 0 and result["failed"] == 0:
+        result.update(status="skipped", message="outputs already exist")
+    return result
+
+
+def _normalize_plan(bins, rois, classes):
+    """Return (lid, rois, folders) tasks from the caller's selection.
+
+    ``rois`` and ``classes`` are dicts keyed by bin lid. A bin missing from
+    ``rois`` exports every ROI; ``classes`` maps a bin to one class name, or to
+    a list of names parallel to its ROI list. Without a class, PNGs go to a
+    folder named after the bin.
+    """
+    rois = rois or {}
+    classes = classes or {}
+    plan = []
+    for lid in bins:
+        bin_rois = rois.get(lid)
+        if bin_rois is not None and not isinstance(bin_rois, (list, tuple)):
+            # reticulate passes a length-1 R vector as a scalar.
+            bin_rois = [bin_rois]
+        bin_rois = None if bin_rois is None else [int(r) for r in bin_rois]
+        folders = classes.get(lid, lid)
+        if not isinstance(folders, str):
+            folders = [str(f) for f in folders]
+            if bin_rois is None or len(folders) != len(bin_rois):
+                raise ValueError(
+                    f"classes for bin {lid} must be a single name or one name "
+                    f"per ROI listed in rois")
+        plan.append((lid, bin_rois, folders))
+    return plan
+
+
+class PngExporter:
+    """Export the ROIs of many bins as PNGs across pool workers.
+
+    Bins are submitted to a pool up front; completed results are retrieved
+    non-blockingly via :meth:`poll`, so the caller (the R wrapper) drives the
+    loop and can stop the workers via :meth:`terminate`, as with
+    ``extract_slim_features.ParallelExtractor``. The pool is a process pool by
+    default, or a thread pool when ``use_threads`` is set; PIL and numpy
+    release the GIL while encoding, so threads still parallelise the work.
+
+    Args:
+        data_directory (str): Path to the raw IFCB data directory.
+        out_folder (str): Root directory for the PNG folders or archives.
+            Created if it does not exist.
+        bins (list): Bin lids to export.
+        rois (dict, optional): Bin lid -> ROI numbers to export. Bins not
+            listed export every ROI with an image.
+        classes (dict, optional): Bin lid -> class name, or a list of names
+            parallel to that bin's ROI numbers in ``rois``. PNGs go to a folder
+            (or archive) named after their class, or otherwise after their bin.
+        archive (bool): Write one ZIP archive per folder instead of files.
+        overwrite (bool): Replace existing PNGs instead of skipping them.
+        gamma (float): Gamma correction, as in ifcb_extract_pngs().
+        normalize (bool): Min-max stretch each image.
+        scale_bar_um (float, optional): Scale bar length in micrometers.
+        scale_micron_factor (float): Micrometers per pixel.
+        scale_bar_position (str): One of :data:`SCALE_BAR_POSITIONS`.
+        scale_bar_color (str): ``"black"`` or ``"white"``.
+        num_workers (int): Number of pool workers.
+        python_executable (str, optional): Real Python interpreter for spawn
+            workers; see ``ifcb_pool.ensure_spawn_executable``.
+        use_threads (bool): Use a thread pool instead of a process pool.
+        backend (str, optional): Force a specific raw-data reader.
+    """
+
+    def __init__(self, data_directory, out_folder, bins, rois=None,
+                 classes=None, archive=False, overwrite=False, gamma=1,
+                 normalize=False, scale_bar_um=None, scale_micron_factor=1/3.4,
+                 scale_bar_position="bottomright", scale_bar_color="black",
+                 num_workers=2, python_executable=None, use_threads=False,
+                 backend=None):
+        if scale_bar_position not in SCALE_BAR_POSITIONS:
+            raise ValueError(
+                f"scale_bar_position must be one of "
+                f"{', '.join(SCALE_BAR_POSITIONS)}; got {scale_bar_position!r}")
+        if scale_bar_color not in ("black", "white"):
+            raise ValueError(
+                f"scale_bar_color must be 'black' or 'white'; "
+                f"got {scale_bar_color!r}")
+        os.makedirs(out_folder, exist_ok=True)
+
+        if isinstance(bins, str):
+            bins = [bins]
+        plan = _normalize_plan([str(b) for b in bins], rois, classes)
+        self.total = len(plan)
+        self.archive = bool(archive)
+        self._out_folder = out_folder
+
+        scale_bar_px = None
+        if scale_bar_um is not None and scale_micron_factor is not None:
+            scale_bar_px = int(round(scale_bar_um / scale_micron_factor))
+        render_options = {"gamma": gamma, "normalize": bool(normalize),
+                          "scale_bar_px": scale_bar_px,
+                          "scale_bar_position": scale_bar_position,
+                          "scale_bar_color": scale_bar_color}
+
+        # Archive mode: open every target archive once, up front, so existing
+        # members can be skipped and each archive has a single writer.
+        self._archives = {}
+        existing = {}
+        if self.archive:
+            for _, _, folders in plan:
+                names = [folders] if isinstance(folders, str) else folders
+                for folder in names:
+                    if folder in self._archives:
+                        continue
+                    path = os.path.join(out_folder, f"{folder}.zip")
+                    if overwrite and os.path.exists(path):
+                        os.remove(path)
+                    archive_file = zipfile.ZipFile(path, 'a')
+                    for name in archive_file.namelist():
+                        # Members are named <lid>_<roi>.png; index them by lid.
+                        existing.setdefault(name.rsplit('_', 1)[0],
+                                            set()).add(name)
+                    self._archives[folder] = archive_file
+
+        # Each worker keeps one reader for its bins; archives are indexed
+        # once, here, and the index handed to the workers.
+        self.pool = create_pool(num_workers, use_threads, python_executable,
+                                initializer=init_worker_reader,
+                                initargs=(data_directory, backend,
+                                          shared_reader(data_directory,
+                                                        backend)))
+        self._pending = [
+            (lid, self.pool.apply_async(
+                _export_bin,
+                (data_directory, out_folder, lid, bin_rois, folders, overwrite,
+                 self.archive, existing.get(lid, set()), render_options,
+                 backend)))
+            for lid, bin_rois, folders in plan
+        ]
+
+    def _store(self, result):
+        # Append a finished bin's PNGs to their archives (archive mode).
+        for folder, members in result.pop("members", {}).items():
+            archive_file = self._archives[folder]
+            for name, data in members:
+                archive_file.writestr(name, data)
+
+    def poll(self):
+        """Return a list of result dicts for bins that have finished since the
+        last call (non-blocking). In archive mode their PNGs have been written
+        to the archives by the time they are returned."""
+        done = []
+        still_pending = []
+        for lid, async_result in self._pending:
+            if async_result.ready():
+                try:
+                    result = async_result.get()
+                    self._store(result)
+                except Exception as e:  # noqa: BLE001 - surface worker crash
+                    result = {"bin": lid, "status": "error", "message": str(e),
+                              "written": 0, "skipped": 0, "failed": 0,
+                              "no_scale_bar": 0}
+                done.append(result)
+            else:
+                still_pending.append((lid, async_result))
+        self._pending = still_pending
+        if not self._pending:
+            self._close_archives()
+        return done
+
+    def remaining(self):
+        """Number of bins not yet collected."""
+        return len(self._pending)
+
+    def _close_archives(self):
+        for archive_file in self._archives.values():
+            try:
+                archive_file.close()
+            except Exception:  # noqa: BLE001 - closing must never raise
+                pass
+        self._archives = {}
+
+    def terminate(self):
+        """Stop the pool immediately, discarding pending work, and close any
+        open archives (keeping the members written so far)."""
+        try:
+            self.pool.terminate()
+            self.pool.join()
+        except Exception:  # noqa: BLE001 - terminate must never raise
+            pass
+        self._close_archives()
+
+
+def export_pngs(data_directory, out_folder, bins, rois=None, classes=None,
+                archive=False, overwrite=False, gamma=1, normalize=False,
+                scale_bar_um=None, scale_micron_factor=1/3.4,
+                scale_bar_position="bottomright", scale_bar_color="black",
+                num_workers=1, progress=None, python_executable=None,
+                use_threads=False, backend=None):
+    """Export ROI images of IFCB bins as PNGs and poll the export to completion.
+
+    Takes the arguments of :class:`PngExporter`, plus ``progress``, called as
+    ``progress(done, total)`` after each bin completes. ``num_workers`` of 1
+    (the default) still runs through a single-worker pool, which keeps the
+    archive writing in one place.
+
+    Returns:
+        list[dict]: One result dict per bin; see :func:`_export_bin`.
+    """
+    exporter = PngExporter(data_directory, out_folder, bins, rois=rois,
+                           classes=classes, archive=archive,
+                           overwrite=overwrite, gamma=gamma,
+                           normalize=normalize, scale_bar_um=scale_bar_um,
+                           scale_micron_factor=scale_micron_factor,
+                           scale_bar_position=scale_bar_position,
+                           scale_bar_color=scale_bar_color,
+                           num_workers=num_workers,
+                           python_executable=python_executable,
+                           use_threads=use_threads, backend=backend)
+    results = []
+    try:
+        while exporter.remaining() > 0:
+            for result in exporter.poll():
+                results.append(result)
+                if progress is not None:
+                    progress(len(results), exporter.total)
+            if exporter.remaining() > 0:
+                time.sleep(0.05)
+    finally:
+        exporter.terminate()
+    return results
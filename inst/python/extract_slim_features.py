@@ -12,7 +12,8 @@ extract_slim_features.py from https://github.com/WHOIGit/ifcb-features so that:
   * raw data is read through the ``ifcb_reader`` adapter, so either the
     ``ifcbkit`` backend (ifcb-features >= 1.1.0) or the ``pyifcb`` backend
     (ifcb-features <= 1.0.0) can be used; ``backend`` forces one when both are
-    installed,
+    installed, and ``backend="archive"`` reads bins straight from ZIP / tar
+    archives (see ``ifcb_archive``),
   * a bin that cannot be read is reported as a per-bin error rather than
     aborting the run, so one corrupt file does not discard the results of every
     bin already processed, and
@@ -23,7 +24,8 @@ Per-bin outputs are the upstream pair: a ``<lid>_features_v4.csv`` table (30
 morphological features per ROI) and a ``<lid>_blobs_v4.zip`` archive of 1-bit
 blob masks (one PNG per ROI). Passing ``feature_tag="fea"`` renames the feature
 table to ``<lid>_fea_v4.csv``, the name the IFCB Dashboard looks for; the blob
-archive name is unaffected.
+archive name is unaffected. ``blob_format="packed"`` writes the masks to an
+indexed ``<lid>_blobs_v4.pack`` instead of the zip (see ``blob_store``).
 
 Feature values match upstream. Where ifcb-features returns a complex number -
 it does from numpy 2.3 onwards - the real part is taken, which reproduces the
@@ -33,65 +35,40 @@ release is installed.
 """
 
 import argparse
+import asyncio
+import collections
+import csv
 import io
-import multiprocessing
+import json
 import os
-import sys
+import re
+import threading
 import time
 import warnings
 import zipfile
 
 import numpy as np
-import pandas as pd
-from PIL import Image
 
-from ifcb_features.all import compute_features
+# pandas, PIL and ifcb_features.all (which loads scikit-image) are imported in
+# the functions that use them: together they take seconds to import, which R
+# would otherwise wait through before list_bins() could start scanning, and a
+# spawned worker before it could unpickle its first task. Pool workers import
+# them in _init_worker.
 
-# Sibling module, imported at module scope so it resolves while this file's
+# Sibling modules, imported at module scope so they resolve while this file's
 # directory is still on sys.path (reticulate's import_from_path puts it there
 # only for the duration of the import).
-from ifcb_reader import open_data_directory
-
-
-def _ensure_module_importable():
-    """Add this module's directory to PYTHONPATH if needed.
-
-    On Linux, multiprocessing uses fork and workers inherit sys.path, so
-    extract_slim_features is already importable. On Windows and macOS,
-    multiprocessing uses spawn: workers start as fresh Python processes and
-    only inherit environment variables, not sys.path. Setting PYTHONPATH here
-    (before Pool() starts the workers) ensures spawn workers can import this
-    module to unpickle _process_bin.
-    """
-    module_dir = os.path.dirname(os.path.abspath(__file__))
-    current = os.environ.get('PYTHONPATH', '')
-    parts = [p for p in current.split(os.pathsep) if p]
-    if module_dir not in parts:
-        os.environ['PYTHONPATH'] = os.pathsep.join([module_dir] + parts)
-
-
-def _ensure_spawn_executable(python_executable=None):
-    """Point multiprocessing at a real Python interpreter for spawn workers.
-
-    Companion to _ensure_module_importable(). On Windows and macOS,
-    multiprocessing uses spawn, which relaunches the interpreter named by
-    sys.executable to start each worker. When Python is embedded in another
-    program - as it is here, running inside R via reticulate - sys.executable
-    often points at the host process (e.g. Rterm.exe / the R binary), not a
-    usable Python. Spawn workers are then launched as the wrong process, never
-    run the bootstrap, and the apply_async results never become ready(): the
-    polling loop hangs forever with no error or warning.
-
-    Setting the multiprocessing executable to the actual interpreter fixes this.
-    The path is supplied by the R caller via reticulate::py_exe(); if it is not
-    given we fall back to sys.executable. Under fork (Linux) nothing is
-    relaunched, so this is a no-op there.
-    """
-    if multiprocessing.get_start_method(allow_none=False) == 'fork':
-        return
-    exe = python_executable or sys.executable
-    if exe and os.path.exists(exe):
-        multiprocessing.set_executable(exe)
+from blob_store import BlobStoreWriter, pack_path
+from ifcb_pool import create_pool, limit_native_threads, threads_per_worker
+from ifcb_reader import (drop_worker_reader, find_raw_files,
+                         init_worker_reader, open_data_directory,
+                         shared_reader, worker_reader)
+from psd_summary import (count_triggers, parse_header, summarize, summary_path,
+                         write_summary)
+from run_metrics import MetricsExporter
+from work_queue import SharedWorkQueue
+from worker_control import (MemoryBudget, WorkerController, current_rss,
+                            in_worker_process, peak_rss, reset_peak_rss)
 
 
 # ifcb_features/blob_geometry.py hits divide-by-zero when computing the
@@ -168,6 +145,35 @@ FEATURE_COLUMNS = [
     'summedConvexPerimeter_over_Perimeter',
 ]
 
+# The columns psd.Sample reads from a feature CSV. Passing these as
+# ``columns`` to extract_features writes everything a particle size
+# distribution needs, without the blob archive.
+PSD_COLUMNS = [
+    'Biovolume',
+    'EquivDiameter',
+    'MajorAxisLength',
+    'MinorAxisLength',
+]
+
+
+def _select_columns(columns):
+    """Validate a requested column subset and return it in table order.
+
+    Returns None when ``columns`` is None (the full feature table). Raises
+    ValueError for a name that is not one of ``FEATURE_COLUMNS``.
+    """
+    if columns is None:
+        return None
+    if isinstance(columns, str):
+        columns = [columns]
+    requested = set(columns)
+    unknown = sorted(requested.difference(FEATURE_COLUMNS))
+    if unknown:
+        raise ValueError(f"unknown feature columns: {', '.join(unknown)}")
+    if not requested:
+        raise ValueError("columns must name at least one feature")
+    return [c for c in FEATURE_COLUMNS if c in requested]
+
 
 def _real_valued(roi_features):
     """Reduce complex feature values to the real numbers upstream reports.
@@ -217,43 +223,136 @@ def _real_valued(roi_features):
     return out
 
 
+#: Blob outputs ``_process_bin`` can write.
+BLOB_FORMATS = ("zip", "packed")
+
+
+def _check_blob_format(blob_format):
+    if blob_format not in BLOB_FORMATS:
+        raise ValueError(f"blob_format must be one of {BLOB_FORMATS}, "
+                         f"not {blob_format!r}")
+    return blob_format
+
+
 def _output_paths(lid, features_directory, blobs_directory,
-                  feature_tag="features"):
-    """Return the (features_csv, blobs_zip) output paths for a bin lid.
+                  feature_tag="features", blob_format="zip"):
+    """Return the (features_csv, blobs) output paths for a bin lid.
 
     ``feature_tag`` controls the token between the bin lid and the version in
     the feature CSV name: ``"features"`` (default) yields the upstream
     ``<lid>_features_v4.csv``; ``"fea"`` yields ``<lid>_fea_v4.csv``, which is
     the name the IFCB Dashboard (pyifcb's FeaturesDirectory) looks for. The
-    blob archive name is unaffected.
+    blob archive name is unaffected. The blob path is that of the
+    ``<lid>_blobs_v4.zip`` archive, or of the ``<lid>_blobs_v4.pack`` pack
+    with ``blob_format="packed"``, and None when ``blobs_directory`` is None
+    (a reduced run writes no blobs).
     """
     features_path = os.path.join(features_directory,
                                  f"{lid}_{feature_tag}_v4.csv")
-    blobs_path = os.path.join(blobs_directory, f"{lid}_blobs_v4.zip")
+    blobs_path = None
+    if blobs_directory is not None and blob_format == "packed":
+        blobs_path = pack_path(blobs_directory, lid)
+    elif blobs_directory is not None:
+        blobs_path = os.path.join(blobs_directory, f"{lid}_blobs_v4.zip")
     return features_path, blobs_path
 
 
+def _has_columns(features_path, columns):
+    """Tell whether the feature table at ``features_path`` holds every one of
+    ``columns``, reading only its header.
+
+    A reduced run (see ``columns`` in :func:`extract_features`) writes its
+    table under the same name as the full one, which ``psd.Sample`` and the
+    IFCB Dashboard read. Checking the header keeps a later full run from
+    skipping the bin as done and leaving the partial table in place.
+    """
+    try:
+        with open(features_path, newline='') as f:
+            header = next(csv.reader(f), [])
+    except OSError:
+        return False
+    return set(columns) <= set(header)
+
+
+def _init_worker(data_directory, backend=None, reader=None):
+    """Pool initializer: prepare a worker before its first bin.
+
+    Opens the worker's reader (see :func:`ifcb_reader.init_worker_reader`;
+    ``reader`` is one the parent has already opened), and runs
+    compute_features once on a small synthetic particle so the first real
+    bin does not pay its first-use costs (scikit-image imports its
+    submodules lazily, on first call, and a spawned worker starts with none
+    of them loaded). Failures are ignored here: they recur, and are
+    reported, in the bin that meets them.
+    """
+    import pandas  # noqa: F401 - imported now rather than in the first bin
+    from PIL import Image  # noqa: F401
+
+    init_worker_reader(data_directory, backend, reader)
+    image = np.full((32, 32), 200, dtype=np.uint8)
+    image[8:24, 10:22] = 40
+    try:
+        from ifcb_features.all import compute_features
+        compute_features(image)
+    except Exception:  # noqa: BLE001 - warm-up only
+        pass
+
+
 def _process_bin(data_directory, features_directory, blobs_directory, bin_name,
-                 overwrite, feature_tag="features", backend=None):
+                 overwrite, feature_tag="features", backend=None, columns=None,
+                 psd_directory=None, micron_factor=1/3.4, blob_format="zip"):
     """Extract features and blobs for a single bin.
 
     This is a module-level function so it can be pickled and dispatched to a
     pool worker (a process under ``multiprocessing.Pool``, or a thread under
-    ``ThreadPool``). Each call opens its own reader because the underlying
-    bin objects are not picklable and to avoid sharing state between workers.
+    ``ThreadPool``). Bins are read through a reader private to the worker
+    (see :func:`ifcb_reader.worker_reader`), opened on its first bin and
+    reused after that, because the underlying bin objects are not picklable
+    and to avoid sharing state between workers.
 
     ``feature_tag`` is forwarded to :func:`_output_paths` to control the
     feature CSV name (e.g. ``"features"`` or ``"fea"``). ``backend`` forces a
     particular raw-data reader; see :func:`ifcb_reader.open_data_directory`.
 
+    ``columns`` (a list validated by :func:`_select_columns`) selects the
+    reduced profile: only ``roi_number`` and those columns are written, and
+    no blob archive is produced, so blob PNG encoding and compression are
+    skipped entirely. Values are those of the full table.
+
+    With ``psd_directory``, the features are also reduced to a particle size
+    distribution summary (see :mod:`psd_summary`) using ``micron_factor``,
+    which is written to ``<lid>_psd.json`` in that directory and returned
+    under the result's ``psd`` key.
+
+    ``blob_format="packed"`` keeps each blob as a boolean mask and writes
+    them to a ``blob_store`` pack, instead of encoding one PNG per ROI into
+    the zip archive.
+
     Returns a dict with keys ``bin``, ``status`` ("processed", "skipped" or
-    "error") and ``message``.
+    "error") and ``message``; a processed bin adds ``n_rois``, plus ``psd``
+    when processed with ``psd_directory``.
     """
-    features_path, blobs_path = _output_paths(bin_name, features_directory,
-                                              blobs_directory, feature_tag)
+    import pandas as pd
+    from ifcb_features.all import compute_features
+    from PIL import Image
 
-    # Skip when both outputs already exist (unless overwrite is requested).
-    if not overwrite and os.path.exists(features_path) and os.path.exists(blobs_path):
+    reduced = columns is not None
+    packed = blob_format == "packed"
+    features_path, blobs_path = _output_paths(bin_name, features_directory,
+                                              blobs_directory, feature_tag,
+                                              blob_format)
+
+    psd = psd_directory is not None
+    psd_path = summary_path(psd_directory, bin_name) if psd else None
+
+    # Skip when the outputs already exist (unless overwrite is requested). A
+    # reduced run produces only the feature table, so an existing table must
+    # hold the columns this run writes: one left by a reduced run is
+    # replaced by a full run.
+    if not overwrite and os.path.exists(features_path) and (
+            reduced or os.path.exists(blobs_path)) and (
+            not psd or os.path.exists(psd_path)) and _has_columns(
+            features_path, ['roi_number'] + (columns or FEATURE_COLUMNS)):
         return {"bin": bin_name, "status": "skipped",
                 "message": "outputs already exist"}
 
@@ -261,8 +360,14 @@ def _process_bin(data_directory, features_directory, blobs_directory, bin_name,
     # kept apart so each can be reported accurately: only an unresolvable bin is
     # "not found".
     try:
-        reader = open_data_directory(data_directory, backend=backend)
-        images = reader.read_images(bin_name)
+        reader = worker_reader(data_directory, backend)
+        try:
+            images = reader.read_images(bin_name)
+        except KeyError:
+            # The worker's reader may predate the bin (see watch_features),
+            # so look again before reporting it missing.
+            reader = worker_reader(data_directory, backend, refresh=True)
+            images = reader.read_images(bin_name)
     except KeyError:
         return {"bin": bin_name, "status": "error",
                 "message": "bin not found in data directory"}
@@ -288,10 +393,13 @@ def _process_bin(data_directory, features_directory, blobs_directory, bin_name,
             blobs_image, roi_features = compute_features(image)
             features.update(_real_valued(roi_features))
 
-            img_buffer = io.BytesIO()
-            Image.fromarray((blobs_image > 0).astype(np.uint8) * 255).save(
-                img_buffer, format="PNG")
-            all_blobs[number] = img_buffer.getvalue()
+            if not reduced and packed:
+                all_blobs[number] = blobs_image > 0
+            elif not reduced:
+                img_buffer = io.BytesIO()
+                Image.fromarray((blobs_image > 0).astype(np.uint8) * 255).save(
+                    img_buffer, format="PNG")
+                all_blobs[number] = img_buffer.getvalue()
         except Exception as e:  # noqa: BLE001 - skip a bad ROI, keep the rest
             print(f"Error processing ROI {number} in sample {bin_name}: {e}")
 
@@ -303,26 +411,103 @@ def _process_bin(data_directory, features_directory, blobs_directory, bin_name,
 
     df = pd.DataFrame.from_records(all_features,
                                    columns=['roi_number'] + FEATURE_COLUMNS)
-    df.to_csv(features_path, index=False, float_format="%.10g")
 
-    if all_blobs:
-        with zipfile.ZipFile(blobs_path, 'w') as zf:
+    result = {"bin": bin_name, "status": "processed", "message": "",
+              "n_rois": len(all_features)}
+    if psd:
+        # The header and ADC are small next to the .roi the reader has just
+        # been through (an archive reader still holds them from
+        # read_images); reading them here is what spares a PSD run its
+        # second pass over the bin.
+        try:
+            raw = reader.read_metadata(bin_name)
+            result["psd"] = summarize(bin_name, df, parse_header(raw["hdr"]),
+                                      count_triggers(raw["adc"]),
+                                      micron_factor)
+        except Exception as e:  # noqa: BLE001 - report to R like a bad bin
+            return {"bin": bin_name, "status": "error",
+                    "message": f"PSD summary failed: {e}"}
+
+    if reduced:
+        df = df[['roi_number'] + columns]
+
+    # Outputs are written under a temporary name and moved into place, so an
+    # interrupted worker never leaves a truncated file that a later run would
+    # skip as "already exists", and two workers processing the same bin (see
+    # work_queue) each replace the outputs with one complete write. The blob
+    # archive goes last: its presence marks the bin as done.
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    if psd:
+        write_summary(psd_path, result["psd"])
+    df.to_csv(features_path + suffix, index=False, float_format="%.10g")
+    os.replace(features_path + suffix, features_path)
+
+    if not reduced and all_blobs and packed:
+        # BlobStoreWriter moves the pack into place itself once complete.
+        with BlobStoreWriter(blobs_path) as writer:
+            for roi_number, mask in all_blobs.items():
+                writer.add(bin_name, roi_number, mask)
+    elif not reduced and all_blobs:
+        with zipfile.ZipFile(blobs_path + suffix, 'w') as zf:
             for roi_number, blob_data in all_blobs.items():
                 filename = f"{bin_name}_{roi_number:05d}.png"
                 zf.writestr(filename, blob_data)
+        os.replace(blobs_path + suffix, blobs_path)
 
-    return {"bin": bin_name, "status": "processed", "message": ""}
+    return result
 
 
-def _resolve_bins(data_directory, bins, backend=None):
+def _process_bin_measured(*args):
+    """Run :func:`_process_bin` and add what it cost to its result.
+
+    The result gains ``wall_seconds``, ``cpu_seconds`` (CPU time of the
+    worker thread; native threads a library starts are not included) and
+    ``rss_bytes`` (the worker's resident memory afterwards, None where it
+    cannot be read), which :class:`worker_control.WorkerController` adjusts
+    the number of bins in flight from, and ``peak_bytes`` (the most memory
+    the worker held during the bin above what it held before), which
+    :class:`worker_control.MemoryBudget` learns from. The peak is measured
+    only in a worker process, on Linux; in a thread or in the calling process
+    (R's, on the sequential path) resetting it would disturb that process, so
+    ``peak_bytes`` is None there and the budget keeps its estimate from the
+    raw file sizes.
+    """
+    baseline = current_rss()
+    measure_peak = (baseline is not None and in_worker_process()
+                    and reset_peak_rss())
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    result = _process_bin(*args)
+    result["cpu_seconds"] = time.thread_time() - cpu
+    result["wall_seconds"] = time.perf_counter() - wall
+    result["rss_bytes"] = current_rss()
+    peak = peak_rss() if measure_peak else None
+    result["peak_bytes"] = peak - baseline if peak is not None else None
+    return result
+
+
+def _raw_bytes(data_directory, lid):
+    """Combined size of ``lid``'s ``.adc`` and ``.roi`` files, or 0 if they
+    cannot be found (the bin then gets the smallest memory estimate, and its
+    error is reported when it is processed)."""
+    try:
+        _, adc = find_raw_files(data_directory, lid)
+        roi = adc[:-len('.adc')] + '.roi'
+        return os.path.getsize(adc) + os.path.getsize(roi)
+    except (KeyError, OSError):
+        return 0
+
+
+def _resolve_bins(data_directory, bins, backend=None, reader=None):
     """Return the list of bin lids to process.
 
     When ``bins`` is None, every bin in the data directory is returned.
     Otherwise the requested bins are filtered against the directory and any
     missing ones are reported back to the caller. ``backend`` forces a
-    particular raw-data reader.
+    particular raw-data reader; ``reader`` is one already open.
     """
-    reader = open_data_directory(data_directory, backend=backend)
+    if reader is None:
+        reader = open_data_directory(data_directory, backend=backend)
     lids = reader.list_lids()
 
     if not bins:
@@ -342,8 +527,8 @@ def list_bins(data_directory, bins=None, backend=None):
         data_directory (str): Path to the raw IFCB data directory.
         bins (list, optional): Bin lids to restrict to. If None, all bins are
             listed.
-        backend (str, optional): Force a specific raw-data reader, ``"ifcbkit"``
-            or ``"pyifcb"``.
+        backend (str, optional): Force a specific raw-data reader, ``"ifcbkit"``,
+            ``"pyifcb"`` or ``"archive"``.
 
     Returns:
         dict: ``{"found": [...], "missing": [...]}`` where ``found`` are the bin
@@ -357,8 +542,9 @@ def list_bins(data_directory, bins=None, backend=None):
 class ParallelExtractor:
     """Process IFCB bins across pool workers, polled incrementally.
 
-    Bins are submitted to a pool up front; completed results are retrieved
-    non-blockingly via :meth:`poll`. This design lets the *caller* (the R
+    Bins are submitted to a pool up front (with ``num_workers="auto"``, as
+    many at a time as the controller allows; see below); completed results
+    are retrieved non-blockingly via :meth:`poll`. This design lets the *caller* (the R
     wrapper) drive the loop and check for interrupts between polls, and lets the
     workers be stopped via :meth:`terminate`.
 
@@ -380,15 +566,67 @@ class ParallelExtractor:
 
     Note also that under a thread pool the GIL limits speedup to the parts of
     the work that release it (most of the numpy / scikit-image computation does).
+
+    ``num_workers="auto"`` starts ``max_workers`` workers (default: the
+    number of cores) and lets a :class:`worker_control.WorkerController`
+    decide how many bins run at a time, between ``min_workers`` and
+    ``max_workers``, from the CPU time, wall time and memory each bin
+    reports. Its changes are listed in :attr:`decisions` and passed to
+    ``log``.
+
+    With ``memory_budget`` set, a bin is only handed to a worker while the
+    estimated peak memory of the bins in flight, its own included, fits the
+    budget (see :class:`worker_control.MemoryBudget`); otherwise it waits,
+    in submission order, for running bins to finish. At most ``num_workers``
+    bins are then in flight, so bins waiting for a free worker do not hold
+    budget. The estimate comes from the size of the bin's ``.roi`` and
+    ``.adc`` and, with a process pool, is refined from the peak memory the
+    workers report; under a thread pool the conservative initial estimate is
+    kept, as threads share a single peak.
+
+    With ``metrics`` set, the bins submitted, finished and in flight, their
+    wall times and the workers' memory are kept in a
+    :class:`run_metrics.RunMetrics` (:attr:`metrics`) and published to a file
+    every ``metrics_interval`` seconds, or served over HTTP, until
+    :meth:`terminate` (see :mod:`run_metrics`).
+
+    ``native_threads`` limits the threads the native libraries under
+    ``compute_features`` (BLAS, OpenMP) start in each worker: by default
+    (``"auto"``) the cores are divided between the ``num_workers`` workers
+    (with ``"auto"`` workers, between ``max_workers``). A thread pool's
+    workers share one set of libraries, so there the limit applies to the
+    whole interpreter until :meth:`terminate` restores it. See
+    ``ifcb_pool.limit_native_threads``.
+
+    When the bins are read from archives, the archives are indexed once,
+    here (or ``reader`` is an :class:`ifcb_archive.ArchiveReader` already
+    indexed), and the index is handed to the workers; see
+    :func:`ifcb_reader.shared_reader`.
+
+    ``columns``, ``psd_directory``, ``micron_factor``, ``maxtasksperchild``,
+    ``blob_format``, ``metrics`` and ``native_threads`` are as for
+    :func:`extract_features`.
     """
 
     def __init__(self, data_directory, features_directory, blobs_directory,
                  bins=None, overwrite=False, num_workers=2,
                  found_bins=None, missing_bins=None, python_executable=None,
-                 use_threads=False, feature_tag="features", backend=None):
+                 use_threads=False, feature_tag="features", backend=None,
+                 columns=None, psd_directory=None, micron_factor=1/3.4,
+                 maxtasksperchild=None, min_workers=1, max_workers=None,
+                 log=None, memory_budget=None, blob_format="zip",
+                 metrics=None, metrics_interval=15, native_threads="auto",
+                 reader=None):
+        columns = _select_columns(columns)
+        _check_blob_format(blob_format)
         os.makedirs(features_directory, exist_ok=True)
-        os.makedirs(blobs_directory, exist_ok=True)
+        if columns is None:
+            os.makedirs(blobs_directory, exist_ok=True)
+        if psd_directory is not None:
+            os.makedirs(psd_directory, exist_ok=True)
 
+        if reader is None:
+            reader = shared_reader(data_directory, backend)
         if found_bins is not None:
             # Accept a pre-resolved bin list to avoid a second DataDirectory
             # scan (the caller already paid for one in list_bins()).
@@ -402,32 +640,97 @@ class ParallelExtractor:
             self.missing = [str(b) for b in (missing_bins or [])]
         else:
             bin_names, self.missing = _resolve_bins(data_directory, bins,
-                                                    backend=backend)
-        self.total = len(bin_names)
-
-        if use_threads:
-            # Thread-based pool: workers are threads in this interpreter, so
-            # there is no spawn, no pickling and no child-process bootstrap.
-            # This is the reliable choice when Python is embedded (reticulate)
-            # on Windows / macOS, where process spawn from an embedded
-            # interpreter hangs. compute_features spends most of its time in
-            # scikit-image / numpy, which release the GIL, so threads still
-            # parallelise the heavy work.
-            from multiprocessing.pool import ThreadPool
-            self.pool = ThreadPool(processes=max(1, int(num_workers)))
-        else:
-            # Process-based pool: true multi-core parallelism. Safe under fork
-            # (Linux). Avoid on Windows / macOS when embedded in R.
-            _ensure_module_importable()
-            _ensure_spawn_executable(python_executable)
-            self.pool = multiprocessing.Pool(processes=max(1, int(num_workers)))
-        self._pending = [
-            (bin_name, self.pool.apply_async(
-                _process_bin,
-                (data_directory, features_directory, blobs_directory,
-                 bin_name, overwrite, feature_tag, backend)))
-            for bin_name in bin_names
-        ]
+                                                    backend=backend,
+                                                    reader=reader)
+
+        # A thread pool when use_threads is set (compute_features spends most
+        # of its time in scikit-image / numpy, which release the GIL, so threads
+        # still parallelise the heavy work), otherwise a process pool. See
+        # ifcb_pool.create_pool. Each worker is warmed up by _init_worker.
+        self.controller = None
+        if num_workers == "auto":
+            self.controller = WorkerController(min_workers, max_workers,
+                                               shared_memory=use_threads,
+                                               log=log)
+            num_workers = self.controller.max_workers
+        self.budget = None
+        if memory_budget is not None:
+            self.budget = MemoryBudget(memory_budget)
+        self._workers = num_workers
+        self.exporter = None
+        if metrics is not None:
+            self.exporter = MetricsExporter(metrics, interval=metrics_interval)
+        self._learn_memory = not use_threads
+        self._raw_sizes = {}
+        self.native_threads = threads_per_worker(num_workers, native_threads)
+        self._thread_limits = None
+        if use_threads and self.native_threads is not None:
+            self._thread_limits = limit_native_threads(self.native_threads,
+                                                       environment=False)
+        self.pool = create_pool(num_workers, use_threads, python_executable,
+                                initializer=_init_worker,
+                                initargs=(data_directory, backend, reader),
+                                maxtasksperchild=maxtasksperchild,
+                                native_threads=self.native_threads)
+        self._task_args = (data_directory, features_directory, blobs_directory)
+        self._task_options = (overwrite, feature_tag, backend, columns,
+                              psd_directory, micron_factor, blob_format)
+        self._pending = []
+        self._backlog = collections.deque()
+        self.total = 0
+        self.submit(bin_names)
+
+    @property
+    def decisions(self):
+        """The controller's changes to the number of bins in flight (empty
+        unless ``num_workers="auto"``)."""
+        return self.controller.decisions if self.controller else []
+
+    @property
+    def metrics(self):
+        """The run's :class:`run_metrics.RunMetrics`, or None without
+        ``metrics``."""
+        return self.exporter.metrics if self.exporter else None
+
+    def submit(self, bins):
+        """Queue more bins on the running pool.
+
+        Lets a long-lived extractor (see :func:`watch_features`) keep its
+        workers while new bins arrive, instead of starting a pool per batch.
+        The bins are not checked against the data directory; one that cannot
+        be read is reported as an error by :meth:`poll`.
+        """
+        if isinstance(bins, str):
+            bins = [bins]
+        for bin_name in bins:
+            self._backlog.append(str(bin_name))
+            self.total += 1
+            if self.exporter is not None:
+                self.exporter.metrics.submitted()
+        self._dispatch()
+
+    def _dispatch(self):
+        limit = self.controller.limit if self.controller else None
+        if limit is None and self.budget is not None:
+            limit = self._workers
+        data_directory = self._task_args[0]
+        while self._backlog and (limit is None or len(self._pending) < limit):
+            bin_name = self._backlog[0]
+            if self.budget is not None:
+                if bin_name not in self._raw_sizes:
+                    self._raw_sizes[bin_name] = _raw_bytes(data_directory,
+                                                           bin_name)
+                if not self.budget.admit(bin_name, self._raw_sizes[bin_name]):
+                    break
+            self._backlog.popleft()
+            self._pending.append((bin_name, self.pool.apply_async(
+                _process_bin_measured,
+                self._task_args + (bin_name,) + self._task_options)))
+        if self.exporter is not None:
+            self.exporter.metrics.update_queue(
+                len(self._backlog), len(self._pending),
+                limit if limit is not None else self._workers)
+            self.exporter.maybe_write()
 
     def poll(self):
         """Return a list of result dicts for bins that have finished since the
@@ -444,11 +747,25 @@ class ParallelExtractor:
             else:
                 still_pending.append((bin_name, async_result))
         self._pending = still_pending
+        if self.budget is not None:
+            for result in done:
+                raw_bytes = self._raw_sizes.pop(result["bin"], 0)
+                self.budget.release(result["bin"])
+                if self._learn_memory and result.get("status") == "processed":
+                    self.budget.observe(raw_bytes, result.get("peak_bytes"))
+        if self.controller is not None:
+            for result in done:
+                self.controller.observe(result)
+            self.controller.update()
+        if self.exporter is not None:
+            for result in done:
+                self.exporter.metrics.observe(result)
+        self._dispatch()
         return done
 
     def remaining(self):
         """Number of bins not yet collected."""
-        return len(self._pending)
+        return len(self._pending) + len(self._backlog)
 
     def terminate(self):
         """Stop the pool immediately, discarding pending work.
@@ -457,17 +774,135 @@ class ParallelExtractor:
         stops dispatching new bins (a bin already in flight runs to completion,
         see the class docstring).
         """
+        self._backlog.clear()
         try:
             self.pool.terminate()
             self.pool.join()
         except Exception:  # noqa: BLE001 - terminate must never raise
             pass
+        if self._thread_limits is not None:
+            self._thread_limits.restore_original_limits()
+            self._thread_limits = None
+        if self.exporter is not None:
+            try:
+                self.exporter.metrics.update_queue(0, 0, self._workers)
+                self.exporter.close()
+            except Exception:  # noqa: BLE001 - terminate must never raise
+                pass
+            self.exporter = None
+
+
+def _extract_distributed(data_directory, features_directory, blobs_directory,
+                         bin_names, queue_directory, overwrite, num_workers,
+                         progress, python_executable, use_threads, feature_tag,
+                         backend, lease_timeout, columns=None, psd_directory=None,
+                         micron_factor=1/3.4, maxtasksperchild=None,
+                         min_workers=1, max_workers=None, log=None,
+                         heartbeat_interval=None, memory_budget=None,
+                         blob_format="zip", metrics=None,
+                         native_threads="auto", reader=None):
+    """Run this node's share of a distributed extraction.
+
+    Claims bins from a :class:`work_queue.SharedWorkQueue` and keeps up to two
+    per bin running on a local :class:`ParallelExtractor`, so nodes pull
+    work as they have capacity and a fast node takes on more bins than a slow
+    one. Leases are refreshed every ``heartbeat_interval`` seconds (a quarter
+    of ``lease_timeout`` by default) while their bins run.
+
+    Bins held by other nodes are revisited at the same interval once this node
+    runs out of unclaimed work, and the node only returns when every bin is
+    done: if the holder has crashed, its lease expires and a waiting node
+    reclaims the bin. On any exception, including an interrupt, the node's
+    leases are released so other nodes can take the bins over at once.
+
+    A bin that fails is recorded as a failed attempt, not as done, and goes
+    back to the end of the queue; its error is returned only once it is given
+    up (see :class:`work_queue.SharedWorkQueue`). With ``overwrite``, done
+    markers left by an earlier run in ``queue_directory`` are ignored.
+    """
+    queue = SharedWorkQueue(queue_directory, lease_timeout=lease_timeout,
+                            overwrite=overwrite)
+    if heartbeat_interval is None:
+        heartbeat_interval = lease_timeout / 4
+    if num_workers != "auto":
+        num_workers = max(1, int(num_workers))
+
+    extractor = ParallelExtractor(data_directory, features_directory,
+                                  blobs_directory, overwrite=overwrite,
+                                  num_workers=num_workers, found_bins=[],
+                                  python_executable=python_executable,
+                                  use_threads=use_threads,
+                                  feature_tag=feature_tag, backend=backend,
+                                  columns=columns, psd_directory=psd_directory,
+                                  micron_factor=micron_factor,
+                                  maxtasksperchild=maxtasksperchild,
+                                  min_workers=min_workers,
+                                  max_workers=max_workers, log=log,
+                                  memory_budget=memory_budget,
+                                  blob_format=blob_format, metrics=metrics,
+                                  native_threads=native_threads,
+                                  reader=reader)
+    # Nodes walk the bins from different starting points, so they do not all
+    # contend for the same leases at the start of a run.
+    offset = hash(queue.node_id) % len(bin_names) if bin_names else 0
+    unclaimed = bin_names[offset:] + bin_names[:offset]
+    held_elsewhere = []
+
+    results = []
+    last_heartbeat = time.time()
+    try:
+        while True:
+            running = (extractor.controller.limit if extractor.controller
+                       else num_workers)
+            while unclaimed and extractor.remaining() < 2 * running:
+                lid = unclaimed.pop(0)
+                if queue.claim(lid):
+                    extractor.submit(lid)
+                elif not queue.is_settled(lid):
+                    held_elsewhere.append(lid)
+            if extractor.remaining() == 0 and not unclaimed:
+                if not held_elsewhere:
+                    break
+
+            for result in extractor.poll():
+                if result["status"] == "error":
+                    if not queue.fail(result["bin"], result):
+                        unclaimed.append(result["bin"])  # retry it later
+                        continue
+                else:
+                    queue.complete(result["bin"], result)
+                results.append(result)
+                if progress is not None:
+                    progress(len(results), len(bin_names))
+
+            if time.time() - last_heartbeat >= heartbeat_interval:
+                queue.heartbeat()
+                last_heartbeat = time.time()
+                if not unclaimed:
+                    # Retry bins other nodes hold: done ones drop out, and
+                    # those whose lease has expired can now be claimed.
+                    unclaimed = [lid for lid in held_elsewhere
+                                 if not queue.is_settled(lid)]
+                    held_elsewhere = []
+            time.sleep(0.05)
+    except BaseException:
+        extractor.terminate()
+        queue.release_all()
+        raise
+    else:
+        extractor.terminate()
+    return results
 
 
 def extract_features(data_directory, features_directory, blobs_directory,
                      bins=None, overwrite=False, num_workers=1, progress=None,
                      python_executable=None, use_threads=False,
-                     feature_tag="features", backend=None):
+                     feature_tag="features", backend=None,
+                     queue_directory=None, lease_timeout=600, columns=None,
+                     psd_directory=None, micron_factor=1/3.4,
+                     maxtasksperchild=None, min_workers=1, max_workers=None,
+                     log=None, memory_budget=None, blob_format="zip",
+                     metrics=None, native_threads="auto"):
     """Extract slim features and blobs for IFCB bins.
 
     Args:
@@ -476,14 +911,21 @@ def extract_features(data_directory, features_directory, blobs_directory,
         features_directory (str): Directory where ``*_features_v4.csv`` files
             are written. Created if it does not exist.
         blobs_directory (str): Directory where ``*_blobs_v4.zip`` files are
-            written. Created if it does not exist.
+            written. Created if it does not exist. May be None with
+            ``columns``.
         bins (list, optional): Bin lids (e.g. 'D20240423T115846_IFCB127') to
             process. If None, all bins in ``data_directory`` are processed.
         overwrite (bool): If False (default), bins whose feature CSV and blob
-            ZIP both already exist are skipped.
-        num_workers (int): Number of pool workers. 1 (default) runs
+            ZIP both already exist are skipped (with ``columns``, bins whose
+            feature CSV exists). A feature CSV only counts if it holds every
+            column the run writes, so a full run replaces the table a
+            ``columns`` run left.
+        num_workers (int or str): Number of pool workers. 1 (default) runs
             sequentially; values > 1 use a pool (worker processes, or threads
-            when ``use_threads`` is True).
+            when ``use_threads`` is True). ``"auto"`` sizes the number of bins
+            in flight as the run goes, from the CPU time, I/O wait and memory
+            the bins report, between ``min_workers`` and ``max_workers``; see
+            :mod:`worker_control`.
         progress (callable, optional): Called as ``progress(done, total)`` after
             each bin completes, where ``done`` is the number of bins finished and
             ``total`` is the number to process. Used to drive a progress bar.
@@ -500,22 +942,115 @@ def extract_features(data_directory, features_directory, blobs_directory,
             ``<lid>_features_v4.csv``; ``"fea"`` writes ``<lid>_fea_v4.csv``,
             the name served by the IFCB Dashboard. Blob archive names are
             unaffected.
-        backend (str, optional): Force a specific raw-data reader, ``"ifcbkit"``
-            or ``"pyifcb"``. If None, the preferred available reader is used.
+        backend (str, optional): Force a specific raw-data reader, ``"ifcbkit"``,
+            ``"pyifcb"`` or ``"archive"`` (bins inside ZIP / tar archives in
+            ``data_directory``, read without unpacking them; see
+            ifcb_archive). If None, the preferred available reader is used,
+            or ``"archive"`` when ``data_directory`` is a single archive.
+        queue_directory (str, optional): Directory on a filesystem shared by
+            several nodes. When given, this call is one node of a distributed
+            run: it claims bins from a work queue kept there (see work_queue)
+            and processes them with its local pool until none are left, and
+            the same call may be started on every node. ``progress`` then
+            counts the bins this node has finished out of all bins in the run.
+            A bin that fails is retried, by any node, up to three times
+            before its error is returned; with ``overwrite``, bins an earlier
+            run recorded as done in the queue are processed again.
+        lease_timeout (float): With ``queue_directory``, seconds without a
+            heartbeat after which another node may take over a claimed bin.
+        columns (list, optional): Feature columns to write, e.g.
+            ``PSD_COLUMNS`` for a size-distribution-only run. The feature CSV
+            then holds ``roi_number`` and these columns (in the usual order,
+            with the same values as the full table) and no blob archive is
+            written, which skips blob PNG encoding and compression. Raises
+            ValueError for an unknown column. If None (default), all
+            ``FEATURE_COLUMNS`` and the blobs are written.
+        psd_directory (str, optional): If given, also build each bin's
+            particle size distribution histograms from the features just
+            computed, scaled by ``micron_factor``, and write them to
+            ``<lid>_psd.json`` in this directory (created if needed; keep it
+            apart from ``features_directory``, whose every lid-named file
+            ``psd.Bin`` reads as a feature table). ``psd.Bin(summaries=...)``
+            is then built from these without reading the features or raw
+            data again (see ``psd_summary.load_summaries``). A bin missing its
+            summary is not skipped as existing.
+        micron_factor (float): Microns per pixel, used with
+            ``psd_directory``.
+        maxtasksperchild (int, optional): With a process pool, replace each
+            worker with a fresh process after this many bins, so memory a
+            worker accumulates over a long run is returned to the system.
+            None (default) keeps workers for the whole run. Ignored when
+            running sequentially or with ``use_threads``.
+        min_workers, max_workers (int): With ``num_workers="auto"``, the
+            bounds on bins in flight; ``max_workers`` defaults to the number
+            of cores and sets the pool size.
+        log (callable, optional): With ``num_workers="auto"``, called with a
+            record (a dict with the new ``limit``, the ``reason`` and the
+            measurements behind it) each time the number of bins in flight
+            changes.
+        memory_budget (int or str, optional): Memory, in bytes or as a size
+            such as ``"8G"``, that the bins in flight may use together on
+            top of the workers' baseline. Bins are then only started while
+            their estimated peak memory fits (see ParallelExtractor), so
+            ``num_workers`` can be set for the CPUs while the budget keeps a
+            run of large bins from exhausting the node's memory. Ignored when
+            running sequentially.
+        blob_format (str): ``"zip"`` (default) writes the upstream
+            ``<lid>_blobs_v4.zip``, one PNG per ROI. ``"packed"`` writes
+            ``<lid>_blobs_v4.pack`` instead, an indexed file from which
+            ``blob_store.BlobStore`` reads a single ROI's mask as a NumPy
+            array without unpacking an archive. A bin is skipped as existing
+            only if its blobs exist in the requested format.
+        metrics (str or int, optional): Publish live run metrics (bins done,
+            pending and errored, ROIs per second, bin time percentiles,
+            queue depth and worker memory; see run_metrics) while the run
+            goes: a file path rewritten every 15 seconds in OpenMetrics text
+            format (JSON if it ends in ``.json``), or a port on which they
+            are served over HTTP at ``127.0.0.1``. In a distributed run each
+            node publishes its own.
+        native_threads (int or str, optional): Threads each pool worker's
+            native libraries (BLAS, OpenMP) may start. ``"auto"`` (default)
+            divides the cores between the workers, so adding workers does
+            not multiply the threads competing for them; an integer sets the
+            count; None leaves the libraries at their defaults (a thread per
+            core in every worker). Limits on libraries a worker has already
+            loaded need ``threadpoolctl``. Ignored when running sequentially.
 
     Returns:
         list[dict]: One result dict per bin with keys ``bin``, ``status`` and
-        ``message``. Missing requested bins are reported with status "error".
+        ``message``, and with ``psd_directory``, the summary of each
+        processed bin under ``psd``. Missing requested bins are reported with
+        status "error".
+        In a distributed run only the bins processed by this node are
+        returned.
     """
+    columns = _select_columns(columns)
+    _check_blob_format(blob_format)
     os.makedirs(features_directory, exist_ok=True)
-    os.makedirs(blobs_directory, exist_ok=True)
+    if columns is None:
+        os.makedirs(blobs_directory, exist_ok=True)
+    if psd_directory is not None:
+        os.makedirs(psd_directory, exist_ok=True)
 
-    bin_names, missing = _resolve_bins(data_directory, bins, backend=backend)
+    reader = shared_reader(data_directory, backend)
+    bin_names, missing = _resolve_bins(data_directory, bins, backend=backend,
+                                       reader=reader)
 
     results = [{"bin": b, "status": "error",
                 "message": "bin not found in data directory"}
                for b in missing]
 
+    if queue_directory is not None:
+        results.extend(_extract_distributed(
+            data_directory, features_directory, blobs_directory, bin_names,
+            queue_directory, overwrite, num_workers, progress,
+            python_executable, use_threads, feature_tag, backend,
+            lease_timeout, columns, psd_directory, micron_factor,
+            maxtasksperchild, min_workers, max_workers, log,
+            memory_budget=memory_budget, blob_format=blob_format,
+            metrics=metrics, native_threads=native_threads, reader=reader))
+        return results
+
     total = len(bin_names)
     done = [0]
 
@@ -524,25 +1059,61 @@ def extract_features(data_directory, features_directory, blobs_directory,
         if progress is not None:
             progress(done[0], total)
 
-    num_workers = max(1, int(num_workers))
-
-    if num_workers <= 1 or len(bin_names) <= 1:
-        for bin_name in bin_names:
-            results.append(_process_bin(data_directory, features_directory,
-                                        blobs_directory, bin_name, overwrite,
-                                        feature_tag, backend))
-            _report()
+    if num_workers != "auto":
+        num_workers = max(1, int(num_workers))
+
+    if (num_workers != "auto" and num_workers <= 1) or len(bin_names) <= 1:
+        exporter = None
+        process = _process_bin
+        if metrics is not None:
+            exporter = MetricsExporter(metrics)
+            exporter.metrics.submitted(len(bin_names))
+            process = _process_bin_measured
+        if reader is not None:
+            init_worker_reader(data_directory, backend, reader)
+        try:
+            for i, bin_name in enumerate(bin_names):
+                if exporter is not None:
+                    exporter.metrics.update_queue(len(bin_names) - i - 1, 1, 1)
+                    exporter.maybe_write()
+                result = process(data_directory, features_directory,
+                                 blobs_directory, bin_name, overwrite,
+                                 feature_tag, backend, columns, psd_directory,
+                                 micron_factor, blob_format)
+                if exporter is not None:
+                    exporter.metrics.observe(result)
+                results.append(result)
+                _report()
+        finally:
+            # The bins were read through a reader kept in this thread, which
+            # is the caller's (R's): kept, it would serve later runs a stale
+            # listing.
+            drop_worker_reader()
+            if exporter is not None:
+                exporter.metrics.update_queue(0, 0, 1)
+                exporter.close()
     else:
         # Delegate to ParallelExtractor and poll it to completion. On any
         # exception (including KeyboardInterrupt) the workers are terminated so
         # they stop immediately and do not keep writing files.
         extractor = ParallelExtractor(data_directory, features_directory,
-                                      blobs_directory, bins, overwrite,
-                                      num_workers,
+                                      blobs_directory, overwrite=overwrite,
+                                      num_workers=num_workers,
+                                      found_bins=bin_names,
                                       python_executable=python_executable,
                                       use_threads=use_threads,
                                       feature_tag=feature_tag,
-                                      backend=backend)
+                                      backend=backend, columns=columns,
+                                      psd_directory=psd_directory,
+                                      micron_factor=micron_factor,
+                                      maxtasksperchild=maxtasksperchild,
+                                      min_workers=min_workers,
+                                      max_workers=max_workers, log=log,
+                                      memory_budget=memory_budget,
+                                      blob_format=blob_format,
+                                      metrics=metrics,
+                                      native_threads=native_threads,
+                                      reader=reader)
         try:
             while extractor.remaining() > 0:
                 for result in extractor.poll():
@@ -559,6 +1130,462 @@ def extract_features(data_directory, features_directory, blobs_directory,
     return results
 
 
+#: Extensions of the three files that make up a raw IFCB bin.
+RAW_EXTENSIONS = ('.hdr', '.adc', '.roi')
+
+_DAY_FOLDER = re.compile(r'^D\d{8}$')
+
+
+class BinWatcher:
+    """Find bins in a data directory that have finished being written.
+
+    The instrument writes a bin's ``.hdr``, ``.adc`` and ``.roi`` while it
+    acquires, so a bin is only handed out once all three exist and their sizes
+    and modification times have not changed between two polls, the last change
+    being at least ``settle_seconds`` old.
+
+    Polling is incremental. Directory listings are cached and only re-read when
+    the directory's modification time changes (adding or renaming a file
+    updates it), and day folders (``DYYYYMMDD``) older than the high-water mark
+    are not entered at all. The high-water mark is the largest lid below which
+    every bin has been reported done via :meth:`mark_done`; bins still in
+    progress hold it back, so a slow bin is never skipped because a later one
+    finished first. (A partial bin that is never completed holds the mark back
+    too; that only costs rescanning the folders after it.) Lids are compared as
+    strings, which orders the ``DYYYYMMDDTHHMMSS_IFCBnnn`` names of current
+    instruments by time.
+
+    When ``state_path`` is given, the high-water mark and the bins done above
+    it are persisted there as JSON, so a restarted watcher resumes where the
+    last one stopped instead of resubmitting the archive.
+    """
+
+    def __init__(self, data_directory, state_path=None, settle_seconds=30):
+        if not os.path.isdir(data_directory):
+            raise FileNotFoundError(
+                f"data directory not found: {data_directory}")
+        self.data_directory = data_directory
+        self.state_path = state_path
+        self.settle_seconds = settle_seconds
+        self.high_water_mark = ""
+        self._done = set()         # lids done above the high-water mark
+        self._submitted = set()    # lids handed out, not yet done
+        self._candidates = {}      # lid -> file signature at the last poll
+        self._dir_cache = {}       # path -> (mtime_ns, subdirs, {lid: paths})
+
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+            self.high_water_mark = state.get("high_water_mark", "")
+            self._done = set(state.get("done", []))
+
+    def _list_directory(self, path):
+        """Return (subdirectories, {lid: [raw file paths]}) for ``path``."""
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._dir_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+
+        subdirs = []
+        files = {}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                    continue
+                stem, ext = os.path.splitext(entry.name)
+                if ext in RAW_EXTENSIONS:
+                    files.setdefault(stem, []).append(entry.path)
+        self._dir_cache[path] = (mtime, subdirs, files)
+        return subdirs, files
+
+    def _scan(self):
+        """Return {lid: [raw file paths]} for bins above the high-water mark."""
+        hwm_day = self.high_water_mark[:9]
+        found = {}
+        stack = [self.data_directory]
+        while stack:
+            subdirs, files = self._list_directory(stack.pop())
+            for subdir in subdirs:
+                name = os.path.basename(subdir)
+                if hwm_day and _DAY_FOLDER.match(name) and name < hwm_day:
+                    continue
+                stack.append(subdir)
+            for lid, paths in files.items():
+                if lid > self.high_water_mark:
+                    found[lid] = paths
+        return found
+
+    def poll(self):
+        """Return the lids of bins that have become complete since the last
+        poll, in lid order."""
+        now = time.time()
+        ready = []
+        candidates = {}
+        for lid, paths in self._scan().items():
+            if lid in self._done or lid in self._submitted:
+                continue
+            if len(paths) < len(RAW_EXTENSIONS):
+                candidates[lid] = None
+                continue
+            try:
+                stats = [os.stat(path) for path in sorted(paths)]
+            except FileNotFoundError:
+                # Renamed or removed between the listing and the stat.
+                continue
+            signature = tuple((st.st_size, st.st_mtime_ns) for st in stats)
+            newest = max(st.st_mtime for st in stats)
+            if (self._candidates.get(lid) == signature
+                    and now - newest >= self.settle_seconds):
+                ready.append(lid)
+            else:
+                candidates[lid] = signature
+        self._candidates = candidates
+        self._submitted.update(ready)
+        return sorted(ready)
+
+    def mark_done(self, lid):
+        """Record that ``lid`` has been processed (or has failed for good) and
+        advance the high-water mark as far as bins still in progress allow."""
+        self._submitted.discard(lid)
+        if lid <= self.high_water_mark:
+            return
+        self._done.add(lid)
+
+        outstanding = self._submitted | set(self._candidates)
+        limit = min(outstanding) if outstanding else None
+        below = [d for d in self._done if limit is None or d < limit]
+        if below:
+            self.high_water_mark = max(below)
+            self._done = {d for d in self._done if d > self.high_water_mark}
+        self._save()
+
+    def _save(self):
+        if not self.state_path:
+            return
+        state = {"high_water_mark": self.high_water_mark,
+                 "done": sorted(self._done)}
+        # Write under a temporary name and move it into place, so an
+        # interrupted write never leaves a truncated state file behind.
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def watch_features(data_directory, features_directory, blobs_directory,
+                   state_path=None, poll_interval=10, settle_seconds=30,
+                   overwrite=False, num_workers=1, callback=None,
+                   max_polls=None, python_executable=None, use_threads=False,
+                   feature_tag="features", backend=None, columns=None,
+                   psd_directory=None, micron_factor=1/3.4,
+                   maxtasksperchild=None, min_workers=1, max_workers=None,
+                   log=None, memory_budget=None, blob_format="zip",
+                   metrics=None, native_threads="auto"):
+    """Extract features continuously as new bins finish being written.
+
+    Polls ``data_directory`` with a :class:`BinWatcher` and feeds each
+    completed bin to one long-lived :class:`ParallelExtractor`, so the latency
+    from acquisition to features is one ``poll_interval`` plus the bin's
+    settling time and extraction, rather than the period of a scheduled run.
+    Runs until interrupted (KeyboardInterrupt), or for ``max_polls`` polls.
+
+    Args:
+        data_directory, features_directory, blobs_directory: As for
+            :func:`extract_features`.
+        state_path (str, optional): JSON file recording the high-water mark,
+            so a restarted watcher does not resubmit bins already handled.
+            Without it, every complete bin in the directory is submitted on
+            start, and existing outputs are skipped unless ``overwrite``.
+        poll_interval (float): Seconds between polls of the data directory.
+        settle_seconds (float): How long a bin's files must have been
+            unchanged before it is considered complete.
+        overwrite (bool): Replace existing outputs instead of skipping.
+        num_workers (int or str): Number of pool workers, or ``"auto"``.
+        callback (callable, optional): Called with each result dict as bins
+            finish.
+        max_polls (int, optional): Stop after this many polls, once the bins
+            submitted so far have finished. Runs indefinitely if None.
+        python_executable, use_threads, feature_tag, backend, columns,
+            psd_directory, micron_factor, maxtasksperchild, min_workers,
+            max_workers, log, memory_budget, blob_format, metrics,
+            native_threads: As for :func:`extract_features`.
+
+    Returns:
+        list[dict]: The result dicts of every bin processed.
+    """
+    watcher = BinWatcher(data_directory, state_path=state_path,
+                         settle_seconds=settle_seconds)
+    extractor = ParallelExtractor(data_directory, features_directory,
+                                  blobs_directory, overwrite=overwrite,
+                                  num_workers=num_workers, found_bins=[],
+                                  python_executable=python_executable,
+                                  use_threads=use_threads,
+                                  feature_tag=feature_tag, backend=backend,
+                                  columns=columns, psd_directory=psd_directory,
+                                  micron_factor=micron_factor,
+                                  maxtasksperchild=maxtasksperchild,
+                                  min_workers=min_workers,
+                                  max_workers=max_workers, log=log,
+                                  memory_budget=memory_budget,
+                                  blob_format=blob_format, metrics=metrics,
+                                  native_threads=native_threads)
+    results = []
+    polls = 0
+    next_poll = 0.0
+    try:
+        while True:
+            if max_polls is None or polls < max_polls:
+                if time.time() >= next_poll:
+                    extractor.submit(watcher.poll())
+                    polls += 1
+                    next_poll = time.time() + poll_interval
+            elif extractor.remaining() == 0:
+                break
+            for result in extractor.poll():
+                # A failed bin is marked done as well: retrying a complete but
+                # unreadable bin on every poll would never succeed.
+                watcher.mark_done(result["bin"])
+                results.append(result)
+                if callback is not None:
+                    callback(result)
+            time.sleep(0.05)
+    finally:
+        extractor.terminate()
+    return results
+
+
+class AsyncExtractor:
+    """Drive a :class:`ParallelExtractor` from an asyncio event loop.
+
+    :meth:`ParallelExtractor.poll` never blocks, so the extractor is polled
+    on the event loop itself, with ``await asyncio.sleep(poll_interval)``
+    between polls rather than ``time.sleep``: no thread is dedicated to
+    polling, and other tasks run while the bins are extracted.
+
+    Bins are fed with :meth:`submit` and results read by iterating::
+
+        async with AsyncExtractor(data, features, blobs, num_workers=4) as ex:
+            feeder = asyncio.create_task(feed(ex))  # awaits ex.submit(...),
+                                                    # then calls ex.finish()
+            async for result in ex:
+                ...
+
+    :meth:`submit` applies backpressure: it waits while ``max_pending``
+    bins are in flight, queued in the pool or finished but not yet read,
+    so a producer cannot run ahead of extraction and the results it has not
+    consumed. ``max_pending`` defaults to twice the bins the pool runs at a
+    time (with ``num_workers="auto"``, twice the controller's current
+    limit). Iteration ends once :meth:`finish` has been called and every bin
+    submitted has been read.
+
+    Leaving the ``async with`` block, by an exception, a ``break`` or
+    cancellation of the task, calls :meth:`ParallelExtractor.terminate`, so
+    cancelling the consumer stops the workers as an interrupt does in R
+    (see :class:`ParallelExtractor` for what that means under a thread
+    pool). Awaiting :meth:`close` does the same outside a ``with`` block.
+    Either way the pool is stopped in a worker thread, so the event loop
+    keeps running while the workers wind down.
+
+    ``num_workers`` and the remaining keyword arguments are as for
+    :class:`ParallelExtractor`; bins are not checked against the data
+    directory, and one that cannot be read is returned as an error.
+    """
+
+    def __init__(self, data_directory, features_directory, blobs_directory,
+                 num_workers=2, max_pending=None, poll_interval=0.05,
+                 **options):
+        if max_pending is not None and int(max_pending) < 1:
+            raise ValueError("max_pending must be at least 1")
+        self.extractor = ParallelExtractor(data_directory, features_directory,
+                                           blobs_directory,
+                                           num_workers=num_workers,
+                                           found_bins=[], **options)
+        self.max_pending = None if max_pending is None else int(max_pending)
+        self.poll_interval = poll_interval
+        self._results = collections.deque()
+        self._finished = False
+        self._closed = False
+
+    def _window(self):
+        if self.max_pending is not None:
+            return self.max_pending
+        extractor = self.extractor
+        running = (extractor.controller.limit if extractor.controller
+                   else extractor._workers)
+        return 2 * running
+
+    def _collect(self):
+        self._results.extend(self.extractor.poll())
+
+    def outstanding(self):
+        """Bins submitted whose results have not been read yet."""
+        return self.extractor.remaining() + len(self._results)
+
+    async def submit(self, bins):
+        """Queue bins for extraction, waiting while ``max_pending`` bins are
+        outstanding (see :meth:`outstanding`)."""
+        if isinstance(bins, str):
+            bins = [bins]
+        for bin_name in bins:
+            while True:
+                if self._closed:
+                    raise RuntimeError("the extractor has been closed")
+                if self._finished:
+                    raise RuntimeError("finish() has already been called")
+                self._collect()
+                if self.outstanding() < self._window():
+                    break
+                await asyncio.sleep(self.poll_interval)
+            self.extractor.submit(bin_name)
+
+    def finish(self):
+        """Declare that no more bins will be submitted, so iteration ends once
+        the bins already submitted have been read."""
+        self._finished = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            if self._results:
+                return self._results.popleft()
+            if self._closed:
+                raise StopAsyncIteration
+            self._collect()
+            if self._results:
+                continue
+            if self._finished and self.extractor.remaining() == 0:
+                raise StopAsyncIteration
+            await asyncio.sleep(self.poll_interval)
+
+    async def close(self):
+        """Stop the pool, discarding bins not yet finished (see
+        :meth:`ParallelExtractor.terminate`).
+
+        Terminating waits for the workers (under a thread pool, for the bins
+        they are running), so it runs in the loop's default executor rather
+        than on the event loop itself.
+        """
+        if not self._closed:
+            self._closed = True
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.extractor.terminate)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+async def _iterate_bins(bins):
+    """Yield the bins of a list, iterable or async iterable."""
+    if isinstance(bins, str):
+        bins = [bins]
+    if hasattr(bins, "__aiter__"):
+        async for bin_name in bins:
+            yield str(bin_name)
+    else:
+        for bin_name in bins:
+            yield str(bin_name)
+
+
+async def _feed(extractor, bins):
+    try:
+        async for bin_name in _iterate_bins(bins):
+            await extractor.submit(bin_name)
+    finally:
+        extractor.finish()
+
+
+async def extract_features_async(data_directory, features_directory,
+                                 blobs_directory, bins=None, num_workers=2,
+                                 max_pending=None, poll_interval=0.05,
+                                 backend=None, **options):
+    """Extract features as an asynchronous generator of result dicts.
+
+    The asyncio counterpart of :func:`extract_features`, for services that
+    ingest bins on an event loop::
+
+        async for result in extract_features_async(data, features, blobs,
+                                                   bins=incoming_lids()):
+            ...
+
+    Results are yielded as bins finish, not in submission order. ``bins``
+    may be a list of lids, any iterable, or an async iterable (for example
+    an async generator reading an ``asyncio.Queue``), which is consumed only
+    as fast as extraction and the caller keep up (see
+    :class:`AsyncExtractor`), so a bounded queue upstream fills and blocks
+    its producers instead of lids piling up in memory. If None (default),
+    every bin in ``data_directory`` is extracted; the directory is scanned
+    in a worker thread, so the scan does not block the event loop.
+
+    Cancelling the consuming task, or closing the generator early (e.g.
+    leaving ``async for`` with ``break`` inside ``contextlib.aclosing``),
+    terminates the pool. An exception raised by ``bins`` is re-raised once
+    the bins already submitted have been yielded.
+
+    Args:
+        data_directory, features_directory, blobs_directory: As for
+            :func:`extract_features`.
+        bins (list, iterable or async iterable, optional): Bin lids to
+            process. A list is checked against the data directory, as in
+            :func:`extract_features`, and missing bins are yielded first
+            with status "error"; lids from other iterables are not checked.
+        num_workers (int or str): Number of pool workers, or ``"auto"``.
+        max_pending (int, optional): Bins outstanding at a time; see
+            :class:`AsyncExtractor`.
+        poll_interval (float): Seconds between polls of the pool.
+        backend, **options: As for :class:`ParallelExtractor`.
+
+    Yields:
+        dict: One result dict per bin, as returned by :func:`extract_features`.
+    """
+    loop = asyncio.get_running_loop()
+    if "reader" not in options:
+        options["reader"] = await loop.run_in_executor(
+            None, shared_reader, data_directory, backend)
+    if bins is None or isinstance(bins, (list, tuple)):
+        bins, missing = await loop.run_in_executor(
+            None, _resolve_bins, data_directory, bins, backend,
+            options["reader"])
+        for bin_name in missing:
+            yield {"bin": bin_name, "status": "error",
+                   "message": "bin not found in data directory"}
+
+    async with AsyncExtractor(data_directory, features_directory,
+                              blobs_directory, num_workers=num_workers,
+                              max_pending=max_pending,
+                              poll_interval=poll_interval, backend=backend,
+                              **options) as extractor:
+        feeder = asyncio.ensure_future(_feed(extractor, bins))
+        try:
+            async for result in extractor:
+                yield result
+            await feeder
+        finally:
+            feeder.cancel()
+
+
+def _workers_arg(value):
+    return value if value == "auto" else int(value)
+
+
+def _native_threads_arg(value):
+    if value == "auto":
+        return value
+    if value == "none":
+        return None
+    return int(value)
+
+
+def _print_decision(record):
+    print(f"workers: {record['previous']} -> {record['limit']} "
+          f"({record['reason']})")
+
+
 def _main(argv=None):
     """Command-line entry point for standalone use.
 
@@ -578,20 +1605,107 @@ def _main(argv=None):
                         help="Bin lids to process (space-separated). Default: all.")
     parser.add_argument("--overwrite", action="store_true",
                         help="Overwrite existing outputs instead of skipping.")
-    parser.add_argument("--workers", type=int, default=1,
-                        help="Number of worker processes (default: 1).")
+    parser.add_argument("--workers", type=_workers_arg, default=1,
+                        help="Number of worker processes, or 'auto' to adjust "
+                             "it to the host as the run goes (default: 1).")
+    parser.add_argument("--max-workers", type=int,
+                        help="With --workers auto: most bins in flight "
+                             "(default: number of cores).")
+    parser.add_argument("--max-tasks-per-worker", type=int,
+                        help="Replace each worker process after this many "
+                             "bins, bounding its memory on long runs.")
+    parser.add_argument("--native-threads", type=_native_threads_arg,
+                        default="auto",
+                        help="Native library (BLAS/OpenMP) threads per "
+                             "worker: a number, 'auto' to divide the cores "
+                             "between workers (default), or 'none' to leave "
+                             "the libraries' defaults.")
+    parser.add_argument("--memory-budget",
+                        help="Memory the bins in flight may use together, "
+                             "e.g. 8G; bins wait while it is exhausted.")
+    parser.add_argument("--metrics",
+                        help="Publish live run metrics: a file rewritten "
+                             "every 15 s (OpenMetrics text, or JSON if it "
+                             "ends in .json), or a port to serve them on at "
+                             "127.0.0.1.")
     parser.add_argument("--feature-tag", default="features",
                         choices=["features", "fea"],
                         help="Token in the feature CSV name: 'features' -> "
                              "<lid>_features_v4.csv (default), 'fea' -> "
                              "<lid>_fea_v4.csv (IFCB Dashboard naming).")
+    parser.add_argument("--blob-format", choices=list(BLOB_FORMATS),
+                        default="zip",
+                        help="Write blobs as one zip of PNGs per bin (default) "
+                             "or as an indexed pack (see blob_store).")
+    parser.add_argument("--columns", nargs='+',
+                        help="Write only these feature columns and no blob "
+                             "archive (see extract_features).")
+    parser.add_argument("--psd-only", action="store_true",
+                        help="Write only the columns a particle size "
+                             "distribution needs, and no blob archive.")
+    parser.add_argument("--psd-dir",
+                        help="Also write each bin's size distribution "
+                             "summary (<lid>_psd.json) to this directory.")
+    parser.add_argument("--micron-factor", type=float, default=1/3.4,
+                        help="With --psd-dir: microns per pixel "
+                             "(default: 1/3.4).")
+    parser.add_argument("--queue-dir",
+                        help="Directory on a shared filesystem used as a work "
+                             "queue: start the same command on several nodes "
+                             "to split the bins between them.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and extract bins as they finish "
+                             "being written (stop with Ctrl-C).")
+    parser.add_argument("--state",
+                        help="With --watch: JSON file persisting the bins "
+                             "already handled across restarts.")
+    parser.add_argument("--poll-interval", type=float, default=10,
+                        help="With --watch: seconds between polls (default: 10).")
+    parser.add_argument("--settle-seconds", type=float, default=30,
+                        help="With --watch: seconds a bin's files must be "
+                             "unchanged to count as complete (default: 30).")
 
     args = parser.parse_args(argv)
+    columns = PSD_COLUMNS if args.psd_only else args.columns
 
     beginning = time.time()
-    out = extract_features(args.data_directory, args.features_directory,
-                           args.blobs_directory, args.bins, args.overwrite,
-                           args.workers, feature_tag=args.feature_tag)
+    if args.watch:
+        def _print_result(result):
+            print(f"{result['bin']}: {result['status']} {result['message']}".rstrip())
+        try:
+            out = watch_features(args.data_directory, args.features_directory,
+                                 args.blobs_directory, state_path=args.state,
+                                 poll_interval=args.poll_interval,
+                                 settle_seconds=args.settle_seconds,
+                                 overwrite=args.overwrite,
+                                 num_workers=args.workers,
+                                 max_workers=args.max_workers,
+                                 log=_print_decision,
+                                 callback=_print_result,
+                                 feature_tag=args.feature_tag,
+                                 columns=columns, psd_directory=args.psd_dir,
+                                 micron_factor=args.micron_factor,
+                                 maxtasksperchild=args.max_tasks_per_worker,
+                                 memory_budget=args.memory_budget,
+                                 blob_format=args.blob_format,
+                                 metrics=args.metrics,
+                                 native_threads=args.native_threads)
+        except KeyboardInterrupt:
+            return
+    else:
+        out = extract_features(args.data_directory, args.features_directory,
+                               args.blobs_directory, args.bins, args.overwrite,
+                               args.workers, feature_tag=args.feature_tag,
+                               max_workers=args.max_workers,
+                               log=_print_decision,
+                               queue_directory=args.queue_dir,
+                               columns=columns, psd_directory=args.psd_dir,
+                               micron_factor=args.micron_factor,
+                               maxtasksperchild=args.max_tasks_per_worker,
+                               memory_budget=args.memory_budget,
+                               blob_format=args.blob_format,
+                               metrics=args.metrics,
+                               native_threads=args.native_threads)
     elapsed = time.time() - beginning
 
     processed = sum(1 for r in out if r["status"] == "processed")
@@ -0,0 +1,350 @@
+"""Read raw IFCB bins from inside ZIP and tar archives.
+
+Raw data from the IFCB Dashboard and from cold storage usually comes as
+archived day folders. :class:`ArchiveReader` indexes the ``.hdr``, ``.adc``
+and ``.roi`` members of such archives and serves them through the same
+interface as the readers in ``ifcb_reader`` (``list_lids()``,
+``read_images(lid)``, ``read_metadata(lid)``, ``raw_paths(lid)``), so
+``extract_slim_features`` can process them in place, without unpacking them
+to scratch space first. Select it with ``backend="archive"``, or pass a
+single archive as the data directory.
+
+How a ``.roi`` member is read depends on how it is stored:
+
+  * uncompressed (a ZIP member ``ZIP_STORED``, or any member of an
+    uncompressed tar): the member is a contiguous byte range of the archive,
+    so each image is read with one seek and one read, as from a loose file;
+  * compressed (a deflated ZIP member, or a ``.tar.gz`` / ``.tar.bz2`` /
+    ``.tar.xz``): the member is decompressed as a stream while its images are
+    read in file order. A compressed tar cannot be entered in the middle, so
+    the reader keeps it open and reads its members in archive order: a pass
+    over the bins in lid order (as ``extract_slim_features`` makes)
+    decompresses each archive once. Going back to an earlier member restarts
+    decompression from the start of the archive.
+
+Images are decoded the way ``ifcbkit`` decodes D-style bins: each ADC row
+with a non-zero width and height is a ROI, numbered by its row (from 1),
+whose ``width x height`` bytes start at the row's byte offset in the
+``.roi``. Only D-style bins (``DYYYYMMDDTHHMMSS_IFCBnnn``) are indexed; the
+older I-style bins need ``ifcbkit``'s stitching and are not supported here.
+"""
+
+import os
+import re
+import shutil
+import struct
+import tarfile
+import tempfile
+import weakref
+import zipfile
+from collections.abc import Mapping
+
+import numpy as np
+
+#: File name endings recognised as archives.
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2',
+                    '.tar.xz', '.txz')
+
+#: ADC columns (0-based) holding a D-style ROI's width, height and offset.
+ADC_WIDTH, ADC_HEIGHT, ADC_START_BYTE = 15, 16, 17
+
+_MEMBER = re.compile(r'(?:^|/)(D\d{8}T\d{6}_IFCB\d+)\.(hdr|adc|roi)$')
+
+# Fixed part of a ZIP local file header, which precedes a member's data.
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+
+
+def is_archive(path):
+    """Return True if ``path`` names a file with an archive suffix."""
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+class _Member:
+    """One ``.hdr``, ``.adc`` or ``.roi`` member of an archive."""
+
+    def __init__(self, archive, kind, name, size, offset=None, info=None,
+                 position=0):
+        self.archive = archive
+        self.kind = kind  # "zip" or "tar"
+        self.name = name
+        self.size = size
+        # Absolute offset of the member's data when it is stored uncompressed
+        # (the archive file can then be read directly), otherwise None.
+        self.offset = offset
+        # The TarInfo of a compressed tar member, which extractfile() is given
+        # instead of the name: looking a name up makes tarfile read (and so
+        # decompress) the whole archive to list its members.
+        self.info = info
+        # Where the member sits in the archive, to read a bin's members in
+        # archive order.
+        self.position = position
+
+    def open(self, tar=None):
+        """Return ``(file, close)``: a binary file object positioned at the
+        start of the member's data, and a function that releases it.
+
+        ``tar`` is an already open ``TarFile`` of the member's archive, kept
+        by the caller so consecutive members of a compressed tar are reached
+        by decompressing forward from the last one.
+        """
+        if self.offset is not None:
+            f = open(self.archive, 'rb')
+            f.seek(self.offset)
+            return f, f.close
+        if self.kind == "zip":
+            zf = zipfile.ZipFile(self.archive)
+            f = zf.open(self.name)
+
+            def close():
+                f.close()
+                zf.close()
+            return f, close
+        if tar is not None:
+            f = tar.extractfile(self.info)
+            return f, f.close
+        tf = tarfile.open(self.archive)
+        f = tf.extractfile(self.info)
+
+        def close():
+            f.close()
+            tf.close()
+        return f, close
+
+
+def _zip_data_offset(f, info):
+    # The central directory gives the local header's position; the data
+    # follows the local header's own (possibly different) name and extra
+    # fields.
+    f.seek(info.header_offset)
+    fields = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+    name_length, extra_length = fields[-2], fields[-1]
+    return info.header_offset + _LOCAL_HEADER.size + name_length + extra_length
+
+
+def _index_zip(path):
+    members = []
+    with zipfile.ZipFile(path) as zf, open(path, 'rb') as f:
+        for info in zf.infolist():
+            match = _MEMBER.search(info.filename)
+            if not match or info.is_dir():
+                continue
+            offset = None
+            if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+                offset = _zip_data_offset(f, info)
+            member = _Member(path, "zip", info.filename, info.file_size,
+                             offset, position=info.header_offset)
+            members.append((match.group(1), match.group(2), member))
+    return members
+
+
+def _index_tar(path):
+    members = []
+    compressed = not path.lower().endswith('.tar')
+    with tarfile.open(path) as tf:
+        for info in tf:
+            match = _MEMBER.search(info.name)
+            if not match or not info.isfile():
+                continue
+            if compressed:
+                member = _Member(path, "tar", info.name, info.size,
+                                 info=info, position=info.offset_data)
+            else:
+                member = _Member(path, "tar", info.name, info.size,
+                                 info.offset_data, position=info.offset_data)
+            members.append((match.group(1), match.group(2), member))
+    return members
+
+
+def _roi_table(adc_bytes):
+    """Return ``{roi_number: (start_byte, height, width)}`` from an ADC file."""
+    rois = {}
+    for number, line in enumerate(adc_bytes.decode('ascii').splitlines(),
+                                  start=1):
+        fields = line.split(',')
+        if len(fields) <= ADC_START_BYTE:
+            continue
+        width = int(float(fields[ADC_WIDTH]))
+        height = int(float(fields[ADC_HEIGHT]))
+        if width > 0 and height > 0:
+            rois[number] = (int(float(fields[ADC_START_BYTE])), height, width)
+    return rois
+
+
+class ArchiveImages(Mapping):
+    """The images of one archived bin, ``{roi_number: uint8 array}``.
+
+    Images are read on access. Iterating :meth:`items` reads them in file
+    order through one open member, which is what a whole-bin pass (feature
+    extraction) uses; indexing reads a single image. ``open`` opens the
+    member (by default :meth:`_Member.open`).
+    """
+
+    def __init__(self, member, rois, open=None):
+        self._member = member
+        self._rois = rois
+        self._open = open or member.open
+
+    def __len__(self):
+        return len(self._rois)
+
+    def __iter__(self):
+        return iter(sorted(self._rois))
+
+    def __getitem__(self, roi_number):
+        start, height, width = self._rois[roi_number]
+        f, close = self._open()
+        try:
+            if self._member.offset is not None:
+                f.seek(self._member.offset + start)
+            else:
+                f.seek(start)
+            return self._decode(f.read(height * width), height, width,
+                                roi_number)
+        finally:
+            close()
+
+    @staticmethod
+    def _decode(data, height, width, roi_number):
+        if len(data) != height * width:
+            raise ValueError(f"ROI {roi_number} is truncated in the .roi file")
+        return np.frombuffer(data, dtype=np.uint8).reshape(height, width)
+
+    def items(self):
+        order = sorted(self._rois.items(), key=lambda item: item[1][0])
+        f, close = self._open()
+        try:
+            position = 0
+            for roi_number, (start, height, width) in order:
+                if self._member.offset is not None:
+                    f.seek(self._member.offset + start)
+                elif start > position:
+                    f.read(start - position)  # stream forward over a gap
+                elif start < position:
+                    f.seek(start)
+                data = f.read(height * width)
+                position = start + len(data)
+                yield roi_number, self._decode(data, height, width, roi_number)
+        finally:
+            close()
+
+
+class ArchiveReader:
+    """Read raw IFCB bins stored in ZIP or tar archives.
+
+    The archives are indexed once, when the reader is created. A reader
+    pickles (and copies) without its open files, so the index can be built
+    once and handed to pool workers, each of which then opens the archives
+    for itself.
+
+    Args:
+        data_directory (str): A single archive, or a directory searched
+            recursively for archives (see ``ARCHIVE_SUFFIXES``). A bin is
+            listed when its ``.hdr``, ``.adc`` and ``.roi`` are all found,
+            which may be in different archives.
+    """
+
+    backend = "archive"
+
+    def __init__(self, data_directory):
+        if is_archive(data_directory):
+            archives = [data_directory]
+        elif os.path.isdir(data_directory):
+            archives = sorted(
+                os.path.join(folder, name)
+                for folder, _, names in os.walk(data_directory)
+                for name in names if name.lower().endswith(ARCHIVE_SUFFIXES))
+        else:
+            raise FileNotFoundError(
+                f"data directory not found: {data_directory}")
+        self.data_directory = data_directory
+
+        files = {}
+        for archive in archives:
+            index = (_index_zip if archive.lower().endswith('.zip')
+                     else _index_tar)
+            for lid, extension, member in index(archive):
+                files.setdefault(lid, {})[extension] = member
+        self._bins = {lid: members for lid, members in files.items()
+                      if len(members) == 3}
+        self._reset()
+
+    def _reset(self):
+        # State tied to this reader's open files, which is not shared.
+        self._tar = None  # (path, TarFile) of the compressed tar last read
+        self._metadata = None  # (lid, {"hdr": bytes, "adc": bytes})
+        self._extracted = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_tar', '_metadata', '_extracted'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def list_lids(self):
+        return sorted(self._bins)
+
+    def _members(self, lid):
+        try:
+            return self._bins[lid]
+        except KeyError:
+            raise KeyError(lid) from None
+
+    def _open(self, member):
+        """Open ``member``, through the kept ``TarFile`` for a compressed
+        tar. Only the last archive used is kept open: bins in lid order come
+        from one archive after another."""
+        if member.info is None:
+            return member.open()
+        if self._tar is None or self._tar[0] != member.archive:
+            if self._tar is not None:
+                self._tar[1].close()
+            self._tar = (member.archive, tarfile.open(member.archive))
+        return member.open(self._tar[1])
+
+    def _read(self, member):
+        f, close = self._open(member)
+        try:
+            return f.read(member.size)
+        finally:
+            close()
+
+    def read_metadata(self, lid):
+        """Return ``{"hdr": bytes, "adc": bytes}``, the contents of ``lid``'s
+        ``.hdr`` and ``.adc``. They are read together, in archive order, and
+        the last bin's are kept, so :meth:`read_images` and a following
+        header read do not go back in a compressed tar."""
+        if self._metadata is None or self._metadata[0] != lid:
+            members = self._members(lid)
+            contents = {}
+            for extension in sorted(('hdr', 'adc'),
+                                    key=lambda e: members[e].position):
+                contents[extension] = self._read(members[extension])
+            self._metadata = (lid, contents)
+        return self._metadata[1]
+
+    def read_images(self, lid):
+        members = self._members(lid)
+        rois = _roi_table(self.read_metadata(lid)['adc'])
+        return ArchiveImages(members['roi'], rois,
+                             open=lambda: self._open(members['roi']))
+
+    def raw_paths(self, lid):
+        """Return ``(hdr, adc)`` paths for ``lid``. The two are small, so they
+        are copied out of the archive to a temporary directory that is removed
+        with the reader."""
+        if self._extracted is None:
+            self._extracted = tempfile.mkdtemp(prefix="irfcb_archive_")
+            weakref.finalize(self, shutil.rmtree, self._extracted, True)
+        contents = self.read_metadata(lid)
+        paths = []
+        for extension in ('hdr', 'adc'):
+            path = os.path.join(self._extracted, f"{lid}.{extension}")
+            if not os.path.exists(path):
+                with open(path, 'wb') as f:
+                    f.write(contents[extension])
+            paths.append(path)
+        return tuple(paths)
@@ -0,0 +1,202 @@
+"""Worker-pool helpers shared by the bundled IFCB processing engines.
+
+The engines in this directory (``extract_slim_features``, ``extract_pngs``)
+process bins in a ``multiprocessing.Pool`` or, when Python is embedded in R on
+Windows / macOS, a ``multiprocessing.pool.ThreadPool``. Starting a process pool
+from an embedded interpreter needs two preparatory steps, collected here so
+every engine takes them the same way; see :func:`create_pool`.
+
+Each worker also runs numpy / scipy / scikit-image code whose native
+libraries (OpenBLAS, MKL, OpenMP) start a thread per core of their own, so
+``N`` workers on ``N`` cores can run ``N * N`` threads that slow each other
+down as workers are added. :func:`create_pool` can give each worker a share
+of the cores instead; see :func:`limit_native_threads`.
+"""
+
+import contextlib
+import multiprocessing
+import os
+import sys
+
+#: Environment variables the native thread pools (OpenMP, OpenBLAS, MKL,
+#: BLIS, Apple Accelerate, numexpr) read when they are first loaded.
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'BLIS_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+)
+
+
+def ensure_module_importable():
+    """Add this module's directory to PYTHONPATH if needed.
+
+    On Linux, multiprocessing uses fork and workers inherit sys.path, so the
+    bundled modules are already importable. On Windows and macOS,
+    multiprocessing uses spawn: workers start as fresh Python processes and
+    only inherit environment variables, not sys.path. Setting PYTHONPATH here
+    (before Pool() starts the workers) ensures spawn workers can import the
+    engine module to unpickle the task function.
+    """
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    current = os.environ.get('PYTHONPATH', '')
+    parts = [p for p in current.split(os.pathsep) if p]
+    if module_dir not in parts:
+        os.environ['PYTHONPATH'] = os.pathsep.join([module_dir] + parts)
+
+
+def ensure_spawn_executable(python_executable=None):
+    """Point multiprocessing at a real Python interpreter for spawn workers.
+
+    Companion to ensure_module_importable(). On Windows and macOS,
+    multiprocessing uses spawn, which relaunches the interpreter named by
+    sys.executable to start each worker. When Python is embedded in another
+    program - as it is here, running inside R via reticulate - sys.executable
+    often points at the host process (e.g. Rterm.exe / the R binary), not a
+    usable Python. Spawn workers are then launched as the wrong process, never
+    run the bootstrap, and the apply_async results never become ready(): the
+    polling loop hangs forever with no error or warning.
+
+    Setting the multiprocessing executable to the actual interpreter fixes this.
+    The path is supplied by the R caller via reticulate::py_exe(); if it is not
+    given we fall back to sys.executable. Under fork (Linux) nothing is
+    relaunched, so this is a no-op there.
+    """
+    if multiprocessing.get_start_method(allow_none=False) == 'fork':
+        return
+    exe = python_executable or sys.executable
+    if exe and os.path.exists(exe):
+        multiprocessing.set_executable(exe)
+
+
+def threads_per_worker(num_workers, native_threads="auto"):
+    """Resolve a ``native_threads`` setting to a thread count per worker.
+
+    ``"auto"`` divides the cores evenly between ``num_workers`` workers (at
+    least one thread each), but never exceeds a limit already set in this
+    process's environment (``THREAD_ENV_VARS`` or ``OMP_THREAD_LIMIT``; iRfcb
+    sets them to 1 when R loads it). An integer is used as given, and None
+    returns None: the libraries are left at their defaults.
+    """
+    if native_threads is None:
+        return None
+    if native_threads == "auto":
+        threads = max(1, (os.cpu_count() or 1) // max(1, int(num_workers)))
+        for name in THREAD_ENV_VARS + ('OMP_THREAD_LIMIT',):
+            try:
+                threads = min(threads, max(1, int(os.environ[name])))
+            except (KeyError, ValueError):
+                pass
+        return threads
+    threads = int(native_threads)
+    if threads < 1:
+        raise ValueError(f"native_threads must be at least 1, not {threads}")
+    return threads
+
+
+def limit_native_threads(threads, environment=True):
+    """Limit this process's native library thread pools to ``threads``.
+
+    A library reads its environment variable (``THREAD_ENV_VARS``) only when
+    it is loaded, so setting them covers libraries imported afterwards; this
+    is skipped with ``environment=False``. Libraries already loaded - numpy's
+    BLAS in a forked worker, or anything in the interpreter R embeds - are
+    limited through ``threadpoolctl`` when it is installed, and left as they
+    are otherwise.
+
+    Returns:
+        The ``threadpoolctl.threadpool_limits`` in effect, whose
+        ``restore_original_limits()`` undoes it, or None without
+        threadpoolctl.
+    """
+    if environment:
+        for name in THREAD_ENV_VARS:
+            os.environ[name] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return None
+    return threadpool_limits(limits=threads)
+
+
+@contextlib.contextmanager
+def _thread_environment(threads):
+    # Spawned workers take the parent's environment when they start, before
+    # they import numpy, so their libraries start at the limit.
+    saved = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _limited_initializer(threads, initializer, initargs):
+    limit_native_threads(threads)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def create_pool(num_workers, use_threads=False, python_executable=None,
+                initializer=None, initargs=(), maxtasksperchild=None,
+                native_threads=None):
+    """Create the worker pool an engine dispatches its bins to.
+
+    Args:
+        num_workers (int): Number of workers (at least one is started).
+        use_threads (bool): If True, return a ``ThreadPool``: workers are
+            threads in this interpreter, so there is no spawn, no pickling and
+            no child-process bootstrap. This is the reliable choice when Python
+            is embedded (reticulate) on Windows / macOS, where process spawn
+            from an embedded interpreter hangs. If False (default), return a
+            process ``Pool`` for true multi-core parallelism; safe under fork
+            (Linux).
+        python_executable (str, optional): Real Python interpreter for spawn
+            workers; see :func:`ensure_spawn_executable`.
+        initializer (callable, optional): Called as ``initializer(*initargs)``
+            in each worker as it starts, to build per-worker state once rather
+            than per task. Must be a module-level function for a process pool.
+        initargs (tuple): Arguments for ``initializer``.
+        maxtasksperchild (int, optional): Replace a worker process with a
+            fresh one after it has run this many tasks, which bounds the
+            memory a long run can accumulate in a worker. None (default)
+            keeps workers for the life of the pool. Ignored for a thread
+            pool, whose workers share this interpreter's memory.
+        native_threads (int, optional): Limit the native library threads of
+            each worker process to this many (see
+            :func:`threads_per_worker` for a share of the cores). The limit
+            is in the environment each worker starts with and is applied
+            again, through threadpoolctl, before ``initializer``, so it also
+            holds for libraries a forked worker inherits already loaded.
+            Ignored for a thread pool, whose workers share one set of
+            libraries: limit those with :func:`limit_native_threads`.
+
+    Returns:
+        multiprocessing.pool.Pool: the pool.
+    """
+    num_workers = max(1, int(num_workers))
+    if use_threads:
+        from multiprocessing.pool import ThreadPool
+        return ThreadPool(processes=num_workers, initializer=initializer,
+                          initargs=initargs)
+    ensure_module_importable()
+    ensure_spawn_executable(python_executable)
+    if maxtasksperchild is not None:
+        maxtasksperchild = max(1, int(maxtasksperchild))
+    if native_threads is None:
+        return multiprocessing.Pool(processes=num_workers,
+                                    initializer=initializer,
+                                    initargs=initargs,
+                                    maxtasksperchild=maxtasksperchild)
+    with _thread_environment(native_threads):
+        return multiprocessing.Pool(
+            processes=num_workers, initializer=_limited_initializer,
+            initargs=(native_threads, initializer, initargs),
+            maxtasksperchild=maxtasksperchild)
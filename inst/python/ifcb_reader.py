@@ -33,14 +33,59 @@ ifcb-features releases depend on and it carries far fewer dependencies. Pass
 driven from R, the environment variable is read on the R side and forwarded as
 ``backend``: Python snapshots ``os.environ`` at interpreter start, so a
 ``Sys.setenv()`` call made after Python has initialised would not be seen here.
+
+A third backend, ``"archive"`` (see ``ifcb_archive``), reads bins from inside
+ZIP and tar archives of raw data without unpacking them. It needs neither
+reader and decodes D-style bins as ``ifcbkit`` does. It is never chosen by
+default for a directory, since it ignores loose files; pass
+``backend="archive"``, or a single archive as the data directory.
 """
 
+import copy
 import os
+import threading
+
+from ifcb_archive import ArchiveReader, is_archive
 
 #: Environment variable used to force a particular backend.
 BACKEND_ENV_VAR = "IRFCB_IFCB_BACKEND"
 
 
+def find_raw_files(data_directory, lid):
+    """Return the ``(hdr, adc)`` paths of bin ``lid`` under ``data_directory``.
+
+    Neither reader exposes the paths of a bin's files through a common API, so
+    they are located directly: first in the layouts IFCB archives use (flat,
+    ``DYYYYMMDD/`` day folders, and ``YYYY/DYYYYMMDD/``), then by a recursive
+    search. Raises KeyError if the bin has no ``.hdr`` and ``.adc``.
+    """
+    day = lid[:9]
+    for folder in (data_directory,
+                   os.path.join(data_directory, day),
+                   os.path.join(data_directory, day[1:5], day)):
+        hdr = os.path.join(folder, f"{lid}.hdr")
+        adc = os.path.join(folder, f"{lid}.adc")
+        if os.path.exists(hdr) and os.path.exists(adc):
+            return hdr, adc
+    for folder, _, files in os.walk(data_directory):
+        if f"{lid}.hdr" in files and f"{lid}.adc" in files:
+            return (os.path.join(folder, f"{lid}.hdr"),
+                    os.path.join(folder, f"{lid}.adc"))
+    raise KeyError(lid)
+
+
+def read_raw_files(data_directory, lid):
+    """Return ``{"hdr": bytes, "adc": bytes}``, the contents of bin ``lid``'s
+    ``.hdr`` and ``.adc`` under ``data_directory`` (see
+    :func:`find_raw_files`)."""
+    contents = {}
+    for extension, path in zip(('hdr', 'adc'),
+                               find_raw_files(data_directory, lid)):
+        with open(path, 'rb') as f:
+            contents[extension] = f.read()
+    return contents
+
+
 def _import_ifcbkit():
     import ifcbkit
     return ifcbkit
@@ -65,6 +110,7 @@ class IfcbkitReader:
                 f"data directory not found: {data_directory}")
         self._parse_pid = ifcbkit.parse_pid
         self._dd = ifcbkit.SyncIfcbDataDirectory(data_directory)
+        self.data_directory = data_directory
 
     def _lid(self, pid):
         # parse_pid normalises a ROI-suffixed pid down to its bin lid. It raises
@@ -84,6 +130,12 @@ class IfcbkitReader:
         # would scan the data directory a second time for every bin.
         return self._dd.read_images(lid)
 
+    def raw_paths(self, lid):
+        return find_raw_files(self.data_directory, lid)
+
+    def read_metadata(self, lid):
+        return read_raw_files(self.data_directory, lid)
+
 
 class PyifcbReader:
     """Read raw IFCB data via ``pyifcb`` (ifcb-features <= 1.0.0)."""
@@ -93,6 +145,7 @@ class PyifcbReader:
     def __init__(self, data_directory):
         ifcb = _import_pyifcb()
         self._dd = ifcb.DataDirectory(data_directory)
+        self.data_directory = data_directory
 
     def list_lids(self):
         return [sample.lid for sample in self._dd]
@@ -102,6 +155,15 @@ class PyifcbReader:
         # ifcbkit reader above.
         return self._dd[lid].images
 
+    def raw_paths(self, lid):
+        return find_raw_files(self.data_directory, lid)
+
+    def read_metadata(self, lid):
+        return read_raw_files(self.data_directory, lid)
+
+
+#: Name of the backend that reads from ZIP / tar archives (ifcb_archive).
+ARCHIVE_BACKEND = "archive"
 
 #: Readers in preference order, as (backend name, import check, class) triples.
 _READERS = (
@@ -127,13 +189,16 @@ def open_data_directory(data_directory, backend=None):
 
     Args:
         data_directory (str): Path to a directory of raw IFCB data.
-        backend (str, optional): Force a specific backend, ``"ifcbkit"`` or
-            ``"pyifcb"``. Defaults to the ``IRFCB_IFCB_BACKEND`` environment
-            variable, or to the first available reader in preference order.
+        backend (str, optional): Force a specific backend, ``"ifcbkit"``,
+            ``"pyifcb"`` or ``"archive"``. Defaults to the
+            ``IRFCB_IFCB_BACKEND`` environment variable, to ``"archive"``
+            when ``data_directory`` is itself an archive, or to the first
+            available reader in preference order.
 
     Returns:
-        IfcbkitReader or PyifcbReader: a reader exposing ``list_lids()`` and
-        ``read_images(lid)``.
+        IfcbkitReader, PyifcbReader or ArchiveReader: a reader exposing
+        ``list_lids()``, ``read_images(lid)``, ``read_metadata(lid)`` (the
+        ``.hdr`` and ``.adc`` contents, as bytes) and ``raw_paths(lid)``.
 
     Raises:
         ValueError: if a named backend is unknown.
@@ -141,13 +206,16 @@ def open_data_directory(data_directory, backend=None):
             is not installed.
     """
     requested = backend or os.environ.get(BACKEND_ENV_VAR) or None
+    if requested == ARCHIVE_BACKEND or (requested is None
+                                        and is_archive(data_directory)):
+        return ArchiveReader(data_directory)
 
     if requested is not None:
         known = {name: (importer, cls) for name, importer, cls in _READERS}
         if requested not in known:
             raise ValueError(
                 f"Unknown IFCB raw-data backend {requested!r}; "
-                f"expected one of {', '.join(known)}.")
+                f"expected one of {', '.join(list(known) + [ARCHIVE_BACKEND])}.")
         importer, reader_class = known[requested]
         try:
             importer()
@@ -169,3 +237,63 @@ def open_data_directory(data_directory, backend=None):
         "package, which provides one: releases >= 1.1.0 depend on 'ifcbkit', "
         "earlier releases on 'pyifcb'."
     )
+
+
+def shared_reader(data_directory, backend=None):
+    """Return an :class:`ifcb_archive.ArchiveReader` for ``data_directory``
+    when it is read through archives, otherwise None.
+
+    Indexing archives means reading through them (all of a compressed tar),
+    so a pool's parent builds the index once, with this, and hands it to
+    every worker through :func:`init_worker_reader`. The other readers are
+    opened by each worker.
+    """
+    if backend == ARCHIVE_BACKEND or (backend is None
+                                      and is_archive(data_directory)):
+        return ArchiveReader(data_directory)
+    return None
+
+
+# Readers kept by pool workers. Thread-local, so that each thread of a
+# ThreadPool keeps a reader of its own (neither reader is documented as
+# thread-safe), while a worker process keeps the one of its single thread.
+_worker_state = threading.local()
+
+
+def init_worker_reader(data_directory, backend=None, reader=None):
+    """Pool initializer: give this worker a reader kept for its bins.
+
+    ``reader`` is one built by the parent (see :func:`shared_reader`), of
+    which the worker keeps a copy: it shares the index but not the open
+    files, since the threads of a ThreadPool are all given the parent's
+    object. Otherwise the worker opens its own; a failure to is left for its
+    bins to report. Only pool workers should keep a reader: one kept in the
+    caller's thread (R's, when run sequentially) would outlive the run and
+    go stale; see :func:`drop_worker_reader`.
+    """
+    if reader is not None:
+        _worker_state.reader = copy.copy(reader)
+        _worker_state.key = (data_directory, backend)
+        return
+    try:
+        worker_reader(data_directory, backend)
+    except Exception:  # noqa: BLE001 - reported by the bins that need it
+        # An initializer that raises kills the worker, and a process pool
+        # would restart it forever.
+        pass
+
+
+def worker_reader(data_directory, backend=None, refresh=False):
+    """Return this worker's reader for ``data_directory``, opening it on first
+    use (or again when ``refresh`` is set)."""
+    key = (data_directory, backend)
+    if refresh or getattr(_worker_state, "key", None) != key:
+        _worker_state.reader = open_data_directory(data_directory,
+                                                   backend=backend)
+        _worker_state.key = key
+    return _worker_state.reader
+
+
+def drop_worker_reader():
+    """Forget the reader kept for this thread, if any."""
+    _worker_state.__dict__.clear()
@@ -0,0 +1,274 @@
+"""Apply the same edits to many MATLAB .mat files in one call.
+
+Relabelling classes across a project (``ifcb_replace_mat_values()``,
+``ifcb_correct_annotation()``, ``ifcb_adjust_classes()`` in R) rewrites
+thousands of manual files. :func:`rewrite_mat_files` does it in one call from
+R: each file is read, edited and written back by a pool worker, and a summary
+per file is returned.
+
+Edits are plain dicts, so they pass unchanged from R:
+
+  * ``{"op": "map", "variable": "classlist", "column": 1, "from": [99],
+    "to": [1]}`` replaces values in one column of a numeric variable (0-based
+    ``column``; None for every column), each ``from`` value by the ``to``
+    value at the same position;
+  * ``{"op": "set", "variable": "classlist", "column": 1, "rows": [3, 7],
+    "value": 5}`` sets rows of a column (1-based, like ROI numbers) to a
+    value. ``rows`` may instead be a dict from file name, without its
+    directory or ``.mat``, to that file's rows; files missing from it are
+    left as they are;
+  * ``{"op": "assign", "variable": "class2use_manual", "value": [...],
+    "shape": "row", "if_present": False}`` replaces a variable with a cell
+    array of strings, as a row (1 x N) or column (N x 1); with
+    ``if_present`` only files that already hold the variable are changed.
+
+Files are read with ``scipy.io.loadmat`` unsqueezed, so every variable keeps
+its MATLAB class and dimensions, and written with ``scipy.io.savemat`` under a
+temporary name that is moved into place once complete. A file whose variables
+would not change is not rewritten. MATLAB v7.3 files, which scipy cannot
+write, are reported as errors (see ``read_mat_file.is_hdf5_mat``).
+"""
+
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+from ifcb_pool import create_pool
+from read_mat_file import is_hdf5_mat
+
+OPERATIONS = ("map", "set", "assign")
+
+
+def _name(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def _as_list(value):
+    # reticulate passes a length-1 R vector as a scalar.
+    if value is None:
+        return []
+    if isinstance(value, (str, bytes)) or np.ndim(value) == 0:
+        return [value]
+    return list(value)
+
+
+def _column(array, column, variable):
+    if array.ndim != 2:
+        raise ValueError(f"{variable} is not a matrix")
+    if column is None:
+        return slice(None)
+    column = int(column)
+    if not 0 <= column < array.shape[1]:
+        raise ValueError(
+            f"column {column} is out of range for {variable}, which has "
+            f"{array.shape[1]} column(s) (valid 0-based columns: "
+            f"0:{array.shape[1] - 1})")
+    return column
+
+
+def _numeric(data, variable):
+    if variable not in data:
+        raise ValueError(f"no {variable} found in the file")
+    array = data[variable]
+    if not isinstance(array, np.ndarray) or array.dtype.kind not in 'biuf':
+        raise ValueError(f"{variable} is not a numeric array")
+    return array
+
+
+def _cell(strings, shape):
+    cell = np.empty(shape, dtype=object)
+    for index, text in zip(np.ndindex(shape), strings):
+        cell[index] = np.array([str(text)])
+    return cell
+
+
+def _same_cell(a, b):
+    return (a.shape == b.shape and a.dtype == b.dtype
+            and all(np.array_equal(x, y) for x, y in zip(a.flat, b.flat)))
+
+
+def _apply(data, operation, file_path):
+    """Apply one edit to ``data`` in place; return the number of values it
+    changed."""
+    op = operation.get("op")
+    variable = operation.get("variable")
+
+    if op == "map":
+        array = _numeric(data, variable)
+        column = _column(array, operation.get("column"), variable)
+        sources = _as_list(operation.get("from"))
+        targets = _as_list(operation.get("to"))
+        if len(sources) != len(targets):
+            raise ValueError("'from' and 'to' must have the same length")
+        edited = array.copy()
+        selected = array[:, column]
+        for source, target in zip(sources, targets):
+            # Compare against the original values, so a chain such as
+            # 1 -> 2, 2 -> 3 maps each value once.
+            edited[:, column] = np.where(selected == source, target,
+                                         edited[:, column])
+    elif op == "set":
+        array = _numeric(data, variable)
+        column = _column(array, operation.get("column"), variable)
+        rows = operation.get("rows")
+        if isinstance(rows, dict):
+            rows = rows.get(_name(file_path))
+        rows = np.asarray(_as_list(rows), dtype=np.int64)
+        out_of_range = rows[(rows < 1) | (rows > array.shape[0])]
+        if out_of_range.size:
+            raise ValueError(
+                f"rows {out_of_range.tolist()} are outside the range "
+                f"1:{array.shape[0]} of {variable}")
+        edited = array.copy()
+        edited[rows - 1, column] = operation.get("value")
+    elif op == "assign":
+        if operation.get("if_present") and variable not in data:
+            return 0
+        strings = [str(s) for s in _as_list(operation.get("value"))]
+        shape = ((len(strings), 1) if operation.get("shape") == "column"
+                 else (1, len(strings)))
+        edited = _cell(strings, shape)
+        current = data.get(variable)
+        if isinstance(current, np.ndarray) and _same_cell(current, edited):
+            return 0
+        data[variable] = edited
+        return len(strings)
+    else:
+        raise ValueError(f"unknown operation {op!r}; expected one of "
+                         f"{', '.join(OPERATIONS)}")
+
+    changed = int(np.count_nonzero(
+        ~((edited == array) | (np.isnan(edited) & np.isnan(array))
+          if array.dtype.kind == 'f' else edited == array)))
+    if changed:
+        data[variable] = edited.astype(array.dtype, copy=False)
+    return changed
+
+
+def _write_atomic(file_path, data, do_compression):
+    import scipy.io
+
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        # A file object, since savemat would append '.mat' to this name.
+        with open(tmp_path, 'wb') as f:
+            scipy.io.savemat(f, data, do_compression=do_compression)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _rewrite_one(file_path, output_path, operations, do_compression):
+    """Edit one file; a module-level function so a process pool can run it.
+    Failures are reported in the summary rather than raised, so one bad file
+    does not abort the batch."""
+    summary = {"file": file_path, "output": output_path, "status": "error",
+               "changed": 0, "message": ""}
+    try:
+        if os.path.getsize(file_path) == 0:
+            summary.update(status="skipped", message="empty file")
+            return summary
+        if is_hdf5_mat(file_path):
+            raise ValueError("MATLAB v7.3 (HDF5) files cannot be rewritten")
+
+        import scipy.io
+
+        data = scipy.io.loadmat(file_path, squeeze_me=False)
+        data = {name: value for name, value in data.items()
+                if not name.startswith('__')}
+        changed = sum(_apply(data, operation, file_path)
+                      for operation in operations)
+        summary["changed"] = changed
+
+        if changed:
+            _write_atomic(output_path, data, do_compression)
+            summary["status"] = "updated"
+        else:
+            # Nothing to re-encode: leave the file in place, or copy it as is.
+            if os.path.abspath(output_path) != os.path.abspath(file_path):
+                tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+                shutil.copyfile(file_path, tmp_path)
+                os.replace(tmp_path, output_path)
+            summary["status"] = "unchanged"
+    except Exception as e:  # noqa: BLE001 - reported per file
+        summary["message"] = str(e)
+    return summary
+
+
+def rewrite_mat_files(file_paths, operations, output_directory=None,
+                      num_workers=1, use_threads=False,
+                      python_executable=None, do_compression=True):
+    """Apply ``operations`` to each of ``file_paths``.
+
+    Args:
+        file_paths (str or list): MAT files to edit.
+        operations (dict or list): Edits, applied in order to every file;
+            see the module docstring.
+        output_directory (str, optional): Directory the edited files are
+            written to, under their own names; created if needed. If None
+            (default), files are rewritten in place.
+        num_workers (int): Files edited at a time. 1 (default) runs
+            sequentially; more use a pool (worker processes, or threads with
+            ``use_threads``; see ``ifcb_pool.create_pool``).
+        use_threads (bool): Use a thread pool rather than processes.
+        python_executable (str, optional): Real Python interpreter for spawn
+            workers, e.g. ``reticulate::py_exe()`` from R.
+        do_compression (bool): Compress the written files (default).
+
+    Returns:
+        list[dict]: One summary per file, in the order given: ``file``,
+        ``output``, ``status`` ("updated", "unchanged", "skipped" for an
+        empty file, or "error"), ``changed`` (the number of values edited)
+        and ``message``.
+    """
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+    file_paths = [str(path) for path in file_paths]
+    if isinstance(operations, dict):
+        operations = [operations]
+    operations = [dict(operation) for operation in operations]
+    for operation in operations:
+        if operation.get("op") not in OPERATIONS:
+            raise ValueError(f"unknown operation {operation.get('op')!r}; "
+                             f"expected one of {', '.join(OPERATIONS)}")
+    if output_directory is not None:
+        os.makedirs(output_directory, exist_ok=True)
+
+    tasks = [(path,
+              path if output_directory is None
+              else os.path.join(output_directory, os.path.basename(path)),
+              operations, do_compression)
+             for path in file_paths]
+    num_workers = max(1, int(num_workers))
+    if num_workers <= 1 or len(tasks) <= 1:
+        return [_rewrite_one(*task) for task in tasks]
+
+    pool = create_pool(min(num_workers, len(tasks)), use_threads,
+                       python_executable)
+    try:
+        # starmap preserves the input order of the files.
+        return pool.starmap(_rewrite_one, tasks)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def r_rewrite_mat_files(file_paths, operations, output_directory=None,
+                        num_workers=1, use_threads=False,
+                        python_executable=None, do_compression=True):
+    """
+    Wrapper function to be used in R via reticulate.
+
+    As :func:`rewrite_mat_files`, but the summaries are returned as columns
+    (a dict of equal-length lists), which R turns into a data frame in one
+    conversion.
+    """
+    summaries = rewrite_mat_files(file_paths, operations, output_directory,
+                                  num_workers, use_threads, python_executable,
+                                  do_compression)
+    keys = ("file", "output", "status", "changed", "message")
+    return {key: [summary[key] for summary in summaries] for key in keys}
@@ -41,18 +41,47 @@ Class overview:
 """
 
 import os
+import importlib.util
 import pandas as pd
 import numpy as np
 import re
-from matplotlib import pyplot as plt
 from math import floor, log10
-from scipy.optimize import curve_fit
+# Modified from the original by kudelalabs: matplotlib and scipy.optimize are
+# imported in the methods that use them (Sample.plot_PSD, Bin.aggregate), so
+# sourcing this file does not pay for them
 import datetime as dt
 import json
 import operator
 from types import SimpleNamespace
 
 
+# Modified from the original by kudelalabs to read only the feature columns the
+# PSD uses, and to read columnar feature files
+#: The feature columns Target reads.
+PSD_FEATURE_COLUMNS = ['Biovolume', 'EquivDiameter', 'MajorAxisLength', 'MinorAxisLength']
+
+
+def read_feature_table(path, columns=None, engine=None):
+    '''Reads a feature table, restricted to ``columns`` when given.
+
+    ``path`` may name a .csv file or leave the extension off. A .parquet or
+    .feather file of the same name is preferred to the CSV when present, since
+    columnar files are read without parsing text and only the requested
+    columns are touched. CSVs are parsed with the pyarrow engine when pyarrow
+    is installed, or with ``engine`` if given, and only the requested columns
+    are converted. V2 feature files from the MATLAB pipeline carry several
+    hundred columns, of which the PSD needs four.'''
+
+    stem = path[:-4] if path.endswith('.csv') else path
+    if os.path.exists(stem + '.parquet'):
+        return pd.read_parquet(stem + '.parquet', columns=columns)
+    if os.path.exists(stem + '.feather'):
+        return pd.read_feather(stem + '.feather', columns=columns)
+    if engine is None:
+        engine = 'pyarrow' if importlib.util.find_spec('pyarrow') else 'c'
+    return pd.read_csv(stem + '.csv', usecols=columns, engine=engine)
+
+
 class Target:
 
     def __init__(self, sample, i, fea_file, micron_factor=1/3.4): # Modified from the original by kudelalabs to parameterize micron_factor
@@ -96,7 +125,7 @@ class Sample:
 
         print(f'Processing {name}')
 
-        self.features = pd.read_csv(f'{feature_dir}/{name}_{ifcb}_fea_v{fea_v}.csv')
+        self.features = read_feature_table(f'{feature_dir}/{name}_{ifcb}_fea_v{fea_v}.csv', columns=PSD_FEATURE_COLUMNS) # Modified from the original by kudelalabs to read only the columns used
         self.metadata = self.read_metadata(roi_dir, name)
         self.targets = [Target(self, i, self.features, self.micron_factor) for i in range(len(self.features.Biovolume))]
         self.mL_analyzed = self.get_volume()
@@ -116,6 +145,39 @@ class Sample:
         self.grouped_major_axis_length_json = []
         self.grouped_minor_axis_length_json = []
 
+    # Modified from the original by kudelalabs to build a sample from a
+    # summary written during feature extraction (see psd_summary.py), without
+    # reading its feature, .hdr or .adc files
+    @classmethod
+    def from_summary(cls, summary, overall_bin):
+        self = cls.__new__(cls)
+        self.name = summary['name']
+        self.ifcb = summary['ifcb']
+        self.micron_factor = summary['micron_factor']
+        self.summary = {}
+        self.data = []
+        self.coeffs = {}
+        self.r_squared = {}
+        self.max_diff = 0
+        self.bin = overall_bin
+        delta = dt.datetime.strptime(self.name, 'D%Y%m%dT%H%M%S') - dt.datetime(1, 1, 1)
+        self.datenum = delta.total_seconds() / (24 * 60 * 60) + 367
+        self.features = None
+        self.metadata = {}
+        self.targets = []
+        self.mL_analyzed = summary['mL_analyzed']
+        self.capture_percent = summary['capture_percent']
+        self.humidity = summary['humidity']
+        self.bead_run = summary['bead_run']
+        self.counts = summary['counts']
+        self.grouped_equiv_diameter_json = []
+        self.grouped_major_axis_length_json = []
+        self.grouped_minor_axis_length_json = []
+        # The same arithmetic as histogram(), applied to the stored counts
+        self.psd = {num: (count / self.mL_analyzed) * 1000 if count and self.mL_analyzed else 0
+                    for num, count in enumerate(self.counts['equiv_diameter'])}
+        return self
+
     def to_JSON(self):
         return {
             "name": self.name,
@@ -217,6 +279,8 @@ class Sample:
 
         print(f'Graphing {self.name}')
 
+        from scipy.optimize import curve_fit # Modified from the original by kudelalabs to import on first use
+
         def power_curve(x, k, n):
             return k * (x ** n)
 
@@ -233,6 +297,7 @@ class Sample:
         if plot_folder: # Modified from the original by kudelalabs to add option to choose plot folder
             if not os.path.exists(plot_folder):
                 os.makedirs(plot_folder)
+            from matplotlib import pyplot as plt # Modified from the original by kudelalabs to import on first use
             fig, ax = plt.subplots()
             ax.set(xlabel="ESD [um]", ylabel="N'(D) [c/L⁻]")
             ax.set_ylim(bottom=-0.1 * maximum, top=1.1 * maximum)
@@ -276,10 +341,16 @@ class Sample:
 
 
 class Bin:
-    def __init__(self, feature_dir, hdr_dir, samples_path=None, micron_factor=1/3.4, fea_v=2, bins=None): # Modified from the original by kudelalabs to parameterize micron_factor and feature file version
+    def __init__(self, feature_dir, hdr_dir, samples_path=None, micron_factor=1/3.4, fea_v=2, bins=None, summaries=None): # Modified from the original by kudelalabs to parameterize micron_factor and feature file version, and to accept extraction-time summaries
         fileConvention = r'D\d\d\d\d\d\d\d\dT\d\d\d\d\d\d'
         regex = re.compile(fileConvention)
-        files = [(f.split('_')[0], f.split('_')[1]) for f in os.listdir(feature_dir) if regex.search(f)]
+        if summaries is not None: # Modified from the original by kudelalabs to accept extraction-time summaries
+            files = [(s['name'], s['ifcb']) for s in summaries]
+        else:
+            files = [(f.split('_')[0], f.split('_')[1]) for f in os.listdir(feature_dir) if regex.search(f)]
+            # Modified from the original by kudelalabs: a sample whose features
+            # are stored in more than one format is listed once
+            files = list(dict.fromkeys(files))
         
         if bins is not None:
             # bins is a list like ["D20251021T133007_IFCB134", "D20251021T140753_IFCB134"]
@@ -294,7 +365,12 @@ class Bin:
         self.micron_factor = micron_factor # Modified from the original by kudelalabs to parameterize micron_factor
 
         self.samples_loaded = bool(samples_path)
-        if self.samples_loaded:
+        if summaries is not None: # Modified from the original by kudelalabs to accept extraction-time summaries
+            # Histograms come with the summaries, so there is nothing to load
+            summaries = {(s['name'], s['ifcb']): s for s in summaries}
+            self.samples = [Sample.from_summary(summaries[f], self) for f in files]
+            self.samples_loaded = True
+        elif self.samples_loaded:
             sample_file = open(samples_path, 'rb')
             samples = json.load(sample_file)["samples"]
             self.samples = [
@@ -361,6 +437,145 @@ class Bin:
         print(files)
         print()
 
+    # Modified from the original by kudelalabs: the one-micron distribution
+    # and volume of every sample, as plot_PSD adds them to data, without
+    # fitting or plotting
+    def _distributions(self):
+        columns = [f'{i}um' for i in range(0, 200)]
+        rows = []
+        for sample in self.samples:
+            if not sample.psd:
+                sample.create_histograms()
+            rows.append([sample.mL_analyzed] + [sample.psd[i] for i in range(0, 200)])
+        return pd.DataFrame(rows, index=self.file_names, columns=['mL_analyzed'] + columns)
+
+    # Modified from the original by kudelalabs to aggregate size distributions
+    # by calendar period (pick_start above is an unfinished start on this)
+    def aggregate(self, period='month', start_fit=10, exclude=None):
+        '''Volume-weighted mean size distribution and power curve per calendar period.
+
+        period is 'day', 'week', 'month' or 'year' for consecutive periods, or
+        'month_of_year' or 'season' (DJF, MAM, JJA, SON) to pool the same
+        months of every year. Samples named in exclude (e.g. flagged ones) are
+        left out. The distributions are computed from the samples, as
+        plot_PSD computes the ones it adds to data, so plot_PSD need not be
+        run first.
+        '''
+        from scipy.optimize import curve_fit
+
+        periods = {'day': 'D', 'week': 'W', 'month': 'M', 'year': 'Y'}
+        if period not in periods and period not in ('month_of_year', 'season'):
+            raise ValueError(f"Unknown period: {period}")
+        columns = [f'{i}um' for i in range(0, 200)]
+        data = self._distributions()
+        if exclude is not None:
+            data = data.drop(index=list(exclude), errors='ignore')
+        if data.empty:
+            raise ValueError('No size distributions to aggregate')
+
+        datenums = pd.Series([s.datenum for s in self.samples], index=self.file_names)
+        # MATLAB datenum 719529 is 1970-01-01
+        times = pd.to_datetime(datenums.loc[data.index].to_numpy() - 719529, unit='D')
+        if period == 'month_of_year':
+            keys = times.month
+        elif period == 'season':
+            keys = pd.Categorical(np.array(['DJF', 'MAM', 'JJA', 'SON'])[(times.month % 12) // 3],
+                                  categories=['DJF', 'MAM', 'JJA', 'SON'])
+        else:
+            keys = times.to_period(periods[period]).astype(str)
+
+        # A sample's concentration times its volume is its count (per 1000),
+        # so summing those per period and dividing by the period's volume
+        # weights every sample by how much water it analysed
+        mL = data['mL_analyzed'].to_numpy(dtype=float)
+        weighted = pd.DataFrame(data[columns].to_numpy(dtype=float) * mL[:, None], columns=columns)
+        grouped = weighted.groupby(keys, observed=True)
+        volume = pd.Series(mL).groupby(keys, observed=True).sum()
+        result = grouped.sum().div(volume, axis=0)
+        result.insert(0, 'mL_analyzed', volume)
+        result.insert(0, 'n_samples', grouped.size())
+
+        def power_curve(x, k, n):
+            return k * (x ** n)
+
+        xdata = np.arange(200, dtype=float)[start_fit:]
+        fits = []
+        for ydata in result[columns].to_numpy()[:, start_fit:]:
+            try:
+                popt, _ = curve_fit(power_curve, xdata, ydata, p0=[80000, -0.8])
+                ss_res = np.sum((ydata - power_curve(xdata, *popt)) ** 2)
+                ss_tot = np.sum((ydata - np.mean(ydata)) ** 2)
+                fits.append((popt[0], popt[1], 1 - ss_res / ss_tot))
+            except (ValueError, RuntimeError, TypeError):
+                fits.append((0.0, 0.0, 0.0))
+        result[['a', 'k', 'R^2']] = pd.DataFrame(fits, index=result.index)
+        result.index = pd.Index(result.index.tolist(), name='period')
+        return result
+
+    # Modified from the original by kudelalabs to build histograms on any bin
+    # edges in one vectorized pass, and to return them compactly
+    def histograms(self, edges=None, feature='equiv_diameter', sparse=False, n_bins=50):
+        '''Concentration histograms (per L) of all samples on the given bin edges.
+
+        edges is None for the 200 one-micron bins of Bin.data, 'log' for
+        n_bins log-spaced bins from 1 to 200 um, or an increasing sequence of
+        edges in um. As in Sample.group, sizes at or above the last edge are
+        counted in the last bin; sizes below the first edge are not counted.
+
+        Returns a dict with 'samples' (names), 'edges' and either 'matrix'
+        (float32, one row per sample) or, when sparse, the occupied cells only
+        as 'sample' and 'bin' (int32 positions) and 'concentration' (float32).
+        '''
+        columns = {'equiv_diameter': 'EquivDiameter', 'major_axis_length': 'MajorAxisLength',
+                   'minor_axis_length': 'MinorAxisLength'}
+        if feature not in columns:
+            raise ValueError(f"Unknown feature: {feature}")
+        if edges is None:
+            edges = np.arange(201, dtype=float)
+        elif isinstance(edges, str):
+            if edges != 'log':
+                raise ValueError(f"Unknown edges: {edges}")
+            edges = np.geomspace(1, 200, int(n_bins) + 1)
+        edges = np.asarray(edges, dtype=float)
+        if edges.ndim != 1 or len(edges) < 2 or np.any(np.diff(edges) <= 0):
+            raise ValueError('edges must be an increasing sequence of at least two values')
+        default = len(edges) == 201 and np.array_equal(edges, np.arange(201))
+        n = len(edges) - 1
+
+        codes, weights = [], []
+        for position, sample in enumerate(self.samples):
+            per_mL = 1000 / sample.mL_analyzed if sample.mL_analyzed else 0
+            if sample.features is None:
+                # Built from a summary, which holds the one-micron counts only
+                if not default:
+                    raise ValueError(f'{sample.name} was built from a summary; only the default edges are available')
+                counts = np.asarray(sample.counts[feature], dtype=float)
+                occupied = np.flatnonzero(counts)
+                codes.append(position * n + occupied)
+                weights.append(counts[occupied] * per_mL)
+                continue
+            sizes = sample.features[columns[feature]].to_numpy(dtype=float) * sample.micron_factor
+            if default:
+                groups = np.minimum(np.floor(sizes), n - 1).astype(np.int64)
+            else:
+                groups = np.minimum(np.searchsorted(edges, sizes, side='right') - 1, n - 1)
+            groups = groups[(groups >= 0) & ~np.isnan(sizes)]
+            codes.append(position * n + groups)
+            weights.append(np.full(len(groups), per_mL))
+
+        codes = np.concatenate(codes) if codes else np.empty(0, dtype=np.int64)
+        weights = np.concatenate(weights) if weights else np.empty(0)
+        result = {'samples': list(self.file_names), 'edges': edges}
+        if sparse:
+            cells, inverse = np.unique(codes, return_inverse=True)
+            result['sample'] = (cells // n).astype(np.int32)
+            result['bin'] = (cells % n).astype(np.int32)
+            result['concentration'] = np.bincount(inverse, weights, minlength=len(cells)).astype(np.float32)
+        else:
+            matrix = np.bincount(codes.astype(np.int64), weights, minlength=len(self.samples) * n)
+            result['matrix'] = matrix.reshape(len(self.samples), n).astype(np.float32)
+        return result
+
     def plot_PSD(self, use_marker, plot_folder, start_fit): # Modified from the original by kudelalabs to add option to choose plot folder
         if not self.samples_loaded:
             for sample in self.samples:
@@ -430,7 +645,35 @@ class Bin:
     def get_fits(self):
         return self.fits.to_dict()
 
+    # Modified from the original by kudelalabs to hand results to R column by
+    # column: a dict of one typed NumPy array per column, led by the sample
+    # names, converts in bulk instead of element by element like to_dict()
+    @staticmethod
+    def _columns(frame, index='sample'):
+        columns = {index: np.asarray(frame.index, dtype=str)}
+        for name, values in frame.infer_objects().items():
+            if values.dtype == object:
+                try:
+                    values = pd.to_numeric(values)
+                except (ValueError, TypeError):
+                    values = values.astype(str)
+            columns[str(name)] = np.ascontiguousarray(values.to_numpy())
+        return columns
+
+    def get_data_columns(self):
+        return self._columns(self.data)
+
+    def get_fits_columns(self):
+        return self._columns(self.fits)
+
+    def get_flags_columns(self, r_sqr=0.5, **kwargs):
+        flags = self._flags(r_sqr, **kwargs)
+        return {'sample': np.asarray(flags['sample'], dtype=str), 'flag': np.asarray(flags['flag'], dtype=str)}
+
     def get_flags(self, r_sqr=0.5, **kwargs):
+        return self._flags(r_sqr, **kwargs).to_dict() # Modified from the original by kudelalabs to share _flags with get_flags_columns
+
+    def _flags(self, r_sqr=0.5, **kwargs):
         def flag(dataset, op, parameter, threshold, flag_name, priority, low_r_only):
             if low_r_only:
                 dataset = dataset[self.fits['R^2'] < r_sqr]
@@ -478,4 +721,4 @@ class Bin:
         flags = full_flags.sort_values('priority').drop_duplicates(subset=['sample']).sort_values(by=['sample'])
         flags = flags.drop('priority', axis=1)
 
-        return flags.to_dict()
+        return flags
@@ -0,0 +1,171 @@
+"""Per-bin particle size distribution summaries computed during extraction.
+
+``psd.Bin`` builds its size distributions from the feature CSVs and the raw
+``.hdr`` / ``.adc`` files, so a PSD run after feature extraction reads every
+bin a second time. When ``extract_slim_features.extract_features`` is given a
+``psd_directory``, each worker instead reduces the features it has just
+computed to the few numbers ``psd.Sample`` derives from them and writes them
+there as ``<lid>_psd.json``. ``psd.Bin(summaries=...)`` is then built from
+those files alone (see :func:`load_summaries`).
+
+A summary holds, per sample:
+
+  * ``name`` and ``ifcb``: the two halves of the lid, as ``psd.Bin`` splits a
+    feature file name,
+  * ``micron_factor``: the conversion the histograms were built with,
+  * ``n_rois``, ``trigger_count``, ``mL_analyzed``, ``capture_percent``,
+    ``humidity`` and ``bead_run``, derived as ``psd.Sample`` derives them,
+  * ``counts``: for each of ``equiv_diameter``, ``major_axis_length`` and
+    ``minor_axis_length``, the number of ROIs in each of the 200 one-micron
+    histogram bins.
+
+Counts rather than concentrations are stored so that ``psd.Sample`` can apply
+exactly its own arithmetic to them. Feature values are first rounded to the 10
+significant digits the feature CSV carries, so a value on a bin edge falls on
+the same side as when read back from the file. A ROI with a missing value
+(compute_features failed on it) is counted in ``n_rois`` but not binned:
+``psd.Sample`` cannot bin it either and stops with an error instead.
+
+Only numpy and the standard library are imported here, since this module runs
+inside the extraction workers.
+"""
+
+import json
+import os
+import re
+import uuid
+
+import numpy as np
+
+#: Feature columns the summary is built from (those ``psd.Target`` reads).
+SUMMARY_COLUMNS = ['Biovolume', 'EquivDiameter', 'MajorAxisLength',
+                   'MinorAxisLength']
+
+#: Histogram features, with the feature column each is measured from.
+HISTOGRAM_FEATURES = {
+    'equiv_diameter': 'EquivDiameter',
+    'major_axis_length': 'MajorAxisLength',
+    'minor_axis_length': 'MinorAxisLength',
+}
+
+#: Number of one-micron histogram bins; larger particles go in the last.
+N_BINS = 200
+
+#: Flow rate assumed by psd.Sample.get_volume, in mL per minute.
+FLOW_RATE = 0.25
+
+_LID = re.compile(r'D\d{8}T\d{6}')
+
+
+def summary_path(psd_directory, lid):
+    """Return the path of the PSD summary for ``lid``."""
+    return os.path.join(psd_directory, f"{lid}_psd.json")
+
+
+def parse_header(hdr):
+    """Parse the contents of an IFCB ``.hdr`` file (bytes or str) into
+    ``{key: [values]}``, as ``psd.Sample.read_metadata`` does: values are
+    split on commas and converted to floats where every one of them
+    parses."""
+    if isinstance(hdr, bytes):
+        hdr = hdr.decode('utf-8')
+    metadata = {}
+    for line in hdr.splitlines():
+        split = line.strip().split(': ')
+        if len(split) < 2:
+            continue
+        try:
+            metadata[split[0]] = [float(v) for v in split[1].split(',')]
+        except ValueError:
+            metadata[split[0]] = split[1].split(',')
+    return metadata
+
+
+def count_triggers(adc):
+    """Return the number of triggers in the contents of an IFCB ``.adc`` file
+    (bytes): its number of lines, as ``psd.Sample`` counts them."""
+    return adc.count(b'\n') + (1 if adc and not adc.endswith(b'\n') else 0)
+
+
+def _as_written(values):
+    # The feature CSV is written with float_format="%.10g"; reproduce that
+    # rounding so a summary bins exactly what psd.Sample reads back.
+    return np.array([float(f"{v:.10g}") for v in values], dtype=float)
+
+
+def summarize(lid, features, metadata, trigger_count, micron_factor=1/3.4):
+    """Reduce one bin's features to a PSD summary.
+
+    The header and trigger count are passed in rather than read here, so the
+    caller takes them from the reader it has the bin open in (see
+    ``read_metadata`` in ``ifcb_reader``), archives included.
+
+    Args:
+        lid (str): Bin lid, e.g. ``D20240423T115846_IFCB127``.
+        features: Mapping of feature column to a sequence with one value per
+            ROI (e.g. a pandas DataFrame), holding at least
+            ``SUMMARY_COLUMNS``.
+        metadata (dict): The bin's header, from :func:`parse_header`.
+        trigger_count (int): The bin's number of triggers, from
+            :func:`count_triggers`.
+        micron_factor (float): Microns per pixel.
+
+    Returns:
+        dict: The summary described in the module docstring.
+    """
+    name, _, ifcb = lid.partition('_')
+    n_rois = len(features[SUMMARY_COLUMNS[0]])
+
+    counts = {}
+    for feature, column in HISTOGRAM_FEATURES.items():
+        values = _as_written(features[column]) * micron_factor
+        values = values[~np.isnan(values)]
+        groups = np.minimum(np.floor(values), N_BINS - 1).astype(np.int64)
+        counts[feature] = np.bincount(groups, minlength=N_BINS).tolist()
+
+    looktime = metadata['runTime'][0] - metadata['inhibitTime'][0]
+    return {
+        "name": name,
+        "ifcb": ifcb,
+        "micron_factor": micron_factor,
+        "n_rois": n_rois,
+        "trigger_count": trigger_count,
+        "mL_analyzed": FLOW_RATE * looktime / 60,
+        "capture_percent": n_rois / trigger_count,
+        "humidity": float(metadata['humidity'][0]),
+        "bead_run": metadata.get('runType', ['NORMAL'])[0] == 'BEADS',
+        "counts": counts,
+    }
+
+
+def write_summary(path, summary):
+    """Write ``summary`` to ``path`` as JSON, atomically."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f)
+    os.replace(tmp_path, path)
+
+
+def load_summaries(psd_directory, bins=None):
+    """Read the PSD summaries in ``psd_directory``, in lid order.
+
+    Args:
+        psd_directory (str): Directory the summaries were written to.
+        bins (list, optional): Lids to restrict to.
+
+    Returns:
+        list[dict]: Summaries ready for ``psd.Bin(summaries=...)``.
+    """
+    if isinstance(bins, str):
+        bins = [bins]
+    wanted = set(bins) if bins is not None else None
+    summaries = []
+    for file_name in sorted(os.listdir(psd_directory)):
+        if not file_name.endswith('_psd.json') or not _LID.match(file_name):
+            continue
+        lid = file_name[:-len('_psd.json')]
+        if wanted is not None and lid not in wanted:
+            continue
+        with open(os.path.join(psd_directory, file_name)) as f:
+            summaries.append(json.load(f))
+    return summaries
@@ -1,30 +1,70 @@
+import collections
+import copy
+import hashlib
+import os
+import sys
+import threading
+import time
+
 import numpy as np
-import scipy.io
 
-def convert_data(x):
-    import numpy as np
+# scipy.io is imported where a file is parsed, so that importing this module,
+# and a read served from the cache, do not pay for it.
+
+def _cellstr_to_list(x):
+    """Flatten an object (cell) array to a list of strings, in C order.
+
+    astype(str) converts the whole array in one vectorized pass instead of
+    calling str() element by element. A cell holding a nested array cannot be
+    cast that way, so such arrays fall back to the element-wise conversion,
+    which gives the same strings for every cell the fast path accepts.
+    """
+    try:
+        return x.astype(str).ravel().tolist()
+    except (TypeError, ValueError):
+        return [str(item) for item in x.flat]
 
+def convert_data(x, promote_integers=True, zero_copy=False):
+    """
+    Converts values returned by scipy.io.loadmat to R-compatible structures.
+    
+    Parameters:
+      x: A value as returned by scipy.io.loadmat (with squeeze_me=True).
+      promote_integers (bool): If True (default), integer arrays are converted
+        to float64, as R.matlab reads all numbers as numeric. If False, they
+        keep their integer type; note that R cannot hold values beyond the
+        32-bit signed range in an integer.
+      zero_copy (bool): If True, numeric arrays are returned in Fortran
+        (column-major) order, the layout R uses, so reticulate can hand them
+        over without transposing; arrays are only copied when their layout or
+        type has to change. If False (default), integer arrays are always
+        copied and other arrays keep the layout loadmat returned.
+    
+    Returns:
+      The converted value.
+    """
     if isinstance(x, dict):
-        return {k: convert_data(v) for k, v in x.items()}
+        return {k: convert_data(v, promote_integers, zero_copy)
+                for k, v in x.items()}
 
     if isinstance(x, str):
         # Wrap plain strings in [[ ]] to mimic 1x1 character matrix in R
         return [[x]]
 
     if isinstance(x, np.ndarray):
-        if np.issubdtype(x.dtype, np.integer):
+        if x.dtype == np.object_:
+            return _cellstr_to_list(x)
+
+        if promote_integers and np.issubdtype(x.dtype, np.integer):
             # Convert integers to float (R.matlab reads all numbers as numeric)
-            x = x.astype(np.float64)
-            if x.ndim == 1:
-                x = x.reshape(-1, 1)  # Convert 1D array to column vector
-            return x
-        elif x.dtype == np.object_:
-            flat = [str(item) for item in x.flat]
-            return flat
-        else:
-            if x.ndim == 1:
-                x = x.reshape(-1, 1)  # Convert 1D numeric arrays to column vector
-            return x
+            x = x.astype(np.float64, order='F' if zero_copy else 'K')
+        elif zero_copy:
+            # A no-op for the Fortran-ordered arrays loadmat normally returns
+            x = np.asfortranarray(x)
+
+        if x.ndim == 1:
+            x = x.reshape(-1, 1)  # Convert 1D numeric arrays to column vector
+        return x
 
     if isinstance(x, list):
         def flatten(lst):
@@ -37,39 +77,1050 @@ def convert_data(x):
 
     return x
 
-def read_mat_file(file_path):
+def _normalize_variable_names(variable_names):
+    """Return ``variable_names`` as a list of names, or None for all variables.
+
+    reticulate converts a length-1 R character vector to a Python str, not a
+    list, and scipy would then match it character by character. An empty
+    selection is treated as "no selection" rather than "read nothing".
+    """
+    if variable_names is None:
+        return None
+    if isinstance(variable_names, str):
+        variable_names = [variable_names]
+    variable_names = [str(name) for name in variable_names]
+    return variable_names or None
+
+#: The signature an HDF5 file starts with. A MATLAB v7.3 file places it
+#: after a 512-byte text header.
+_HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+#: NumPy types of the MATLAB classes read from v7.3 files, used for the type
+#: of an empty array.
+_MATLAB_DTYPES = {
+    'double': np.float64, 'single': np.float32, 'logical': np.uint8,
+    'int8': np.int8, 'uint8': np.uint8, 'int16': np.int16,
+    'uint16': np.uint16, 'int32': np.int32, 'uint32': np.uint32,
+    'int64': np.int64, 'uint64': np.uint64, 'char': '<U1', 'cell': object,
+}
+
+_MATLAB_CLASSES = {np.dtype(dtype).type: name
+                   for name, dtype in _MATLAB_DTYPES.items()
+                   if name not in ('logical', 'char', 'cell')}
+
+def is_hdf5_mat(file_path):
+    """
+    Tells whether a .mat file is a MATLAB v7.3 (HDF5-based) file.
+    
+    scipy.io.loadmat reads the v4 - v7 formats but not v7.3, which MATLAB
+    writes for variables over 2 GB or when saving with -v7.3.
+    
+    Parameters:
+      file_path (str): Path to the .mat file.
+    
+    Returns:
+      bool: True for an HDF5-based file.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(512 + len(_HDF5_SIGNATURE))
+    return (head.startswith(_HDF5_SIGNATURE)
+            or head[512:] == _HDF5_SIGNATURE)
+
+def _open_hdf5(file_path):
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError(
+            f"{file_path} is a MATLAB v7.3 (HDF5) file, which needs the "
+            f"Python package h5py to be read; install it in the iRfcb "
+            f"environment, e.g. ifcb_py_install(packages = 'h5py')") from None
+    return h5py.File(file_path, 'r')
+
+def _h5_attr(obj, name):
+    value = obj.attrs.get(name)
+    if isinstance(value, bytes):
+        return value.decode('ascii')
+    if isinstance(value, np.ndarray) and value.size == 1:
+        return value.item()
+    return value
+
+def _h5_variables(h5file):
+    # '#refs#' holds the contents of cells and struct arrays, '#subsystem#'
+    # MATLAB's opaque objects; neither is a variable.
+    return [name for name in h5file.keys() if not name.startswith('#')]
+
+def _squeeze_element(array, matlab_class=None):
+    """Squeeze an array in MATLAB dimension order the way loadmat does with
+    squeeze_me=True: an empty array becomes a 1-D empty array, singleton
+    dimensions are dropped, and a 1x1 array becomes its element."""
+    if not array.size:
+        return np.array([], dtype=_MATLAB_DTYPES.get(matlab_class,
+                                                     array.dtype))
+    array = np.squeeze(array)
+    if not array.shape and (array.dtype.isbuiltin or array.dtype.kind == 'U'):
+        return array.item()
+    return array
+
+def _h5_char(data):
+    """Decode MATLAB char data (UTF-16 code units, MATLAB dimension order)."""
+    data = np.asarray(data, dtype=np.uint16)
+    if data.ndim == 2 and data.shape[0] == 1:
+        return data.tobytes().decode('utf-16-le')
+    # A char matrix is one string per row, as loadmat returns it.
+    rows = data.reshape(data.shape[0], -1)
+    return np.array([row.tobytes().decode('utf-16-le') for row in rows])
+
+def _h5_numeric(data):
+    if data.dtype.names and {'real', 'imag'} <= set(data.dtype.names):
+        return data['real'] + 1j * data['imag']
+    return data
+
+def _h5_dims(dataset):
+    # MATLAB writes column-major arrays as HDF5 row-major ones with the
+    # dimensions reversed.
+    return tuple(reversed(dataset.shape))
+
+def _h5_decode(h5file, obj):
+    """Decode one v7.3 variable, cell element or struct field to the value
+    loadmat would return for it (squeeze_me=True, struct_as_record=False)."""
+    import h5py
+
+    matlab_class = _h5_attr(obj, 'MATLAB_class')
+    if isinstance(obj, h5py.Group):
+        if matlab_class == 'struct' or matlab_class is None:
+            return _h5_struct(h5file, obj)
+        if _h5_attr(obj, 'MATLAB_sparse') is not None:
+            return _h5_sparse(obj, matlab_class)
+        raise ValueError(f"cannot read MATLAB class '{matlab_class}' "
+                         f"({obj.name}) from a v7.3 file")
+
+    if _h5_attr(obj, 'MATLAB_empty'):
+        dims = np.asarray(obj[()]).ravel()
+        return _squeeze_element(
+            np.empty(tuple(int(d) for d in dims) or (0,),
+                     dtype=_MATLAB_DTYPES.get(matlab_class, np.float64)),
+            matlab_class)
+    data = obj[()].T
+    if matlab_class == 'char':
+        return _h5_char(data) if data.size else _squeeze_element(
+            np.empty((0,), '<U1'), matlab_class)
+    if matlab_class == 'cell':
+        return _squeeze_element(_h5_dereference(h5file, data), matlab_class)
+    if matlab_class in (None, 'function_handle') or \
+            _h5_attr(obj, 'MATLAB_object_decode') is not None:
+        raise ValueError(f"cannot read MATLAB class '{matlab_class}' "
+                         f"({obj.name}) from a v7.3 file")
+    return _squeeze_element(np.asarray(_h5_numeric(data)), matlab_class)
+
+def _h5_dereference(h5file, refs):
+    """Decode an array of object references (a cell, or a field of a struct
+    array) into an object array of the same shape."""
+    out = np.empty(refs.shape, dtype=object)
+    for index, ref in np.ndenumerate(refs):
+        out[index] = _h5_decode(h5file, h5file[ref])
+    return out
+
+def _h5_struct(h5file, group):
+    from scipy.io.matlab import mat_struct
+
+    names = _h5_attr(group, 'MATLAB_fields')
+    if names is None:
+        fields = list(group.keys())
+    else:
+        fields = [b''.join(np.asarray(name).ravel()).decode('ascii')
+                  for name in names]
+    values = {}
+    shape = None
+    for field in fields:
+        member = group[field]
+        # In a struct array every field is an array of references, one per
+        # element; in a scalar struct each field holds its value directly.
+        if (_h5_attr(group, 'MATLAB_class') == 'struct'
+                and getattr(member, 'dtype', None) is not None
+                and member.dtype.kind == 'O'
+                and _h5_attr(member, 'MATLAB_class') is None):
+            values[field] = _h5_dereference(h5file, member[()].T)
+            shape = values[field].shape
+        else:
+            values[field] = _h5_decode(h5file, member)
+
+    def element(index=None):
+        item = mat_struct()
+        item._fieldnames = fields
+        for field in fields:
+            value = values[field]
+            setattr(item, field, value if index is None else value[index])
+        return item
+
+    if shape is None:
+        return element()
+    out = np.empty(shape, dtype=object)
+    for index in np.ndindex(shape):
+        out[index] = element(index)
+    return _squeeze_element(out)
+
+def _h5_sparse(group, matlab_class):
+    import scipy.sparse
+
+    n_rows = int(_h5_attr(group, 'MATLAB_sparse'))
+    jc = group['jc'][()].astype(np.int64)
+    ir = group['ir'][()].astype(np.int64) if 'ir' in group else \
+        np.zeros(0, np.int64)
+    if 'data' in group:
+        data = _h5_numeric(group['data'][()])
+    else:
+        data = np.zeros(len(ir), dtype=np.float64)
+    if matlab_class == 'logical':
+        data = data.astype(bool)
+    return scipy.sparse.csc_matrix((data, ir, jc),
+                                   shape=(n_rows, len(jc) - 1))
+
+def _read_hdf5(file_path, variable_names=None):
+    """Read a v7.3 file into the dict loadmat would return for a v5 one."""
+    with _open_hdf5(file_path) as h5file:
+        names = _h5_variables(h5file)
+        if variable_names is not None:
+            wanted = set(variable_names)
+            names = [name for name in names if name in wanted]
+        return {name: _h5_decode(h5file, h5file[name]) for name in names}
+
+def list_variables(file_path):
+    """
+    Lists the variables stored in a MATLAB .mat file without reading their data.
+    
+    Uses scipy.io.whosmat, which parses only the variable headers, so this is
+    cheap even for large classifier or feature files. A v7.3 file's variables
+    are listed from its HDF5 index, in name order.
+    
+    Parameters:
+      file_path (str): Path to the .mat file.
+    
+    Returns:
+      list: Variable names, in the order they are stored in the file.
+    """
+    if is_hdf5_mat(file_path):
+        with _open_hdf5(file_path) as h5file:
+            return _h5_variables(h5file)
+
+    import scipy.io
+
+    return [name for name, _, _ in scipy.io.whosmat(file_path)
+            if not name.startswith('__')]
+
+#: Default upper bound, in bytes, on the parsed data held in memory by the cache.
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+#: Files modified less than this long ago are identified by their content as
+#: well as their size and modification time: FAT records modification times
+#: to 2 seconds and some network filesystems to 1, so a file rewritten with
+#: the same size within that window can keep its modification time.
+_RACY_SECONDS = 2.0
+
+def _digest(file_path):
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 ** 2), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def _nbytes(data):
+    """Approximate the memory held by a converted read_mat_file result."""
+    total = 0
+    for value in data.values():
+        if isinstance(value, np.ndarray):
+            total += value.nbytes
+        elif isinstance(value, list):
+            total += sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+        else:
+            total += sys.getsizeof(value)
+    return total
+
+def _encode_npz(data):
+    """Encode a converted result as NPZ members, or return None if it cannot be.
+
+    Each member name carries a one-letter tag recording how to rebuild the
+    value: 'a' a numeric array, 'g' a numpy scalar, 'p' a Python number (a
+    squeezed 1x1 array), 'l' a list of strings and 's' a single string (the
+    [[x]] form). Anything else, such as a MATLAB
+    struct, is only cached in memory. MATLAB variable names cannot contain
+    ':', so the tag separator is unambiguous.
+    """
+    members = {}
+    for name, value in data.items():
+        if isinstance(value, np.ndarray) and value.dtype != np.object_:
+            members[f"a:{name}"] = value
+        elif isinstance(value, np.generic):
+            members[f"g:{name}"] = np.asarray(value)
+        elif isinstance(value, (bool, int, float, complex)):
+            members[f"p:{name}"] = np.asarray(value)
+        elif (isinstance(value, list) and len(value) == 1
+              and isinstance(value[0], list) and len(value[0]) == 1
+              and isinstance(value[0][0], str)):
+            members[f"s:{name}"] = np.asarray(value[0][0])
+        elif isinstance(value, list) and all(isinstance(v, str) for v in value):
+            encoded = np.asarray(value, dtype=str)
+            # A fixed-width string array drops trailing NULs; keep such
+            # strings out of the disk tier rather than alter them.
+            if encoded.tolist() != value:
+                return None
+            members[f"l:{name}"] = encoded
+        else:
+            return None
+    return members
+
+def _decode_npz(npz):
+    """Rebuild a converted result from the members written by _encode_npz."""
+    data = {}
+    for member in npz.files:
+        tag, name = member.split(':', 1)
+        value = npz[member]
+        if tag == 'a':
+            data[name] = value
+        elif tag == 'g':
+            data[name] = value[()]
+        elif tag == 'p':
+            data[name] = value.item()
+        elif tag == 's':
+            data[name] = [[str(value)]]
+        else:
+            data[name] = value.tolist()
+    return data
+
+def _shared(value):
+    """Return ``value`` as the cache shares it: dicts, lists and tuples are
+    copied, so each caller has containers of its own, while numeric arrays are
+    marked read-only and shared, not copied. Strings and numbers are immutable;
+    anything else (e.g. an object array) is deep-copied."""
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        value.setflags(write=False)
+        return value
+    if isinstance(value, dict):
+        return {name: _shared(item) for name, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_shared(item) for item in value)
+    if isinstance(value, (str, bytes, int, float, complex, bool, np.generic,
+                          type(None))):
+        return value
+    return copy.deepcopy(value)
+
+class _MatCache:
+    """Memoize parsed .mat files, keyed on the file's identity and the request.
+
+    Entries are keyed on (absolute path, size, modification time, inode,
+    variable selection, conversion options), so a file that is rewritten - as
+    the annotation editors do - is simply read again, and its stale entries
+    are dropped. A file modified within the last ``_RACY_SECONDS`` is also
+    keyed on a digest of its content, since a rewrite that soon may not have
+    changed its modification time. The memory tier is an LRU bounded by the total size of the parsed
+    data. An optional disk tier keeps parsed results as NPZ files in
+    ``cache_dir``, which survives the R session and is shared by every process
+    pointed at the same directory.
+
+    Results share their arrays with the cache, which marks them read-only, so
+    a hit copies only the small dicts and lists around them (see _shared): a
+    caller may edit those freely, but must copy an array before changing it.
+    All methods are thread-safe, so
+    read_mat_files can share the cache across its thread pool.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MAX_BYTES, cache_dir=None):
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self.configure(max_bytes, cache_dir)
+        self.clear()
+
+    def configure(self, max_bytes, cache_dir):
+        with self._lock:
+            self.max_bytes = max(0, int(max_bytes))
+            self.cache_dir = cache_dir
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            self._evict()
+
+    def key(self, file_path, variable_names, promote_integers, zero_copy):
+        st = os.stat(file_path)
+        selection = tuple(sorted(variable_names)) if variable_names else None
+        digest = None
+        if time.time_ns() - st.st_mtime_ns < _RACY_SECONDS * 1e9:
+            digest = _digest(file_path)
+        identity = (st.st_size, st.st_mtime_ns, st.st_ino, digest)
+        return (os.path.abspath(file_path), identity, selection,
+                bool(promote_integers), bool(zero_copy))
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.npz")
+
+    def _evict(self):
+        # Caller holds the lock.
+        while self._entries and self._bytes > self.max_bytes:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _shared(self._entries[key][0])
+
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                with np.load(path, allow_pickle=False) as npz:
+                    data = _decode_npz(npz)
+            except (OSError, ValueError, KeyError):
+                pass
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+                self.put(key, data, write_disk=False)
+                return data
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, data, write_disk=True):
+        size = _nbytes(data)
+
+        with self._lock:
+            # Drop entries for earlier versions of the same file.
+            for stale in [k for k in self._entries
+                          if k[0] == key[0] and k[1] != key[1]]:
+                self._bytes -= self._entries.pop(stale)[1]
+            if size <= self.max_bytes:
+                if key in self._entries:
+                    self._bytes -= self._entries.pop(key)[1]
+                # Containers of the cache's own; the arrays, now read-only,
+                # are shared with the caller's ``data``.
+                self._entries[key] = (_shared(data), size)
+                self._bytes += size
+                self._evict()
+
+        if write_disk and self.cache_dir:
+            members = _encode_npz(data)
+            if members is not None:
+                path = self._disk_path(key)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                try:
+                    # Write under a temporary name and move it into place, so
+                    # a concurrent reader never sees a partial file.
+                    with open(tmp_path, 'wb') as f:
+                        np.savez(f, **members)
+                    os.replace(tmp_path, path)
+                except OSError:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+
+    def clear(self, disk=False):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.disk_hits = 0
+            self.evictions = 0
+            if disk and self.cache_dir and os.path.isdir(self.cache_dir):
+                for name in os.listdir(self.cache_dir):
+                    if name.endswith('.npz'):
+                        os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, 'cache_dir': self.cache_dir}
+
+_cache = _MatCache()
+
+def configure_cache(max_bytes=DEFAULT_CACHE_MAX_BYTES, cache_dir=None):
+    """
+    Configures the cache used by read_mat_file.
+    
+    Parameters:
+      max_bytes (int): Upper bound on the parsed data held in memory. Least
+        recently used entries are evicted beyond it; 0 disables the memory
+        tier.
+      cache_dir (str, optional): Directory for the on-disk NPZ tier. If None
+        (default), parsed results are only cached in memory.
+    """
+    _cache.configure(max_bytes, cache_dir)
+
+def clear_cache(disk=False):
+    """
+    Empties the in-memory cache and resets its statistics.
+    
+    Parameters:
+      disk (bool): Also delete the NPZ files in the configured cache_dir.
+    """
+    _cache.clear(disk=disk)
+
+def cache_stats():
+    """
+    Returns cache statistics.
+    
+    Returns:
+      dict: 'hits' (memory), 'disk_hits', 'misses', 'evictions', and the
+      current 'entries', 'bytes', 'max_bytes' and 'cache_dir'.
+    """
+    return _cache.stats()
+
+def read_mat_file(file_path, variable_names=None, promote_integers=True,
+                  zero_copy=False, use_cache=True):
     """
     Reads a MATLAB .mat file and returns a dictionary with the contents.
     The function flattens MATLAB cell arrays to Python lists of strings
     for compatibility with the R version using R.matlab::readMat.
     
+    MATLAB v7.3 (HDF5) files, which scipy cannot read, are read through h5py
+    into the same structures loadmat gives for the older formats, so they
+    are converted identically. To read part of a large variable, see
+    open_mat_file.
+    
     Parameters:
       file_path (str): Path to the .mat file.
+      variable_names (str or list, optional): Variables to read. Only these
+        are decompressed and converted; variables that are not present in the
+        file are silently absent from the result. If None (default), every
+        variable is read.
+      promote_integers (bool): Convert integer arrays to float64 (default);
+        see convert_data.
+      zero_copy (bool): Return numeric arrays Fortran-ordered, copying only
+        where needed; see convert_data.
+      use_cache (bool): If True (default), return a cached result when the file
+        is unchanged since it was last read with the same arguments, and cache
+        this one; see configure_cache. The arrays of a cached result are
+        read-only and shared between calls (copy one to edit it); its dicts
+        and lists are the caller's own.
     
     Returns:
       dict: A dictionary with MATLAB variables.
     """
-    # Load the .mat file; squeeze_me=True reduces singleton dimensions
-    # and struct_as_record=False avoids converting MATLAB structs to record arrays.
-    data = scipy.io.loadmat(file_path, squeeze_me=True, struct_as_record=False)
+    variable_names = _normalize_variable_names(variable_names)
+
+    key = None
+    if use_cache and (_cache.max_bytes > 0 or _cache.cache_dir):
+        key = _cache.key(file_path, variable_names, promote_integers, zero_copy)
+        cached = _cache.get(key)
+        if cached is not None:
+            return cached
+
+    if is_hdf5_mat(file_path):
+        data = _read_hdf5(file_path, variable_names)
+    else:
+        import scipy.io
+
+        # Load the .mat file; squeeze_me=True reduces singleton dimensions
+        # and struct_as_record=False avoids converting MATLAB structs to record arrays.
+        # variable_names lets scipy skip over (and never inflate) unselected variables.
+        data = scipy.io.loadmat(file_path, squeeze_me=True, struct_as_record=False,
+                                variable_names=variable_names)
     
     # Remove MATLAB metadata keys (those starting with '__')
-    data = {key: value for key, value in data.items() if not key.startswith('__')}
+    data = {name: value for name, value in data.items() if not name.startswith('__')}
     
     # Convert list-like items to a list of strings (if applicable)
-    data = {key: convert_data(value) for key, value in data.items()}
+    data = {name: convert_data(value, promote_integers, zero_copy)
+            for name, value in data.items()}
+
+    if key is not None:
+        _cache.put(key, data)
     
     return data
 
-# R Function Wrapper for use with reticulate
-def r_read_mat_file(file_path):
+def _index_array(key, length):
+    """Return ``key``, a sequence of indices into an axis of ``length``, as
+    a non-negative int64 array, raising IndexError when one is out of range."""
+    index = np.asarray(key, dtype=np.int64).ravel()
+    index = np.where(index < 0, index + length, index)
+    if index.size and (index.min() < 0 or index.max() >= length):
+        raise IndexError(f"index out of range for an axis of length {length}")
+    return index
+
+def _select(source, key, shape, transposed):
+    """Index ``source`` with ``key``, given in MATLAB dimension order.
+
+    Each item of ``key`` is an int, a slice or a sequence of indices. An
+    HDF5 dataset (``transposed``) is stored with its dimensions reversed and
+    can read only one strictly increasing list of indices per selection, so
+    any other list is read as the range it spans and picked from in memory.
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+    if len(key) > len(shape):
+        raise IndexError(f"too many indices for a {len(shape)}-D variable")
+    key = key + (slice(None),) * (len(shape) - len(key))
+
+    selection = []
+    picks = []  # (axis of the result, positions) applied after reading
+    kept = 0
+    listed = False
+    for k, length in zip(key, shape):
+        if isinstance(k, slice):
+            selection.append(k)
+        elif np.ndim(k) == 0:
+            selection.append(int(_index_array(k, length)[0]))
+            continue  # an int drops its axis
+        else:
+            index = _index_array(k, length)
+            if not transposed or (not listed and index.size
+                                  and np.all(np.diff(index) > 0)):
+                selection.append(index if not transposed else index.tolist())
+                listed = listed or transposed
+            else:
+                start = int(index.min()) if index.size else 0
+                stop = int(index.max()) + 1 if index.size else 0
+                selection.append(slice(start, stop))
+                picks.append((kept, index - start))
+        kept += 1
+
+    if transposed:
+        data = np.asarray(source[tuple(reversed(selection))]).T
+    else:
+        # One axis at a time: numpy would pair up several index lists
+        # rather than take their cross product.
+        data = np.asarray(source)
+        axis = 0
+        for k in selection:
+            if isinstance(k, int):
+                data = np.take(data, k, axis=axis)
+                continue
+            if isinstance(k, slice):
+                data = data[(slice(None),) * axis + (k,)]
+            else:
+                data = np.take(data, k, axis=axis)
+            axis += 1
+    for axis, positions in picks:
+        data = np.take(data, positions, axis=axis)
+    return data
+
+class MatVariable:
+    """One variable of an open MAT file, read on demand.
+
+    Index it in MATLAB dimension order, with Python's 0-based ints, slices
+    or lists of indices, e.g. ``var[0:100, :]`` for the first 100 rows or
+    ``var[:, [0, 4]]`` for two columns; the result is converted as by
+    convert_data. In a v7.3 file only the selected part of a numeric,
+    logical or cell variable is read from disk. :meth:`read` returns the
+    whole variable as read_mat_file would.
+
+    Attributes:
+      name (str): Variable name.
+      shape (tuple): Dimensions, as MATLAB reports them (never squeezed).
+      matlab_class (str): MATLAB class, e.g. 'double' or 'cell'.
+    """
+
+    def __init__(self, mat_file, name, source, shape, matlab_class):
+        self._file = mat_file
+        self.name = name
+        self._source = source
+        self.shape = shape
+        self.matlab_class = matlab_class
+
+    def __repr__(self):
+        dims = 'x'.join(str(d) for d in self.shape)
+        return f"<MatVariable {self.name}: {dims} {self.matlab_class}>"
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if self.matlab_class in ('char', 'struct') or \
+                self.matlab_class.startswith('sparse'):
+            raise TypeError(f"{self.name} is a {self.matlab_class} variable; "
+                            f"use read() to read it whole")
+        transposed = self._file.hdf5
+        data = _select(self._source, key, self.shape, transposed)
+        if self.matlab_class == 'cell':
+            if transposed:
+                data = _h5_dereference(self._file._h5, data)
+            else:
+                # Older-format cells are read unsqueezed; squeeze each
+                # element as loadmat would have.
+                data = np.asarray(data, dtype=object)
+                for index, item in np.ndenumerate(data):
+                    if isinstance(item, np.ndarray):
+                        data[index] = _squeeze_element(item)
+            return _cellstr_to_list(np.asarray(data, dtype=object))
+        return convert_data(np.asarray(_h5_numeric(data) if transposed
+                                       else data),
+                            self._file.promote_integers,
+                            self._file.zero_copy)
+
+    def read(self):
+        """Return the whole variable, converted as by read_mat_file."""
+        if not self._file.hdf5:
+            return read_mat_file(self._file.file_path, [self.name],
+                                 self._file.promote_integers,
+                                 self._file.zero_copy)[self.name]
+        return convert_data(_h5_decode(self._file._h5, self._source),
+                            self._file.promote_integers, self._file.zero_copy)
+
+class MatFile:
+    """A MAT file opened for lazy, partial reads; see open_mat_file."""
+
+    def __init__(self, file_path, promote_integers=True, zero_copy=False):
+        self.file_path = file_path
+        self.promote_integers = promote_integers
+        self.zero_copy = zero_copy
+        self.hdf5 = is_hdf5_mat(file_path)
+        self._h5 = _open_hdf5(file_path) if self.hdf5 else None
+        self._variables = {}
+
+    def variables(self):
+        """Variable names in the file."""
+        if self.hdf5:
+            return _h5_variables(self._h5)
+        return list_variables(self.file_path)
+
+    def __contains__(self, name):
+        return name in self.variables()
+
+    def __getitem__(self, name):
+        if name in self._variables:
+            return self._variables[name]
+        if self.hdf5:
+            if name not in _h5_variables(self._h5):
+                raise KeyError(name)
+            obj = self._h5[name]
+            matlab_class = _h5_attr(obj, 'MATLAB_class') or 'struct'
+            if _h5_attr(obj, 'MATLAB_sparse') is not None:
+                matlab_class = f"sparse {matlab_class}"
+                shape = (int(_h5_attr(obj, 'MATLAB_sparse')),
+                         len(obj['jc']) - 1)
+            elif _h5_attr(obj, 'MATLAB_empty'):
+                shape = tuple(int(d) for d in np.asarray(obj[()]).ravel())
+            elif hasattr(obj, 'shape'):
+                shape = _h5_dims(obj)
+            else:
+                shape = (1, 1)
+            source = obj
+        else:
+            # scipy cannot read part of a variable, so an older-format
+            # variable is read whole, unsqueezed, the first time it is used.
+            import scipy.io
+
+            values = scipy.io.loadmat(self.file_path, squeeze_me=False,
+                                      struct_as_record=False,
+                                      variable_names=[name])
+            if name not in values:
+                raise KeyError(name)
+            source = values[name]
+            shape = tuple(np.shape(source))
+            if hasattr(source, 'tocsc'):
+                matlab_class = 'sparse'
+            elif source.dtype.kind == 'U':
+                matlab_class = 'char'
+            elif source.dtype == object:
+                matlab_class = ('struct' if source.size and
+                                hasattr(source.flat[0], '_fieldnames')
+                                else 'cell')
+            else:
+                matlab_class = _MATLAB_CLASSES.get(source.dtype.type,
+                                                   source.dtype.name)
+        variable = MatVariable(self, name, source, shape, matlab_class)
+        self._variables[name] = variable
+        return variable
+
+    def close(self):
+        """Close the file."""
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
+        self._variables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def open_mat_file(file_path, promote_integers=True, zero_copy=False):
+    """
+    Opens a MATLAB .mat file for reading variables lazily, or in part.
+    
+    ``open_mat_file(path)["TBscores"][0:100, :]`` reads the first 100 rows of
+    a classifier's score matrix. In a v7.3 (HDF5) file only those rows are
+    read from disk, which makes rows or columns of a multi-gigabyte variable
+    cheap to reach; in an older-format file, which scipy can only read whole,
+    each variable is read in full the first time it is indexed. Use as a
+    context manager, or call close().
+    
+    Parameters:
+      file_path (str): Path to the .mat file.
+      promote_integers (bool): Convert integer arrays to float64 (default);
+        see convert_data.
+      zero_copy (bool): Return numeric arrays Fortran-ordered; see
+        convert_data.
+    
+    Returns:
+      MatFile: Indexed by variable name, giving a MatVariable.
+    """
+    return MatFile(file_path, promote_integers, zero_copy)
+
+def _read_one(file_path, variable_names, promote_integers, zero_copy):
+    """Read one file for read_mat_files, reporting a failure instead of raising.
+
+    A module-level function so it can be pickled to a process pool worker.
+    """
+    try:
+        return file_path, read_mat_file(file_path, variable_names,
+                                        promote_integers, zero_copy), None
+    except Exception as e:  # noqa: BLE001 - one bad file must not abort the batch
+        return file_path, None, str(e)
+
+def _as_columns(name, value):
+    """Split a converted variable into (column name, 1-D values) pairs.
+
+    A single-column variable keeps its own name; the columns of a matrix are
+    numbered from 1, as in R.
+    """
+    if isinstance(value, list):
+        return [(name, np.asarray(value, dtype=object))]
+    value = np.asarray(value)
+    if value.ndim == 0:
+        return [(name, value.reshape(1))]
+    if value.ndim == 1 or value.shape[1] == 1:
+        return [(name, value.reshape(-1))]
+    return [(f"{name}_{j + 1}", value[:, j]) for j in range(value.shape[1])]
+
+def _stack(data):
+    """Stack per-file variables into one long-format table with a file column.
+
+    Each file contributes one row per element of its variables, so every
+    variable read from a file must have the same number of rows. A file whose
+    variables disagree is reported as an error rather than stacked.
+
+    Returns:
+      tuple: (pandas.DataFrame, dict of file path -> error message).
+    """
+    import pandas as pd
+
+    frames = []
+    errors = {}
+    for file_path, variables in data.items():
+        columns = {}
+        for name, value in variables.items():
+            columns.update(_as_columns(name, value))
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            errors[file_path] = ("variables have different numbers of rows "
+                                 "and cannot be stacked")
+            continue
+        n_rows = lengths.pop() if lengths else 0
+        frame = pd.DataFrame(columns)
+        frame.insert(0, 'file', [file_path] * n_rows)
+        frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame({'file': []}), errors
+    return pd.concat(frames, ignore_index=True), errors
+
+def read_mat_files(file_paths, variable_names=None, num_workers=1,
+                   use_threads=True, stack=False, promote_integers=True,
+                   zero_copy=False):
+    """
+    Reads many MATLAB .mat files in one call, optionally in parallel.
+    
+    Reading a batch in one call lets a caller in R pay the reticulate call
+    and conversion overhead once rather than once per file. Files are read
+    with read_mat_file, so each file's variables are converted exactly as a
+    single read would convert them. No iRfcb R function calls this yet; it
+    is meant for scripts that use the module directly.
+    
+    Parameters:
+      file_paths (str or list): Paths to the .mat files. Each path may be
+        given once; a repeated path raises ValueError.
+      variable_names (str or list, optional): Variables to read from each
+        file. If None (default), every variable is read.
+      num_workers (int): Number of pool workers. 1 (default) reads the files
+        sequentially.
+      use_threads (bool): If True (default), read in a thread pool. scipy
+        inflates compressed variables with zlib, which releases the GIL, so
+        threads parallelise the bulk of the work and are safe when Python is
+        embedded in R. If False, a process pool is used; this relies on fork
+        and should only be used on Linux or from standalone Python.
+      stack (bool): If False (default), return the variables of each file
+        keyed by file path. If True, stack them into one long-format table
+        with a leading 'file' column (see _stack); select variables of equal
+        length, e.g. the columns of 'classlist', with variable_names.
+      promote_integers (bool): Convert integer arrays to float64 (default);
+        see convert_data.
+      zero_copy (bool): Return numeric arrays Fortran-ordered, copying only
+        where needed; see convert_data.
+    
+    Returns:
+      dict: 'data', either a dict of file path -> variables (in the order of
+      file_paths) or, with stack=True, a pandas.DataFrame; and 'errors', a dict
+      of file path -> message for the files that could not be read.
+    """
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+    file_paths = [str(path) for path in file_paths]
+    # Results are keyed by path, so a repeated path would silently collapse
+    # into one entry.
+    duplicated = sorted(path for path, count
+                        in collections.Counter(file_paths).items()
+                        if count > 1)
+    if duplicated:
+        raise ValueError(f"file paths given more than once: "
+                         f"{', '.join(duplicated)}")
+    variable_names = _normalize_variable_names(variable_names)
+    num_workers = max(1, int(num_workers))
+
+    tasks = [(path, variable_names, promote_integers, zero_copy)
+             for path in file_paths]
+    if num_workers <= 1 or len(file_paths) <= 1:
+        results = [_read_one(*task) for task in tasks]
+    else:
+        if use_threads:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(processes=num_workers)
+        else:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes=num_workers)
+        try:
+            # starmap preserves the input order of the files.
+            results = pool.starmap(_read_one, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    data = {}
+    errors = {}
+    for file_path, variables, error in results:
+        if error is None:
+            data[file_path] = variables
+        else:
+            errors[file_path] = error
+
+    if stack:
+        data, stack_errors = _stack(data)
+        errors.update(stack_errors)
+
+    return {'data': data, 'errors': errors}
+
+# R Function Wrappers for use with reticulate
+def _r_indices(indices):
+    """Convert R's 1-based indices (a number or a vector) to 0-based ones, or
+    None to None (the whole axis). Raises ValueError for an index below 1:
+    converted, 0 and R's negative (exclusion) indices would count from the
+    end of the axis and silently select other rows."""
+    if indices is None:
+        return slice(None)
+    indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+    if (indices < 1).any():
+        raise ValueError("rows and columns must be positive 1-based indices, "
+                         f"got {indices[indices < 1].tolist()}")
+    return (indices - 1).tolist()
+
+def r_read_mat_file(file_path, variable_names=None, promote_integers=True,
+                    zero_copy=False, rows=None, columns=None):
     """
     Wrapper function to be used in R via reticulate.
     
     Parameters:
       file_path (str): Path to the .mat file.
+      variable_names (str or list, optional): Variables to read. If None
+        (default), every variable is read.
+      promote_integers (bool): Convert integer arrays to float64 (default).
+      zero_copy (bool): Return numeric arrays Fortran-ordered, copying only
+        where needed.
+      rows, columns (int or list, optional): 1-based rows and columns to read
+        from each numeric, logical or cell variable, through open_mat_file;
+        other variables are read whole. None (default) reads every row or
+        column. A variable without all of the requested rows or columns, such
+        as the 1 x N class list of a manual file, is read whole too, unless it
+        is named in variable_names, in which case IndexError is raised.
     
     Returns:
       dict: A dictionary with MATLAB variables, converted for R compatibility.
     """
-    return read_mat_file(file_path)
+    if rows is None and columns is None:
+        return read_mat_file(file_path, variable_names=variable_names,
+                             promote_integers=promote_integers,
+                             zero_copy=zero_copy)
+
+    variable_names = _normalize_variable_names(variable_names)
+    key = (_r_indices(rows), _r_indices(columns))
+
+    def covers(shape):
+        return all(isinstance(k, slice) or max(k, default=-1) < length
+                   for k, length in zip(key, shape))
+
+    data = {}
+    with open_mat_file(file_path, promote_integers, zero_copy) as mat:
+        for name in mat.variables():
+            if variable_names is not None and name not in variable_names:
+                continue
+            variable = mat[name]
+            sliceable = len(variable.shape) == 2 and \
+                variable.matlab_class not in ('char', 'struct') and \
+                not variable.matlab_class.startswith('sparse')
+            if sliceable and (variable_names is not None
+                              or covers(variable.shape)):
+                try:
+                    data[name] = variable[key]
+                except IndexError as e:
+                    raise IndexError(f"{name}: {e}") from None
+            else:
+                data[name] = variable.read()
+    return data
+
+def r_list_variables(file_path):
+    """
+    Wrapper function to be used in R via reticulate.
+    
+    Parameters:
+      file_path (str): Path to the .mat file.
+    
+    Returns:
+      list: Variable names stored in the .mat file.
+    """
+    return list_variables(file_path)
+
+def r_read_mat_files(file_paths, variable_names=None, num_workers=1,
+                     use_threads=True, stack=False, promote_integers=True,
+                     zero_copy=False):
+    """
+    Wrapper function to be used in R via reticulate.
+    
+    Parameters:
+      file_paths (str or list): Paths to the .mat files.
+      variable_names (str or list, optional): Variables to read from each file.
+      num_workers (int): Number of pool workers. reticulate passes R numbers
+        as floats, so this is coerced to int.
+      use_threads (bool): Use a thread pool (default) rather than processes.
+      stack (bool): Stack the variables into one long-format table.
+      promote_integers (bool): Convert integer arrays to float64 (default).
+      zero_copy (bool): Return numeric arrays Fortran-ordered, copying only
+        where needed.
+    
+    Returns:
+      dict: 'data' and 'errors', as returned by read_mat_files.
+    """
+    return read_mat_files(file_paths, variable_names=variable_names,
+                          num_workers=num_workers, use_threads=use_threads,
+                          stack=stack, promote_integers=promote_integers,
+                          zero_copy=zero_copy)
+
+def r_clear_cache(disk=False):
+    """
+    Wrapper function to be used in R via reticulate.
+    
+    Parameters:
+      disk (bool): Also delete the on-disk NPZ tier.
+    """
+    clear_cache(disk=disk)
+
+def r_cache_stats():
+    """
+    Wrapper function to be used in R via reticulate.
+    
+    Returns:
+      dict: Cache statistics; see cache_stats.
+    """
+    return cache_stats()
@@ -0,0 +1,325 @@
+"""Live metrics for long-running extractions, in OpenMetrics text or JSON.
+
+A multi-hour ``extract_features`` or ``watch_features`` run otherwise reports
+only its progress callback and a final count. With ``metrics`` set, the
+:class:`ParallelExtractor` behind the run keeps a :class:`RunMetrics` up to
+date as bins finish and publishes it every ``interval`` seconds, so standard
+monitoring tools (Prometheus, node_exporter's textfile collector, a Grafana
+agent, or ``curl``) can watch throughput and catch stalls.
+
+``metrics`` selects where the metrics go:
+
+  * a file path: the metrics are rewritten there atomically every
+    ``interval`` seconds and once more when the run ends, as OpenMetrics
+    text, or as JSON if the path ends in ``.json``;
+  * a port number: they are served as OpenMetrics text over HTTP on
+    ``127.0.0.1`` at that port (any path, e.g. ``/metrics``) for as long
+    as the extractor runs.
+
+Metrics exported (all prefixed ``irfcb_``):
+
+  * ``bins_total{status}`` - bins finished, by status (processed, skipped,
+    error);
+  * ``rois_total`` - ROIs in processed bins;
+  * ``bins_submitted_total`` - bins handed to the extractor;
+  * ``bins_pending`` / ``bins_in_flight`` - bins waiting for a worker, and
+    bins running;
+  * ``workers_limit`` - bins that may run at once (moves with
+    ``num_workers="auto"``);
+  * ``rois_per_second`` - throughput over the last ``RATE_WINDOW`` seconds;
+  * ``bin_duration_seconds`` - a histogram of each processed bin's wall
+    time, and ``bin_duration_quantile_seconds`` a summary of its median,
+    90th and 99th percentiles over the last ``QUANTILE_WINDOW`` bins;
+  * ``worker_rss_bytes`` - the largest resident memory a worker reported
+    over the rate window, and ``process_rss_bytes`` that of the process
+    running the extractor;
+  * ``start_time_seconds`` and ``last_bin_timestamp_seconds`` - Unix times
+    the run started and a bin last finished. A run has stalled when the
+    latter stops moving while ``bins_in_flight`` is non-zero.
+"""
+
+import bisect
+import collections
+import json
+import os
+import threading
+import time
+import uuid
+
+from worker_control import current_rss
+
+#: Upper bounds (seconds) of the ``bin_duration_seconds`` histogram buckets.
+DURATION_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800)
+
+#: Quantiles of bin wall time reported in ``bin_duration_quantile_seconds``.
+QUANTILES = (0.5, 0.9, 0.99)
+
+#: Number of recent bins the quantiles are computed over.
+QUANTILE_WINDOW = 1000
+
+#: Seconds of finished bins ``rois_per_second`` and ``worker_rss_bytes``
+#: are computed over.
+RATE_WINDOW = 60
+
+#: Content type of the OpenMetrics text format.
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+STATUSES = ("processed", "skipped", "error")
+
+
+def _quantile(ordered, q):
+    # Nearest-rank quantile of an ascending list.
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class RunMetrics:
+    """Counters, gauges and bin-time distributions of one extraction run.
+
+    :meth:`observe` records each finished bin and :meth:`update_queue` the
+    state of the queue; :meth:`snapshot`, :meth:`render` and
+    :meth:`render_json` read them back. All are safe to call from different
+    threads (the HTTP server reads while the run writes).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.start_time = time.time()
+        self._bins = dict.fromkeys(STATUSES, 0)
+        self._rois = 0
+        self._submitted = 0
+        self._pending = 0
+        self._in_flight = 0
+        self._limit = None
+        self._last_bin = None
+        self._bucket_counts = [0] * len(DURATION_BUCKETS)
+        self._duration_count = 0
+        self._duration_sum = 0.0
+        self._durations = collections.deque(maxlen=QUANTILE_WINDOW)
+        self._recent = collections.deque()  # (time, n_rois, rss_bytes)
+
+    def submitted(self, n=1):
+        """Count ``n`` bins handed to the extractor."""
+        with self._lock:
+            self._submitted += n
+
+    def observe(self, result):
+        """Record a finished bin's result dict (see
+        ``extract_slim_features._process_bin_measured``)."""
+        now = time.time()
+        status = result.get("status", "error")
+        with self._lock:
+            self._bins[status] = self._bins.get(status, 0) + 1
+            self._last_bin = now
+            if status != "processed":
+                return
+            n_rois = result.get("n_rois") or 0
+            self._rois += n_rois
+            self._recent.append((now, n_rois, result.get("rss_bytes")))
+            wall = result.get("wall_seconds")
+            if wall is not None:
+                bucket = bisect.bisect_left(DURATION_BUCKETS, wall)
+                if bucket < len(DURATION_BUCKETS):
+                    self._bucket_counts[bucket] += 1
+                self._duration_count += 1
+                self._duration_sum += wall
+                self._durations.append(wall)
+
+    def update_queue(self, pending, in_flight, limit=None):
+        """Record the bins waiting for a worker, those running, and how many
+        may run at once."""
+        with self._lock:
+            self._pending = pending
+            self._in_flight = in_flight
+            self._limit = limit
+
+    def snapshot(self):
+        """Return the current metrics as a dict (the JSON export)."""
+        now = time.time()
+        with self._lock:
+            while self._recent and self._recent[0][0] < now - RATE_WINDOW:
+                self._recent.popleft()
+            window = min(RATE_WINDOW, max(now - self.start_time, 1e-9))
+            rss = [r for _, _, r in self._recent if r is not None]
+            ordered = sorted(self._durations)
+            cumulative, buckets = 0, {}
+            for bound, count in zip(DURATION_BUCKETS, self._bucket_counts):
+                cumulative += count
+                buckets[bound] = cumulative
+            return {
+                "time": now,
+                "start_time_seconds": self.start_time,
+                "last_bin_timestamp_seconds": self._last_bin,
+                "bins_total": dict(self._bins),
+                "rois_total": self._rois,
+                "bins_submitted_total": self._submitted,
+                "bins_pending": self._pending,
+                "bins_in_flight": self._in_flight,
+                "workers_limit": self._limit,
+                "rois_per_second": sum(n for _, n, _ in self._recent) / window,
+                "bin_duration_seconds": {
+                    "buckets": buckets,
+                    "count": self._duration_count,
+                    "sum": self._duration_sum,
+                },
+                "bin_duration_quantile_seconds": {
+                    q: _quantile(ordered, q) if ordered else None
+                    for q in QUANTILES},
+                "worker_rss_bytes": max(rss) if rss else None,
+                "process_rss_bytes": current_rss(),
+            }
+
+    def render_json(self):
+        """Return the metrics as a JSON document."""
+        return json.dumps(self.snapshot(), indent=2)
+
+    def render(self):
+        """Return the metrics in the OpenMetrics text format."""
+        s = self.snapshot()
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# TYPE irfcb_{name} {kind}")
+            lines.append(f"# HELP irfcb_{name} {help_text}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                label_text = "{" + label_text + "}" if label_text else ""
+                lines.append(f"irfcb_{name}{suffix}{label_text} "
+                             f"{_number(value)}")
+
+        family("bins", "counter", "Bins finished, by status.",
+               [("_total", [("status", k)], v)
+                for k, v in s["bins_total"].items()])
+        family("rois", "counter", "ROIs in processed bins.",
+               [("_total", [], s["rois_total"])])
+        family("bins_submitted", "counter", "Bins handed to the extractor.",
+               [("_total", [], s["bins_submitted_total"])])
+        family("bins_pending", "gauge", "Bins waiting for a worker.",
+               [("", [], s["bins_pending"])])
+        family("bins_in_flight", "gauge", "Bins being processed.",
+               [("", [], s["bins_in_flight"])])
+        if s["workers_limit"] is not None:
+            family("workers_limit", "gauge", "Bins that may run at once.",
+                   [("", [], s["workers_limit"])])
+        family("rois_per_second", "gauge",
+               f"ROIs processed per second over the last {RATE_WINDOW} s.",
+               [("", [], s["rois_per_second"])])
+
+        duration = s["bin_duration_seconds"]
+        family("bin_duration_seconds", "histogram",
+               "Wall time of each processed bin.",
+               [("_bucket", [("le", float(bound))], count)
+                for bound, count in duration["buckets"].items()]
+               + [("_bucket", [("le", "+Inf")], duration["count"]),
+                  ("_count", [], duration["count"]),
+                  ("_sum", [], duration["sum"])])
+        family("bin_duration_quantile_seconds", "summary",
+               f"Wall time of the last {QUANTILE_WINDOW} processed bins.",
+               [("", [("quantile", q)], v)
+                for q, v in s["bin_duration_quantile_seconds"].items()]
+               + [("_count", [], min(duration["count"], QUANTILE_WINDOW))])
+
+        if s["worker_rss_bytes"] is not None:
+            family("worker_rss_bytes", "gauge",
+                   f"Largest worker resident memory over the last "
+                   f"{RATE_WINDOW} s.", [("", [], s["worker_rss_bytes"])])
+        if s["process_rss_bytes"] is not None:
+            family("process_rss_bytes", "gauge",
+                   "Resident memory of the process running the extractor.",
+                   [("", [], s["process_rss_bytes"])])
+        family("start_time_seconds", "gauge", "Unix time the run started.",
+               [("", [], s["start_time_seconds"])])
+        if s["last_bin_timestamp_seconds"] is not None:
+            family("last_bin_timestamp_seconds", "gauge",
+                   "Unix time a bin last finished.",
+                   [("", [], s["last_bin_timestamp_seconds"])])
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Publish a :class:`RunMetrics` to a file or a localhost HTTP port.
+
+    Args:
+        target (str or int): A file path, rewritten by :meth:`maybe_write`
+            every ``interval`` seconds (JSON if it ends in ``.json``,
+            otherwise OpenMetrics text), or a port to serve OpenMetrics text
+            on at ``127.0.0.1``. A string of digits is taken as a port.
+        metrics (RunMetrics, optional): The metrics to publish; a new one
+            by default.
+        interval (float): Seconds between file writes.
+    """
+
+    def __init__(self, target, metrics=None, interval=15):
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.interval = interval
+        self.path = None
+        self.port = None
+        self._server = None
+        self._next_write = 0.0
+        if isinstance(target, float) and target.is_integer():
+            target = int(target)  # an R number arrives as a float
+        if isinstance(target, int) or str(target).isdigit():
+            self._serve(int(target))
+        else:
+            self.path = str(target)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    def _serve(self, port):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # scrapes would otherwise be printed to stderr
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever,
+                         name="irfcb-metrics", daemon=True).start()
+
+    def write(self):
+        """Write the metrics file now (no-op when serving over HTTP)."""
+        if self.path is None:
+            return
+        text = (self.metrics.render_json() if self.path.endswith('.json')
+                else self.metrics.render())
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+
+    def maybe_write(self):
+        """Write the metrics file if ``interval`` seconds have passed since
+        the last write."""
+        now = time.monotonic()
+        if self.path is not None and now >= self._next_write:
+            self._next_write = now + self.interval
+            self.write()
+
+    def close(self):
+        """Write the final metrics file, or stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        else:
+            self.write()
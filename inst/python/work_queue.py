@@ -0,0 +1,239 @@
+"""Shared-filesystem work queue for spreading bins across compute nodes.
+
+Several machines that mount the same data archive can cooperate on one
+extraction run without a scheduler service: each node claims bins from a queue
+directory on the shared mount, processes them with its local pool, and records
+them as done. ``extract_slim_features.extract_features`` uses this when given a
+``queue_directory``.
+
+The queue is plain files, because file locking (and so SQLite) is unreliable on
+the network filesystems such archives live on, whereas exclusive file creation
+is atomic on them:
+
+  * ``claims/<lid>.<n>.lease`` - the bin's lease of generation ``n``, created
+    with ``O_CREAT | O_EXCL`` by the node that claims the bin, so exactly one
+    claim of each generation succeeds. The newest generation is the lease in
+    force; its modification time is a heartbeat the owner refreshes while the
+    bin is in flight.
+  * ``done/<lid>.json`` - the bin's result dict, written once it has been
+    processed. A done bin is not claimed again, unless the queue is opened
+    with ``overwrite`` (see below).
+  * ``failed/<lid>.<n>.json`` - the result dict of the bin's ``n``-th failed
+    attempt. A failed bin's lease is released, so the bin is retried, by any
+    node, until it has failed ``max_attempts`` times in this run; it is then
+    given up. A failure may be transient (a filesystem hiccup, a worker
+    killed for memory), so failures are never recorded as done: only those
+    made since the node started count towards its limit, and a later run
+    tries the bin again.
+
+A lease whose heartbeat is older than ``lease_timeout`` belongs to a node that
+has crashed or hung. Any node may reclaim the bin by creating the next
+generation's lease. The stale lease is never moved or removed, so a node that
+saw it go stale cannot displace a lease another node has just taken: the
+generation it tries to create already exists, and its claim fails. Releasing a
+lease resets its heartbeat to zero, which lets the next claim take over at
+once. Node clocks are compared against file modification times, so keep them
+synchronised (NTP) and keep ``lease_timeout`` well above any skew.
+
+A queue opened with ``overwrite`` ignores the done markers left by earlier
+runs (those older than its start), so the bins are processed again. Start
+the nodes of such a run together: a bin another node has finished before
+this one started may be done a second time.
+
+If a node was merely stalled past its lease, two nodes can end up processing
+the same bin: the stalled node only learns at its next heartbeat that the bin
+was reclaimed. That is harmless: outputs are written under a temporary name and
+moved into place (see ``_process_bin``), so a bin's files are always a single
+complete write, never a mixture or a partial file.
+"""
+
+import json
+import os
+import socket
+import time
+import uuid
+
+
+class SharedWorkQueue:
+    """A lease-based work queue kept in a directory on a shared filesystem.
+
+    Args:
+        queue_directory (str): Directory on the shared mount. Created if it
+            does not exist; every node of a run must use the same one.
+        node_id (str, optional): Name recorded in this node's leases; must be
+            unique among the running nodes. Defaults to
+            ``<hostname>-<pid>-<random suffix>``.
+        lease_timeout (float): Seconds without a heartbeat after which a lease
+            is considered abandoned and may be reclaimed.
+        max_attempts (int): Failed attempts, by any node since this one
+            started, after which a bin is given up.
+        overwrite (bool): Ignore done markers written before this node
+            started, so an earlier run's bins are processed again.
+    """
+
+    def __init__(self, queue_directory, node_id=None, lease_timeout=600,
+                 max_attempts=3, overwrite=False):
+        self.node_id = node_id or (
+            f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max(1, int(max_attempts))
+        self.overwrite = overwrite
+        self.started = time.time()
+        self._claims = os.path.join(queue_directory, "claims")
+        self._done = os.path.join(queue_directory, "done")
+        self._failed = os.path.join(queue_directory, "failed")
+        for directory in (self._claims, self._done, self._failed):
+            os.makedirs(directory, exist_ok=True)
+        self.held = {}  # lid -> generation of this node's lease
+
+    def _lease_path(self, lid, generation):
+        return os.path.join(self._claims, f"{lid}.{generation}.lease")
+
+    def _done_path(self, lid):
+        return os.path.join(self._done, f"{lid}.json")
+
+    def _failure_path(self, lid, attempt):
+        return os.path.join(self._failed, f"{lid}.{attempt}.json")
+
+    def is_done(self, lid):
+        try:
+            mtime = os.stat(self._done_path(lid)).st_mtime
+        except FileNotFoundError:
+            return False
+        return not self.overwrite or mtime >= self.started
+
+    def _failures(self, lid):
+        """Return the number of ``lid``'s failure records and how many of
+        them were written since this node started."""
+        attempt = recent = 0
+        while True:
+            try:
+                st = os.stat(self._failure_path(lid, attempt))
+            except FileNotFoundError:
+                return attempt, recent
+            attempt += 1
+            recent += st.st_mtime >= self.started
+
+    def is_given_up(self, lid):
+        """Return True if ``lid`` has failed ``max_attempts`` times since this
+        node started."""
+        return self._failures(lid)[1] >= self.max_attempts
+
+    def is_settled(self, lid):
+        """Return True if ``lid`` needs no more work: done or given up."""
+        return self.is_done(lid) or self.is_given_up(lid)
+
+    def _latest(self, lid):
+        """Return the newest lease generation of ``lid`` and its heartbeat
+        (modification time), or (-1, None) if the bin was never claimed."""
+        generation = -1
+        heartbeat = None
+        while True:
+            try:
+                st = os.stat(self._lease_path(lid, generation + 1))
+            except FileNotFoundError:
+                return generation, heartbeat
+            generation += 1
+            heartbeat = st.st_mtime
+
+    def _create_lease(self, lid, generation):
+        try:
+            fd = os.open(self._lease_path(lid, generation),
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"node": self.node_id, "claimed": time.time()}, f)
+        return True
+
+    def _superseded(self, lid, generation):
+        # A stalled node's bin may have been reclaimed under a newer lease.
+        return os.path.exists(self._lease_path(lid, generation + 1))
+
+    def claim(self, lid):
+        """Try to claim ``lid``; return True if this node now holds it."""
+        if self.is_settled(lid):
+            return False
+        generation, heartbeat = self._latest(lid)
+        if heartbeat is not None and \
+                time.time() - heartbeat < self.lease_timeout:
+            return False
+        # Fails if another node has claimed (or reclaimed) the bin since.
+        generation += 1
+        if not self._create_lease(lid, generation):
+            return False
+        self.held[lid] = generation
+        # The bin may have been completed between the first check and the
+        # claim; give it back rather than processing it twice.
+        if self.is_done(lid):
+            self.release(lid)
+            return False
+        return True
+
+    def heartbeat(self):
+        """Refresh the leases of every bin this node holds."""
+        for lid, generation in list(self.held.items()):
+            if self._superseded(lid, generation):
+                # Reclaimed by another node after we stalled; it now owns it.
+                del self.held[lid]
+                continue
+            try:
+                os.utime(self._lease_path(lid, generation))
+            except FileNotFoundError:
+                del self.held[lid]
+
+    def complete(self, lid, result):
+        """Record ``lid`` as done with its result dict and drop its leases."""
+        path = self._done_path(lid)
+        tmp_path = f"{path}.{self.node_id}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(dict(result, node=self.node_id), f)
+        os.replace(tmp_path, path)
+        generation = self.held.pop(lid, None)
+        if generation is None or self._superseded(lid, generation):
+            return
+        # Newest first, so a node scanning the generations meanwhile sees an
+        # unbroken run of them; any lease it then creates is for a done bin,
+        # which its claim gives back.
+        for old in range(generation, -1, -1):
+            try:
+                os.remove(self._lease_path(lid, old))
+            except FileNotFoundError:
+                pass
+
+    def fail(self, lid, result):
+        """Record a failed attempt at ``lid`` and release its lease, so the
+        bin can be retried. Return True if it has now failed ``max_attempts``
+        times since this node started and is given up."""
+        record = dict(result, node=self.node_id)
+        attempt, _ = self._failures(lid)
+        while True:
+            try:
+                fd = os.open(self._failure_path(lid, attempt),
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                attempt += 1  # another node's failure was recorded first
+                continue
+            with os.fdopen(fd, 'w') as f:
+                json.dump(record, f)
+            break
+        self.release(lid)
+        return self.is_given_up(lid)
+
+    def release(self, lid):
+        """Give up the lease on ``lid`` without marking it done."""
+        generation = self.held.pop(lid, None)
+        if generation is None or self._superseded(lid, generation):
+            return
+        try:
+            # A zero heartbeat is stale to every node, so the next claim
+            # takes the bin over at once.
+            os.utime(self._lease_path(lid, generation), (0, 0))
+        except FileNotFoundError:
+            pass
+
+    def release_all(self):
+        """Give up every lease this node holds, e.g. when interrupted, so other
+        nodes can take the bins over at once instead of after a timeout."""
+        for lid in list(self.held):
+            self.release(lid)
@@ -0,0 +1,337 @@
+"""Adaptive control of how many bins an extraction keeps in flight.
+
+Two controls live here. :class:`WorkerController` adjusts the number of bins
+in flight for throughput, and :class:`MemoryBudget` holds bins back while the
+memory those in flight are expected to need would exceed a budget. Both are
+used by ``extract_slim_features.ParallelExtractor`` and can be combined.
+
+``extract_slim_features.ParallelExtractor`` normally hands every bin to its
+pool at once, so the pool size fixes the concurrency. With
+``num_workers="auto"`` the pool is started at its upper bound and a
+:class:`WorkerController` decides how many bins may run at a time, adjusting
+it from the measurements each finished bin reports (see
+``extract_slim_features._process_bin_measured``): its CPU time, wall time, ROI
+count and the worker's resident memory.
+
+The controller works in windows of finished bins. After each window it
+compares throughput (ROIs per second) with the previous window's and, in
+order of precedence:
+
+  * shrinks by one when free memory has fallen below what one more worker
+    would need, so a run of bloom bins does not drive the host into swap;
+  * shrinks by one, and stops growing past that point, when the last step up
+    made throughput fall (more workers were fighting over cores or storage);
+  * grows by one while throughput holds up, up to the number of cores when
+    bins are CPU-bound, or up to ``max_workers`` when they spend most of their
+    time waiting on I/O (CPU time under half of wall time), e.g. on NFS.
+
+A ceiling set by a fall in throughput is raised again after ten windows
+without a change, so a controller that backed off during a burst of large
+bins probes upwards again once they have passed. Every change is recorded in
+``decisions`` and passed to ``log`` if one is given.
+
+A :class:`MemoryBudget` estimates a bin's peak memory from the size of its
+``.roi`` and ``.adc`` files, which grow with the number and size of its
+images, and refines the estimate from the peaks workers report.
+"""
+
+import collections
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+#: Relative fall in throughput treated as a real change rather than noise.
+TOLERANCE = 0.05
+
+#: Windows without a change after which a lowered ceiling is raised again.
+REPROBE_WINDOWS = 10
+
+#: Fraction of wall time spent on CPU below which bins count as I/O-bound.
+IO_BOUND_UTILIZATION = 0.5
+
+
+def current_rss():
+    """Return this process's resident set size in bytes, or None where it
+    cannot be determined.
+
+    Read from /proc on Linux. Elsewhere the peak RSS reported by
+    ``resource.getrusage`` is the closest available measure; on Windows,
+    which has neither, None is returned.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on other platforms.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def in_worker_process():
+    """Return True in a process started by ``multiprocessing`` (a process
+    pool's worker), False in the process that started it (R's, when run from
+    R), where :func:`reset_peak_rss` must not be used."""
+    return multiprocessing.parent_process() is not None
+
+
+def reset_peak_rss():
+    """Reset this process's peak RSS so :func:`peak_rss` measures from now.
+
+    Linux only (``/proc/self/clear_refs``); returns False where the peak
+    cannot be reset, in which case :func:`peak_rss` should not be used.
+    The reset applies to the whole process, and also clears the referenced
+    bits of its pages, so call it only in a worker process of one's own (see
+    :func:`in_worker_process`): never in a thread, nor in the calling
+    process.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """Return this process's peak RSS (VmHWM) in bytes, or None outside
+    Linux."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def available_memory():
+    """Return the memory available to new work in bytes (MemAvailable), or
+    None where it cannot be determined (outside Linux)."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class WorkerController:
+    """Decide how many bins to keep in flight from the bins that finish.
+
+    Args:
+        min_workers (int): Lower bound on bins in flight.
+        max_workers (int, optional): Upper bound on bins in flight, which is
+            also the pool size. Defaults to the number of cores.
+        shared_memory (bool): True when workers are threads of one process,
+            so a reported RSS covers every worker rather than one.
+        log (callable, optional): Called with each decision record.
+        min_window (int): Fewest finished bins a decision is based on.
+    """
+
+    def __init__(self, min_workers=1, max_workers=None, shared_memory=False,
+                 log=None, min_window=4):
+        cores = os.cpu_count() or 1
+        self.cores = cores
+        self.max_workers = max(1, int(max_workers or cores))
+        self.min_workers = min(max(1, int(min_workers)), self.max_workers)
+        self.limit = max(self.min_workers, min(self.max_workers, cores // 2))
+        self.shared_memory = shared_memory
+        self.min_window = max(1, int(min_window))
+        self.decisions = []
+        self._log = log
+        self._ceiling = self.max_workers
+        self._window = []
+        self._window_start = time.monotonic()
+        self._last_throughput = None
+        self._last_step = 0
+        self._holds = 0
+
+    def observe(self, result):
+        """Record a finished bin's result dict. Results without measurements
+        (skipped bins, or errors before the bin was read) are ignored."""
+        if result.get("status") == "processed" and "wall_seconds" in result:
+            self._window.append(result)
+
+    def update(self):
+        """Re-evaluate the limit once a full window of bins has finished.
+
+        Returns:
+            int: the number of bins that may now be in flight.
+        """
+        if len(self._window) < max(self.limit, self.min_window):
+            return self.limit
+
+        elapsed = max(time.monotonic() - self._window_start, 1e-9)
+        rois = sum(r.get("n_rois", 1) for r in self._window)
+        wall = sum(r["wall_seconds"] for r in self._window)
+        cpu = sum(r["cpu_seconds"] for r in self._window)
+        rss = max((r.get("rss_bytes") or 0) for r in self._window)
+        throughput = rois / elapsed
+        utilization = cpu / wall if wall > 0 else 1.0
+        per_worker = rss / self.limit if self.shared_memory else rss
+        available = available_memory()
+
+        step, reason = self._choose(throughput, utilization, per_worker,
+                                    available)
+        if step:
+            record = {
+                "time": time.time(),
+                "previous": self.limit,
+                "limit": self.limit + step,
+                "reason": reason,
+                "rois_per_second": throughput,
+                "cpu_utilization": utilization,
+                "worker_rss_bytes": per_worker,
+                "available_bytes": available,
+            }
+            self.limit += step
+            self.decisions.append(record)
+            if self._log is not None:
+                self._log(record)
+
+        self._last_throughput = throughput
+        self._last_step = step
+        self._window = []
+        self._window_start = time.monotonic()
+        return self.limit
+
+    def _choose(self, throughput, utilization, per_worker, available):
+        if self._last_step == 0:
+            self._holds += 1
+            if self._holds >= REPROBE_WINDOWS and self._ceiling < self.max_workers:
+                self._ceiling += 1
+                self._holds = 0
+        else:
+            self._holds = 0
+
+        can_shrink = self.limit > self.min_workers
+        if available is not None and per_worker and available < per_worker:
+            if can_shrink:
+                self._ceiling = self.limit - 1
+                return -1, (f"memory: {available} bytes free, less than the "
+                            f"{per_worker} a worker uses")
+            return 0, ""
+
+        if (self._last_step > 0 and self._last_throughput is not None
+                and throughput < self._last_throughput * (1 - TOLERANCE)):
+            if can_shrink:
+                self._ceiling = self.limit - 1
+                return -1, (f"throughput fell from {self._last_throughput:.1f} "
+                            f"to {throughput:.1f} ROIs/s after growing")
+            return 0, ""
+
+        io_bound = utilization < IO_BOUND_UTILIZATION
+        cap = self._ceiling if io_bound else min(self._ceiling, self.cores)
+        fits = (available is None or not per_worker
+                or available >= 2 * per_worker)
+        if self.limit < cap and fits:
+            if io_bound:
+                return 1, (f"I/O-bound: CPU busy {utilization:.0%} of wall "
+                           f"time")
+            return 1, (f"CPU-bound with cores free: {self.limit} of "
+                       f"{self.cores} in use")
+        return 0, ""
+
+
+_SIZE = re.compile(r'^\s*([0-9.]+)\s*([kmgt]?)i?b?\s*$', re.IGNORECASE)
+
+
+def parse_bytes(value):
+    """Convert a size such as ``8e9``, ``"512M"`` or ``"16GiB"`` to bytes.
+
+    Suffixes are binary (``"1K"`` is 1024 bytes). Raises ValueError for an
+    unrecognised size.
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = _SIZE.match(str(value))
+    if not match:
+        raise ValueError(f"not a memory size: {value!r}")
+    number, unit = match.groups()
+    power = 'kmgt'.index(unit.lower()) + 1 if unit else 0
+    return int(float(number) * 1024 ** power)
+
+
+class MemoryBudget:
+    """Admit bins only while their estimated memory fits a budget.
+
+    A bin's estimate is :attr:`factor` times the combined size of its
+    ``.roi`` and ``.adc`` files, never less than ``minimum``.
+    ``_process_bin`` holds all of a bin's images in memory at once, so its
+    peak grows with the ``.roi``; the ``.adc`` stands in for the number of
+    ROIs, each adding a feature row and a blob. The factor starts at a
+    conservative ``initial_factor`` and is replaced, once bins have reported
+    their peaks (:meth:`observe`), by the largest factor among the last
+    ``history`` observations times ``margin``.
+
+    Args:
+        budget (int or str): Memory the bins in flight may use together, in
+            bytes or as a size string (see :func:`parse_bytes`). This is on
+            top of each worker's baseline memory.
+        initial_factor (float): Estimate per byte of raw data before any bin
+            has been measured.
+        minimum (int): Smallest estimate for any bin, in bytes.
+        margin (float): Multiplier applied to the learned factor.
+        history (int): Number of recent observations the factor is taken
+            from.
+    """
+
+    def __init__(self, budget, initial_factor=4.0, minimum=16 * 1024 ** 2,
+                 margin=1.25, history=50):
+        self.budget = parse_bytes(budget)
+        if self.budget <= 0:
+            raise ValueError("memory_budget must be positive")
+        self.initial_factor = initial_factor
+        self.minimum = minimum
+        self.margin = margin
+        self._factors = collections.deque(maxlen=history)
+        self._in_flight = {}
+
+    @property
+    def factor(self):
+        """Current estimate of peak bytes per byte of raw data."""
+        if not self._factors:
+            return self.initial_factor
+        return max(self._factors) * self.margin
+
+    @property
+    def in_flight(self):
+        """Sum of the estimates of the bins currently admitted, in bytes."""
+        return sum(self._in_flight.values())
+
+    def estimate(self, raw_bytes):
+        """Estimated peak memory of a bin with ``raw_bytes`` of raw data."""
+        return max(self.minimum, int(self.factor * raw_bytes))
+
+    def admit(self, lid, raw_bytes):
+        """Admit ``lid`` if its estimate fits the remaining budget, and
+        return whether it was admitted. A bin is always admitted when none
+        is in flight, so one larger than the whole budget still runs (on its
+        own) rather than blocking the run."""
+        need = self.estimate(raw_bytes)
+        if self._in_flight and self.in_flight + need > self.budget:
+            return False
+        self._in_flight[lid] = need
+        return True
+
+    def release(self, lid):
+        """Return ``lid``'s share of the budget once it has finished."""
+        self._in_flight.pop(lid, None)
+
+    def observe(self, raw_bytes, peak_bytes):
+        """Learn from a bin that used ``peak_bytes`` above its worker's
+        baseline for ``raw_bytes`` of raw data. Only meaningful for worker
+        processes: threads share one peak, so ParallelExtractor does not
+        call this under a thread pool."""
+        if raw_bytes and peak_bytes is not None and peak_bytes > 0:
+            self._factors.append(peak_bytes / raw_bytes)